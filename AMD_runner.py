@@ -1,17 +1,19 @@
 import os
 import sys
 import subprocess
-from Benchmarks.AMD import RCCLBandwidth as RCCL
-from Benchmarks.AMD import FlashAttention as FA
-from Benchmarks.AMD import HBMBandwidth as HBM
-from Benchmarks.AMD import TransferBench as TB
-from Benchmarks.AMD import GEMMHipblasLt as GEMM
-from Benchmarks.AMD import FIO
 from Infra import tools
-from Benchmarks.AMD import LLMBenchmark as llmb
+from Infra import container_pool
+from Infra import telemetry
+from Infra import tracing
+from Infra import manifest
+from Infra import registry
 
 current = os.getcwd()
 tools.create_dir("Outputs")
+# the benchmarks are imported only when they are selected, see Infra/registry.py
+tests = registry.Registry("amd")
+# containers are shared between the tests of this run and removed when it exits
+container_pool.pool.configure("config.json")
 
 def get_system_specs():
     file = open("Outputs/system_specs.txt", "w")
@@ -36,78 +38,95 @@ def get_system_specs():
     file.close()
     return "ND_MI300X_v5"
 
-def run_TransferBench():
-    test = TB.TransferBench("config.json", current, machine_name)
-    test.build()
-    test.run()
-
-def run_GEMMHipBLASLt():
+@tests.benchmark("gemm", "GEMMHipBLASLt", "Benchmarks.AMD.GEMMHipblasLt", requires=["docker"], usage=[
+    ("ROCBLAS GEMM", "gemm"), ("hipBLASLt GEMM soak", "gemm soak"), ("Run on every GPU at once", "hbm pergpu, fa pergpu"),
+])
+def run_GEMMHipBLASLt(GEMM):
     test = GEMM.GEMMHipBLASLt("config.json", current, machine_name)
-    test.create_container()
+    if not test.create_container():
+        return
+    if "soak" in arguments:
+        test.run_soak()
+    else:
+        test.run()
+
+@tests.benchmark("rccl", "RCCLBandwidth", "Benchmarks.AMD.RCCLBandwidth", requires=["docker", "numpy"], usage=[
+    ("RCCL Bandwidth", "rccl"), ("RCCL across the nodes of the hostfile", "rccl multinode, rccl bisect"),
+])
+def run_RCCLBandwidth(RCCL):
+    test = RCCL.RCCLBandwidth("config.json", current, machine_name)
+    if not test.create_container():
+        return
     test.build()
-    test.run()
+    if "multinode" in arguments:
+        test.run_multinode()
+    elif "bisect" in arguments:
+        test.run_bisect()
+    else:
+        test.run()
+
+@tests.benchmark("hbm", "HBMBandwidth", "Benchmarks.AMD.HBMBandwidth", usage=[("HBMBandwidth", "hbm")])
+def run_HBMBandwidth(HBM):
+    test = HBM.HBMBandwidth("config.json", current, machine_name)
+    test.build()
+    if "pergpu" in arguments:
+        test.run_pergpu()
+    else:
+        test.run()
 
-def run_RCCLBandwidth():
-    test = RCCL.RCCLBandwidth("config.json", current, machine_name)
-    test.create_container()
+@tests.benchmark("transfer", "TransferBench", "Benchmarks.AMD.TransferBench", usage=[("Transferbench", "transfer")])
+def run_TransferBench(TB):
+    test = TB.TransferBench("config.json", current, machine_name)
     test.build()
     test.run()
 
-def run_FlashAttention():
+@tests.benchmark("fa", "FlashAttention", "Benchmarks.AMD.FlashAttention", requires=["docker"], usage=[("Flash Attention", "fa")])
+def run_FlashAttention(FA):
     test = FA.FlashAttention(current, machine_name)
-    test.run()
+    if "pergpu" in arguments:
+        test.run_pergpu()
+    else:
+        test.run()
     os.chdir(current)
 
-def run_FIO():
+@tests.benchmark("fio", "FIO", "Benchmarks.AMD.FIO", usage=[
+    ("FIO Tests", "fio"), ("FIO quick profile", "fio quick"), ("FIO NVMe device scaling", "fio scaling"),
+])
+def run_FIO(FIO):
     test = FIO.FIO(current, machine_name)
-    test.run()
-
-def run_HBMBandwidth():
-    test = HBM.HBMBandwidth("config.json", current, machine_name)
-    test.build()
-    test.run()
-
-def run_LLMBenchmark():
+    profile = "quick" if "quick" in arguments else "full"
+    if "scaling" in arguments:
+        test.run_scaling(profile)
+    else:
+        test.run(profile)
+
+@tests.benchmark("llm", "LLMBenchmark", "Benchmarks.AMD.LLMBenchmark", requires=["docker"], usage=[("LLM Inference Workloads", "llm")])
+def run_LLMBenchmark(llmb):
     test = llmb.LLMBenchmark("config.json", current, machine_name)
-    test.create_container()
+    if not test.create_container():
+        return
     test.run()
 
-machine_name = get_system_specs()
 arguments = []
-match = False
 for arg in sys.argv:
     arguments.append(arg.lower())
+if "--import-only" in arguments:
+    tests.import_only(arguments)
+    sys.exit(0)
 
-if ("gemm" in arguments):
-    match = True
-    run_GEMMHipBLASLt()
-
-if ("rccl" in arguments):
-    match = True
-    run_RCCLBandwidth()
-
-if ("hbm" in arguments):
-    match = True
-    run_HBMBandwidth()
-
-if ("transfer" in arguments):
-    match = True
-    run_TransferBench()
-
-if ("fa" in arguments):
-    match = True
-    run_FlashAttention()
-
-if ("fio" in arguments):
-    match = True
-    run_FIO()
+machine_name = get_system_specs()
+# GPU and CPU telemetry is sampled in the background while each test runs
+telemetry.monitor.configure("config.json", machine_name, "amd")
+# spans of every test, benchmark method, build step, subprocess and sleep, written to Outputs/Trace_<hostname>.json at exit
+tracing.tracer.configure("config.json", machine_name)
+# a new run manifest, or the arguments of the run to resume with --resume <run id>
+arguments = manifest.runs.configure(arguments, machine_name)
 
-if ("llm" in arguments):
-    match = True
-    run_LLMBenchmark()
+match = tests.run(arguments, current)
 
 if ("all" in arguments):
     match = True
+    manifest.runs.plan(["HBMBandwidth", "TransferBench", "RCCLBandwidth", "FIO", "FlashAttention", "LLMBenchmark", "GEMMHipBLASLt"])
     run_HBMBandwidth()
     run_TransferBench()
     run_RCCLBandwidth()
@@ -116,4 +135,4 @@ if ("all" in arguments):
     run_LLMBenchmark()
     run_GEMMHipBLASLt()
 if not match:
-    print("Usage: python3 AMD_runner.py [arg]\n   or: python3 AMD_runner.py [arg1] [arg2] ... to run more than one test e.g python3 AMD_runner.py hbm nccl\nArguments are as follows, and are case insensitive:\nAll tests:  all\nROCBLAS GEMM:  gemm\nRCCL Bandwidth: rccl\nHBMBandwidth:   hbm\nTransferbench:   transfer\nFlash Attention: fa\nFIO Tests:   fio\nLLM Inference Workloads: llm")
+    print(tests.usage("AMD_runner.py"))
@@ -1,44 +1,66 @@
-import subprocess
-from Infra import tools
+import os
+import json
+from Infra import stream_runner
+from Infra import fio
+from Infra import storage
 
 class FIO:
     def __init__(self, path: str, machine: str):
         self.name = "FIO"
         self.machine_name = machine
         self.dir_path = path
+        config = self.get_config(path + '/config.json')
+        self.inputs = config["inputs"]
+        self.jobs = fio.jobs(self.inputs["matrix"])
 
-    def run(self):
-        print("Running FIO Tests...")
-        tests = [
-            ["read", "1M"],
-            ["read", "512k"],
-            ["read", "1k"],
-            ["write", "1M"],
-            ["write", "512k"],
-            ["write", "1k"],
-            ["randwrite", "1k"],
-            ["randread", "1k"]
-        ]
-        file = open(self.dir_path + '/Outputs/FIO_results_' + self.machine_name +'.txt', 'w')
+    def get_config(self, path: str):
+        file = open(path)
+        data = json.load(file)
+        file.close()
+        try:
+            return data[self.name]
+        except KeyError:
+            raise KeyError("no value found")
 
-        for test in tests:
-            results = subprocess.run(
-                "fio --bs=" + test[1] +  " --ioengine=libaio --iodepth=255 --directory=" + self.dir_path + "/Outputs --direct=1 --runtime=300 --numjobs=4 --rw=" +test[0]+ " --name=test --group_reporting --gtod_reduce=1 --size=10G | grep -A 1 ': bw='",
-                shell=True,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-            )
-            tools.write_log(tools.check_error(results))
-            res = results.stdout.decode('utf-8').split()[2].strip(",()")
-            res = test[0] + " BS=" + test[1] + ": " + res
-            print(res)
-            file.write(res + '\n')
-        
-        file.close()   
-        results = subprocess.run(
-            "rm Outputs/test*",
-            shell=True,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-        )
-        tools.write_log(tools.check_error(results))
+    # profile is "full" or "quick", a short time based run of the same jobs
+    def run(self, profile: str = "full"):
+        settings = fio.profile(self.inputs, profile)
+        directory = self.dir_path + '/' + self.inputs.get("directory", "Outputs")
+        print("Running FIO Tests (" + profile + " profile, " + str(len(self.jobs)) + " jobs)...")
+
+        sink = stream_runner.CSVSink(self.dir_path + '/Outputs/FIO_results_' + self.machine_name + '.csv', fio.FIELDS, fio.row)
+        results = fio.run(self.jobs, directory, self.dir_path + '/Outputs/FIO_' + self.machine_name, settings, sink, self.inputs.get("ioengine", "libaio"))
+        sink.close()
+        fio.cleanup(directory)
+        fio.print_table(results)
+
+    # reads every NVMe disk alone, then 1..N of them at once and through their RAID volumes, read only, plus
+    # the filesystems listed in scaling.filesystems (test files are written there and removed afterwards)
+    def run_scaling(self, profile: str = "full"):
+        settings = fio.profile(self.inputs, profile)
+        scaling = self.inputs.get("scaling", {})
+        jobs = fio.jobs(scaling.get("matrix", self.inputs["matrix"]))
+        found = storage.discover()
+        storage.save(found, self.dir_path + '/Outputs/Storage_' + self.machine_name + '.json')
+        storage.print_table(found)
+        targets = storage.targets(found, scaling.get("devices", "auto"))
+        if not targets and not scaling.get("filesystems"):
+            print("No NVMe devices found for the FIO scaling test.")
+            return
+        print("Running FIO Scaling Tests (" + profile + " profile, " + str(len(targets)) + " device sets)...")
+
+        output_dir = self.dir_path + '/Outputs/FIO_Scaling_' + self.machine_name
+        sink = stream_runner.CSVSink(self.dir_path + '/Outputs/FIO_Scaling_' + self.machine_name + '.csv', fio.SCALING_FIELDS, fio.scaling_row)
+        engine = self.inputs.get("ioengine", "libaio")
+        results = fio.run_scaling(jobs, targets, output_dir, settings, sink, engine)
+        for mount in scaling.get("filesystems", []):
+            directory = mount + '/' + scaling.get("directory", "fio-scaling")
+            os.makedirs(directory, exist_ok=True)
+            reads = [job for job in jobs if job.rw in ("read", "randread")]
+            for record in fio.run(reads, directory, output_dir + '/' + mount.strip("/").replace("/", "_"), settings, None, engine):
+                result = fio.ScalingResult(mount, "filesystem", 0, record, None, None)
+                sink(result)
+                results.append(result)
+            fio.cleanup(directory)
+        sink.close()
+        fio.print_scaling(results)
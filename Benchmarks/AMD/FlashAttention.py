@@ -1,7 +1,10 @@
 import subprocess
 import os
-import docker
+import csv
 from Infra import tools
+from Infra import device_fanout
+from Infra import stream_runner
+from Infra import container_pool
 
 class FlashAttention:
     def __init__(self, path:str, machine: str):
@@ -10,46 +13,22 @@ class FlashAttention:
         self.machine_name = machine
         self.dir_path = path
         self.container = None
+        self.outlier_band = device_fanout.outlier_band(path + '/config.json')
+        self.wall_timeout, self.idle_timeout = device_fanout.timeouts(path + '/config.json')
+        self.hf_cache = container_pool.hf_cache()
 
         # self.buffer = []
 
     def create_container(self):
-        client = docker.from_env()
-        # Define the Docker run options
-        docker_run_options = {
-            'ipc_mode':'host',
-            'network': 'host',
-            'name': 'flash_attention',
-            'group_add': ['render'],
-            'privileged': True,
-            'security_opt': ['seccomp=unconfined', 'apparmor=unconfined'],
-            'cap_add': ['CAP_SYS_ADMIN', 'SYS_PTRACE'],
-            'devices': ['/dev/kfd', '/dev/dri', '/dev/mem'],
-            'volumes': {
-                str(self.dir_path): {'bind': str(self.dir_path), 'mode': 'rw'},
-                '/mnt/resource_nvme/hf_cache': {'bind': '/root/.cache/huggingface', 'mode': 'rw'}
-            },
-            'environment': {
-                'HUGGINGFACE_HUB_CACHE': '/mnt/resource_nvme/hf_cache'
-            },
-            'tty': True,
-            'detach': True,
-            'auto_remove': True,
-            'shm_size': '16G'
-        }
-
-        # Creates new Docker container
-        print("Pulling docker container rocm/vllm:latest...")
-        self.container = client.containers.run('rocm/vllm:latest', **docker_run_options)
-        print(f"Created Docker Container ID: {self.container.id}")
+        docker_run_options = container_pool.rocm_options(self.dir_path)
+        docker_run_options['environment'] = {'HUGGINGFACE_HUB_CACHE': self.hf_cache}
+
+        # Reuses the warm rocm/vllm:latest container with Flash Attention installed, or creates and provisions it
+        self.container = container_pool.pool.get('rocm/vllm:latest', docker_run_options, ['pip install flash-attn --no-build-isolation'])
+        return self.container is not None
 
     def run(self):
-        self.create_container()
-        print("Installing Flash Attention in the container...")
-        install_result = self.container.exec_run('pip install flash-attn --no-build-isolation')
-        if install_result.exit_code != 0:
-            print(f"Failed to install Flash Attention: {install_result.output.decode('utf-8')}")
-            self.container.kill()
+        if not self.create_container():
             return
 
         print("Running Flash Attention...")
@@ -57,7 +36,28 @@ class FlashAttention:
         tools.write_log(res.output.decode('utf-8'))
         print(res.output.decode('utf-8'))
 
-        self.container.kill()
-
         with open(self.dir_path + "/Outputs/FlashAttention_" + self.machine_name + ".txt", "w") as file:
             file.write(res.output.decode('utf-8'))
+
+
+    # runs the benchmark on every GPU at once inside the container and compares the Flash2 fwd + bwd TFLOPS
+    def run_pergpu(self):
+        if not self.create_container():
+            return
+        devices = device_fanout.gpus("amd")
+        print(f"Running Flash Attention on {len(devices)} GPUs at once...")
+        cmd = f'python3 {self.dir_path}/flash-attention/benchmarks/benchmark_flash_attention.py'
+        results = device_fanout.run_each(
+            lambda device: stream_runner.exec_stream(self.container, cmd, device_fanout.tflops_parser(), environment={"HIP_VISIBLE_DEVICES": str(device["index"])}, wall_timeout=self.wall_timeout, idle_timeout=self.idle_timeout),
+            devices,
+        )
+
+        values = {}
+        for index, result in results.items():
+            values[index] = result.records[0] if result.records else None
+
+        with open(self.dir_path + "/Outputs/FlashAttention_PerGPU_" + self.machine_name + ".csv", "w") as csvFile:
+            writer = csv.writer(csvFile, delimiter=',', quotechar='"', quoting=csv.QUOTE_MINIMAL)
+            writer.writerow(["GPU", "NUMA", "TFLOPS", "Deviation (%)", "Outlier"])
+            for row in device_fanout.compare("TFLOPS", values, devices, self.outlier_band):
+                writer.writerow(row)
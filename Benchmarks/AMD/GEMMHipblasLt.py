@@ -2,14 +2,20 @@ import json
 import os
 from Infra import tools
 from prettytable import PrettyTable
-import docker
-import datetime
+import csv
+import glob
+import time
+import threading
+from Infra import soak
+from Infra import container_pool
 
 class GEMMHipBLASLt:
     def __init__(self, path: str, dir_path: str, machine: str, i: int = 1000, w: int = 10000):
         self.name = "GEMMHipBLASLt"
         config = self.get_config(path)
         self.m, self.n, self.k, self.duration, self.datatype = self.config_conversion(config)
+        self.batched, self.batch_cold_iters = self.parse_json(config, "batch")
+        self.soak_shapes, self.soak_interval, self.soak_threshold, self.soak_estimate = self.parse_json(config, "soak")
         self.dir_path = dir_path
         self.i = i
         self.w = w
@@ -31,6 +37,12 @@ class GEMMHipBLASLt:
             return config["inputs"]["duration"]
         if var == "datatype":
             return config["inputs"]["datatype"]
+        if var == "soak":
+            soak = config["inputs"].get("soak", {})
+            return soak.get("shapes", [[8192, 8192, 8192]]), soak.get("interval", 1.0), soak.get("threshold", 0.05), soak.get("estimate_tflops", 1000)
+        if var == "batch":
+            batch = config["inputs"].get("batch", {})
+            return batch.get("enabled", False), batch.get("cold_iters", 10)
         start = config["inputs"][var]["start"]
         end = config["inputs"][var]["end"]
         interval = config["inputs"][var]["interval"]
@@ -48,36 +60,162 @@ class GEMMHipBLASLt:
         return m, n, k, duration, datatype
 
     def create_container(self):
-        client = docker.from_env()
-        # Define the Docker run options
-        docker_run_options = {
-            'ipc_mode':'host',
-            'entrypoint': '/bin/bash',
-            'network': 'host',
-            'group_add': ['render'],
-            'privileged': True,
-            'security_opt': ['seccomp=unconfined'],
-            'cap_add': ['CAP_SYS_ADMIN', 'SYS_PTRACE'],
-            'devices': ['/dev/kfd', '/dev/dri', '/dev/mem'],
-            'volumes': {str(self.dir_path): {'bind': str(self.dir_path), 'mode': 'rw'}},
-            'tty': True,
-            'detach': True
-        }
-
-        # Creates new Docker container
-        print("Pulling docker container rocm/vllm:latest...")
-        self.container = client.containers.run('rocm/vllm:latest', **docker_run_options)
-        print(f"Created Docker Container ID: {self.container.id}")
-
-    def build(self):
-        print(f"[{datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] Installing hipBLASLt package...")
-        results = self.container.exec_run(f'/bin/sh -c "apt-get update && apt-get install -y hipblaslt"', stderr=True)
-        if results.exit_code != 0:
-            tools.write_log(results.output.decode('utf-8'))
-            return
+        docker_run_options = container_pool.rocm_options(self.dir_path)
+
+        # Reuses the warm rocm/vllm:latest container with hipBLASLt installed, or creates and provisions it
+        self.container = container_pool.pool.get('rocm/vllm:latest', docker_run_options, ['apt-get update && apt-get install -y hipblaslt'])
+        return self.container is not None
+
+    def problem(self, m_val, n_val, k_val, cold_iters, iters=2000):
+        return (
+            f"- {{function: matmul, transA: T, transB: N, a_type: f8_r, b_type: f8_r, c_type: f16_r, d_type: f16_r, "
+            f"compute_type: c_f32_r, M: {m_val}, N: {n_val}, K: {k_val}, lda: {k_val}, ldb: {k_val}, ldc: {m_val}, ldd: {m_val}, "
+            f"alpha: 1, beta: 0, scale_type: f32_r, iters: {iters}, cold_iters: {cold_iters}, initialization: trig_float, rotating: 512}}\n"
+        )
+
+    # runs every shape in a single hipblaslt-bench process: the device is warmed up by the first problem only,
+    # and results are streamed back and saved as each problem completes
+    def run_batched(self):
+        print("Running HipBLASLt (batched)...")
+
+        results_file_path = os.path.join(self.dir_path, 'Outputs', 'GEMMHipBLASLt_results.csv')
+        problems_path = os.path.join(self.dir_path, 'Outputs', 'GEMMHipBLASLt_problems.yaml')
+        os.makedirs(os.path.dirname(results_file_path), exist_ok=True)
+
+        shapes = list(zip(self.m, self.n, self.k))
+        with open(problems_path, 'w') as f:
+            for i, (m_val, n_val, k_val) in enumerate(shapes):
+                f.write(self.problem(m_val, n_val, k_val, 100 if i == 0 else self.batch_cold_iters))
+        with open(results_file_path, 'w') as f:
+            f.write("M,N,K,TFLOPS\n")
+
+        table1 = PrettyTable()
+        table1.field_names = ["M", "N", "K", "TFLOPS"]
+        pending = list(shapes)
+
+        results = self.container.exec_run(f'/opt/rocm/bin/hipblaslt-bench --device 0 --flush --yaml {problems_path}', stream=True)
+        partial = ""
+        for chunk in results.output:
+            lines = (partial + chunk.decode('utf-8')).split('\n')
+            partial = lines.pop()
+            for line in lines:
+                if "T,N,0" not in line or not pending:
+                    continue
+                tools.write_log(line)
+                line_parts = line.strip().split(',')
+                try:
+                    shape = (int(line_parts[4]), int(line_parts[5]), int(line_parts[6]))
+                    tflops = float(line_parts[-3]) / 1000
+                except (IndexError, ValueError) as e:
+                    print(f"Could not parse result line {line.strip()}. Error: {e}")
+                    continue
+                # a row for a shape that is not pending is never attributed to another one, that shape stays failed
+                if shape not in pending:
+                    print(f"Skipping result line for M={shape[0]}, N={shape[1]}, K={shape[2]}, which is not a pending shape")
+                    tools.write_log("Unexpected hipblaslt-bench result line: " + line.strip())
+                    continue
+                pending.remove(shape)
+                table1.add_row([shape[0], shape[1], shape[2], f"{tflops:.2f}"])
+                print(f"Result {len(shapes) - len(pending)}/{len(shapes)}: M={shape[0]}, N={shape[1]}, K={shape[2]}: {tflops:.2f} TFLOPS")
+                with open(results_file_path, 'a') as f:
+                    f.write(f"{shape[0]},{shape[1]},{shape[2]},{tflops:.2f}\n")
+
+        for m_val, n_val, k_val in pending:
+            table1.add_row([m_val, n_val, k_val, "Test Failed"])
+
+        print("\n--- Benchmark Summary ---")
+        print(table1)
+
+    # GPUs are the KFD topology nodes with SIMDs, CPU nodes report simd_count 0
+    def num_gpus(self):
+        count = 0
+        for properties in glob.glob('/sys/class/kfd/kfd/topology/nodes/*/properties'):
+            with open(properties) as f:
+                for line in f:
+                    if line.startswith('simd_count') and int(line.split()[1]) > 0:
+                        count += 1
+        return count
+
+    # one hipblaslt-bench process per GPU runs a problem list of the soak shapes back to back, each sized to take
+    # about one interval, so the GPU never idles on process start and library init between samples. A sample is
+    # the TFLOPS of a problem, timed by when its result line arrives. The list is sized from estimate_tflops, the
+    # process is stopped at duration, and when it runs out early the next one is sized from the measured TFLOPS.
+    def soak_device(self, device, series, writer, lock):
+        problems_path = os.path.join(self.dir_path, 'Outputs', f'GEMMHipBLASLt_Soak_problems_{device}.yaml')
+        estimate = self.soak_estimate
+        start = time.time()
+        while time.time() - start < self.duration:
+            remaining = self.duration - (time.time() - start)
+            count = int(remaining / self.soak_interval) + 1
+            with open(problems_path, 'w') as f:
+                for sample in range(count):
+                    m_val, n_val, k_val = self.soak_shapes[sample % len(self.soak_shapes)]
+                    iters = max(10, int(self.soak_interval * estimate * 1e12 / (2 * m_val * n_val * k_val)))
+                    f.write(self.problem(m_val, n_val, k_val, 100 if sample == 0 else 0, iters))
+
+            results = self.container.exec_run(f'timeout {int(remaining) + 1} stdbuf -oL /opt/rocm/bin/hipblaslt-bench --device {device} --yaml {problems_path}', stream=True)
+            partial = ""
+            measured = []
+            output = []
+            for chunk in results.output:
+                lines = (partial + chunk.decode('utf-8')).split('\n')
+                partial = lines.pop()
+                for line in lines:
+                    if "T,N,0" not in line:
+                        output.append(line)
+                        continue
+                    try:
+                        tflops = float(line.strip().split(',')[-3]) / 1000
+                    except (IndexError, ValueError):
+                        tools.write_log(line)
+                        continue
+                    elapsed = round(time.time() - start, 3)
+                    if elapsed > self.duration:
+                        continue
+                    measured.append(tflops)
+                    with lock:
+                        series.setdefault(device, []).append((elapsed, tflops))
+                        writer.writerow([device, elapsed, round(tflops, 3)])
+            if not measured:
+                tools.write_log('\n'.join(output))
+                print(f"Soak failed on GPU {device}, see logs for details.")
+                return
+            estimate = sorted(measured)[len(measured) // 2]
+
+    # holds the soak shapes on every GPU for duration seconds and records a TFLOPS time series per GPU
+    def run_soak(self):
+        num_gpus = self.num_gpus()
+        print(f"Running HipBLASLt soak for {self.duration} s on {num_gpus} GPUs...")
+
+        series = {}
+        lock = threading.Lock()
+        with open(os.path.join(self.dir_path, 'Outputs', 'GEMMHipBLASLt_Soak_' + self.machine_name + '.csv'), 'w') as csvFile:
+            writer = csv.writer(csvFile, delimiter=',', quotechar='"', quoting=csv.QUOTE_MINIMAL)
+            writer.writerow(["GPU", "Time(s)", "TFLOPS"])
+            threads = [threading.Thread(target=self.soak_device, args=(device, series, writer, lock)) for device in range(num_gpus)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        table1 = PrettyTable()
+        fields = ["GPU", "Initial TFLOPS", "Sustained TFLOPS", "Min TFLOPS", "Drop (%)", "Time to throttle (s)"]
+        table1.field_names = fields
+        with open(os.path.join(self.dir_path, 'Outputs', 'GEMMHipBLASLt_Soak_Summary_' + self.machine_name + '.csv'), 'w') as csvFile:
+            writer = csv.writer(csvFile, delimiter=',', quotechar='"', quoting=csv.QUOTE_MINIMAL)
+            writer.writerow(fields)
+            for device in sorted(series):
+                summary = soak.summarize(series[device], self.soak_threshold)
+                row = [device, summary["initial"], summary["sustained"], summary["min"], summary["drop"], summary["throttle"] if summary["throttle"] is not None else "-"]
+                writer.writerow(row)
+                table1.add_row(row)
+        print(table1)
 
     # run GEMM with predetermined matrix sizes that are commonly used in transformers
     def run(self):
+        if self.batched:
+            self.run_batched()
+            return
         print("Running HipBLASLt...")
 
         results_file_path = os.path.join(self.dir_path, 'Outputs', 'GEMMHipBLASLt_results.csv')
@@ -118,4 +256,3 @@ class GEMMHipBLASLt:
 
         print("\n--- Benchmark Summary ---")
         print(table1)
-        self.container.kill()
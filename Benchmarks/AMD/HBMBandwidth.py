@@ -6,6 +6,9 @@ import csv
 from prettytable import PrettyTable
 import subprocess
 from Infra import tools
+from Infra import device_fanout
+from Infra import stream_runner
+from Infra import sampling
 
 class HBMBandwidth:
     def __init__(self, config_path: str, dir_path: str, machine: str):
@@ -13,9 +16,12 @@ class HBMBandwidth:
         self.machine_name = machine
         config = self.get_config(dir_path + '/' + config_path)
         self.num_runs, self.interval = self.config_conversion(config)
+        self.sampling = sampling.from_config(config["inputs"], self.num_runs)
+        self.outlier_band = device_fanout.outlier_band(dir_path + '/' + config_path)
+        self.wall_timeout, self.idle_timeout = stream_runner.timeouts(config["inputs"], 600, 120)
         self.dir_path = dir_path
         self.container = None
-        self.buffer = []
+        self.sampler = None
 
     def get_config(self, path: str):
         file = open(path)
@@ -45,63 +51,64 @@ class HBMBandwidth:
     def run(self):
         print("Running HBM Bandwidth...")
         runs_executed = 0
-        buffer = []
-        while runs_executed < self.num_runs:
-            run_cmd = "sudo " + self.dir_path + "/BabelStream/build/hip-stream"
-            results = subprocess.run(run_cmd, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-            tools.write_log(tools.check_error(results))
-            log = results.stdout.decode("utf-8").strip().split("\n")[13:18]
-            for i in range(len(log)):
-                temp = log[i].split()
-                log[i] = [temp[0], temp[1]]
-            buffer.append(log)
+        sampler = sampling.Sampler(stream_runner.BABELSTREAM_FUNCTIONS, **self.sampling)
+        # every result line is saved as soon as BabelStream prints it
+        sink = stream_runner.CSVSink(self.dir_path + "/Outputs/HBMBandwidth_Runs_" + self.machine_name + ".csv", ["Run", "Operation", "MBytes/sec"])
+        # runs until the median of every kernel is known to the target precision
+        while not sampler.done():
+            run_cmd = ["sudo", self.dir_path + "/BabelStream/build/hip-stream"]
+            result = stream_runner.run(run_cmd, stream_runner.babelstream_row, lambda row: sink([runs_executed] + row), wall_timeout=self.wall_timeout, idle_timeout=self.idle_timeout)
+            if len(result.records) == 5:
+                sampler.add({op: float(value) for op, value in result.records})
+            else:
+                sampler.add(None)
+                print("HBM Bandwidth run " + str(runs_executed) + " failed, see logs for details.")
 
             runs_executed += 1
-            time.sleep(int(self.interval))
+            if not sampler.done():
+                time.sleep(int(self.interval))
+        sink.close()
 
-        self.buffer = buffer
+        self.sampler = sampler
         self.save_results()
 
-    def process_stats(self, results):
-        mean = statistics.mean(results)/1000000
-        maximum = max(results)/1000000
-        minimum = min(results)/1000000
-        stdev = statistics.stdev(results)/1000
-        return [round(minimum, 2), round(maximum, 2), round(mean, 2)]
+    # runs hip-stream on every GPU at once for num_runs rounds and flags the GPUs whose mean bandwidth
+    # falls outside the configured band around the node median
+    def run_pergpu(self):
+        devices = device_fanout.gpus("amd")
+        print("Running HBM Bandwidth on " + str(len(devices)) + " GPUs at once...")
+        buffers = {device["index"]: [] for device in devices}
+        for _ in range(self.num_runs):
+            for index, result in device_fanout.run([self.dir_path + "/BabelStream/build/hip-stream"], devices, "amd", lambda: stream_runner.babelstream_row, prefix=["sudo"], wall_timeout=self.wall_timeout, idle_timeout=self.idle_timeout).items():
+                if len(result.records) == 5:
+                    buffers[index].append(result.records)
+                else:
+                    print("HBM Bandwidth failed on GPU " + str(index) + ", see logs for details.")
+            time.sleep(int(self.interval))
+
+        with open(self.dir_path + '/Outputs/HBMBandwidth_PerGPU_' + self.machine_name + '.csv', 'w') as csvFile:
+            writer = csv.writer(csvFile, delimiter=',', quotechar='"', quoting=csv.QUOTE_MINIMAL)
+            writer.writerow(["Operation", "GPU", "NUMA", "Mean (TB/s)", "Deviation (%)", "Outlier"])
+            for op, name in enumerate(["Copy", "Mul", "Add", "Triad", "Dot"]):
+                values = {}
+                for index, buffer in buffers.items():
+                    values[index] = statistics.mean(float(log[op][1]) for log in buffer) / 1000000 if buffer else None
+                print(name)
+                for row in device_fanout.compare("Mean (TB/s)", values, devices, self.outlier_band):
+                    writer.writerow([name] + row)
 
     def save_results(self):
-        copy = ["Copy"]
-        mul = ["Mul"]
-        add = ["Add"]
-        triad = ["Triad"]
-        dot = ["Dot"]
-        for log in self.buffer:
-            copy.append(float(log[0][1]))
-            mul.append(float(log[1][1]))
-            add.append(float(log[2][1]))
-            triad.append(float(log[3][1]))
-            dot.append(float(log[4][1]))
-
-        copy[1:] = self.process_stats(copy[1:])
-        mul[1:] = self.process_stats(mul[1:])
-        add[1:] = self.process_stats(add[1:])
-        triad[1:] = self.process_stats(triad[1:])
-        dot[1:] = self.process_stats(dot[1:])
+        fields = ["Operation"] + sampling.fields("TB/s")
+        rows = self.sampler.rows(1000000)
 
         table1 = PrettyTable()
-        table1.field_names = ["Operation","Min (TB/s)", "Max (TB/s)", "Mean (TB/s)"]
-        table1.add_row(copy)
-        table1.add_row(mul)
-        table1.add_row(add)
-        table1.add_row(triad)
-        table1.add_row(dot)
+        table1.field_names = fields
+        for row in rows:
+            table1.add_row(row)
         print(table1)
 
         with open(self.dir_path + '/Outputs/HBMBandwidth_Performance_results_' + self.machine_name +'.csv', 'w') as csvFile:
             writer = csv.writer(csvFile, delimiter=',', quotechar='"', quoting=csv.QUOTE_MINIMAL)
-            writer.writerow(["Operation","Min (TB/s)", "Max (TB/s)", "Mean (TB/s)"])
-            writer.writerow(copy)
-            writer.writerow(mul)
-            writer.writerow(add)
-            writer.writerow(triad)
-            writer.writerow(dot)
+            writer.writerow(fields)
+            for row in rows:
+                writer.writerow(row)
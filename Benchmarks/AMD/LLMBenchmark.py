@@ -1,10 +1,11 @@
-import docker
 import os
 import json
 import csv
 from prettytable import PrettyTable
 import json
 from Infra import tools
+from Infra import container_pool
+from Infra import manifest
 
 class LLMBenchmark:
     def __init__(self, config_path: str, dir_path: str, machine: str):
@@ -25,31 +26,33 @@ class LLMBenchmark:
             raise KeyError("no value found")
 
     def create_container(self):
-        client = docker.from_env()
-        # Define the Docker run options
-        docker_run_options = {
-            'ipc_mode':'host',
-            'network': 'host',
-            'entrypoint':'/bin/bash',
-            'group_add': ['render'],
-            'privileged': True,
-            'security_opt': ['seccomp=unconfined'],
-            'cap_add': ['CAP_SYS_ADMIN', 'SYS_PTRACE'],
-            'devices': ['/dev/kfd', '/dev/dri', '/dev/mem'],
-            'volumes': {str(self.dir_path): {'bind': str(self.dir_path), 'mode': 'rw'}},
-            'environment': {'HF_HOME': str(self.dir_path)},
-            'tty': True,
-            'detach': True
-        }
+        docker_run_options = container_pool.rocm_options(self.dir_path)
+        docker_run_options['environment'] = {'HF_HOME': str(self.dir_path)}
 
-        # Creates new Docker container
-        # print("Pulling docker container rocm/vllm-dev:20241121-tuned")
-        print("Pulling docker container rocm/vllm:latest")
-        # self.container = client.containers.run('rocm/vllm-dev:20241121-tuned', **docker_run_options)
-        self.container = client.containers.run('rocm/vllm:latest', **docker_run_options)
-        print(f"Docker Container ID: {self.container.id}")
+        # Reuses the warm rocm/vllm:latest container or creates it
+        # self.container = container_pool.pool.get('rocm/vllm-dev:20241121-tuned', docker_run_options)
+        self.container = container_pool.pool.get('rocm/vllm:latest', docker_run_options)
+        return self.container is not None
+
+    # every model, tp size, max num seqs, input/output size and number of requests is a unit of the run manifest,
+    # a resumed run skips the ones that are done, their rows are already in the appended csv
+    def unit(self, model_name, tp_size, max_num_seq, input_size, output_size, request):
+        return "/".join([self.name, model_name, "tp" + str(tp_size), "seqs" + str(max_num_seq), str(input_size) + "_" + str(output_size), str(request)])
+
+    def units(self):
+        units = []
+        for model_name in self.config['models']:
+            model = self.config['models'][model_name]
+            if model['use_model'] and model['type'] == "amd":
+                for tp_size in model['tp_sizes']:
+                    for max_num_seq in model['max_num_seqs']:
+                        for input_size, output_size in zip(model['input_length'], model['output_length']):
+                            for request in model['num_requests']:
+                                units.append(self.unit(model_name, tp_size, max_num_seq, input_size, output_size, request))
+        return units
 
     def run_benchmark(self):
+        manifest.runs.plan(self.units())
         for model_name in self.config['models']:
             if self.config['models'][model_name]['use_model'] and self.config['models'][model_name]['type'] == "amd":
                 for tp_size in self.config['models'][model_name]['tp_sizes']:
@@ -58,6 +61,9 @@ class LLMBenchmark:
                             for request in self.config['models'][model_name]['num_requests']:
                                 input_size = self.config['models'][model_name]['input_length'][i]
                                 output_size = self.config['models'][model_name]['output_length'][i]
+                                unit = self.unit(model_name, tp_size, max_num_seq, input_size, output_size, request)
+                                if manifest.runs.skip(unit):
+                                    continue
                                 print(f"Benchmarking {model_name} | TP Size: {tp_size} | Input Size: {input_size} | Output Size: {output_size}")
                                 run_benchmark_command = f'''
                                     /bin/bash -c \
@@ -80,24 +86,25 @@ class LLMBenchmark:
                                         --output-len {output_size}"
                                     '''
 
-                                rb1 = self.container.exec_run(run_benchmark_command)
-
-                                tools.write_log(rb1.output.decode('utf-8'))
+                                with manifest.runs.unit(unit, ['LLMBenchmark_' + self.machine + '.csv']):
+                                    rb1 = self.container.exec_run(run_benchmark_command)
 
-                                temp = rb1.output.decode('utf-8').split('\n')
-                                for line in temp:
-                                    if "Throughput: " in line:
-                                        result = line.split(' ')[6]
-                                        table1 = PrettyTable()
-                                        table1.add_row(['Model Name', model_name])
-                                        table1.add_row(['Input/Output lengths', str(input_size) + "/" + str(output_size)])
-                                        table1.add_row(['World Size (TP size)', str(tp_size)])
-                                        table1.add_row(['Throughput (tokens/sec)', str(result)])
+                                    tools.write_log(rb1.output.decode('utf-8'))
+                                    if rb1.exit_code != 0:
+                                        manifest.runs.fail(unit, "benchmark_throughput.py exited with " + str(rb1.exit_code))
 
-                                        print(table1.get_string(header=False))
-                                        self.save_data([model_name, str(input_size), str(output_size), str(tp_size), str(result)], 'Outputs/LLMBenchmark_' + self.machine + '.csv')
+                                    temp = rb1.output.decode('utf-8').split('\n')
+                                    for line in temp:
+                                        if "Throughput: " in line:
+                                            result = line.split(' ')[6]
+                                            table1 = PrettyTable()
+                                            table1.add_row(['Model Name', model_name])
+                                            table1.add_row(['Input/Output lengths', str(input_size) + "/" + str(output_size)])
+                                            table1.add_row(['World Size (TP size)', str(tp_size)])
+                                            table1.add_row(['Throughput (tokens/sec)', str(result)])
 
-        self.container.kill()
+                                            print(table1.get_string(header=False))
+                                            self.save_data([model_name, str(input_size), str(output_size), str(tp_size), str(result)], 'Outputs/LLMBenchmark_' + self.machine + '.csv')
 
     def save_data(self, data, file_path):
         file_exists = os.path.exists(file_path)
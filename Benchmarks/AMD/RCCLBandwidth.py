@@ -1,10 +1,11 @@
 import json
-import docker
 import os
-import csv
-import csv
-from prettytable import PrettyTable
 from Infra import tools
+from Infra import stream_runner
+from Infra import collectives
+from Infra import alpha_beta
+from Infra import container_pool
+from Infra import multinode
 
 class RCCLBandwidth:
     def __init__(self, config_path:str, dir_path:str, machine: str):
@@ -12,7 +13,11 @@ class RCCLBandwidth:
         self.machine_name = machine
         config = self.get_config(config_path)
         self.start, self.end, self.num_gpus = self.config_conversion(config)
+        self.wall_timeout, self.idle_timeout = stream_runner.timeouts(config['inputs'], 3600, 600)
+        self.runs = list(collectives.runs(config['inputs'], {"all_reduce": {"algos": ["Tree", "Ring", "NVLS", "NVLSTree"]}}))
+        self.fit_baseline, self.fit_drift, self.fit_regimes = alpha_beta.from_config(config_path)
         self.dir_path = dir_path
+        self.multinode = multinode.Multinode(config_path, self.name, machine)
         self.container = None
         self.buffer = []
 
@@ -32,7 +37,6 @@ class RCCLBandwidth:
         return self.parse_json(config)
 
     def create_container(self):
-        client = docker.from_env()
         # Define the Docker run options
         docker_run_options = {
             'ipc_mode':'host',
@@ -48,10 +52,9 @@ class RCCLBandwidth:
             'detach': True
         }
 
-        # Creates new Docker container from https://hub.docker.com/r/rocm/pytorch/tags
-        print("Pulling docker container rocm/pytorch:rocm6.2.3_ubuntu22.04_py3.10_pytorch_release_2.3.0_triton_llvm_reg_issue...")
-        self.container = client.containers.run('rocm/pytorch:rocm6.2.3_ubuntu22.04_py3.10_pytorch_release_2.3.0_triton_llvm_reg_issue', **docker_run_options)
-        print(f"Docker Container ID: {self.container.id}")
+        # Reuses the warm container from https://hub.docker.com/r/rocm/pytorch/tags or creates it
+        self.container = container_pool.pool.get('rocm/pytorch:rocm6.2.3_ubuntu22.04_py3.10_pytorch_release_2.3.0_triton_llvm_reg_issue', docker_run_options)
+        return self.container is not None
 
     def build(self):
         path ='rccl'
@@ -85,39 +88,50 @@ class RCCLBandwidth:
                 tools.write_log(results.output.decode('utf-8'))
 
     def run(self):
-        buffer=[["8 ","16 ","32 ","64 ","128 ","256 ","512 ","1K","2K","4K","8K","16K","32K","65K","132K","256K", "524K","1M","2M","4M","8M","16M","33M","67M","134M","268M","536M","1G","2G","4G","8G"]]
-        runs = ["Tree", "Ring", "NVLS", "NVLSTree"]
-        print("Running RCCL AllReduce...")
-        for run in runs:
-            run_cmd = "NCCL_ALGO=" + run + " " + self.dir_path +"/rccl-tests/build/all_reduce_perf -b 8 -e 8G -f 2 -g 8 -n 40 | grep float"
-            run_cmd = '/bin/sh -c "' + run_cmd + '"'
-            results = self.container.exec_run(run_cmd, stderr=True)
-            if results.exit_code != 0:
-                tools.write_log(results.output.decode('utf-8'))
-                return
-            res = results.output.decode('utf-8').split('\n')
-            log = []
-            for line in res:
-                line = line.split()
-                if len(line) == 13:
-                    log.append(line[11])
-            buffer.append(log)
-
-        table1 = PrettyTable()
-        runs = ["Message Size", "Tree", "Ring", "NVLS", "NVLSTree"]
-
-        for i in range(len(buffer)):
-            table1.add_column(runs[i], buffer[i])
-
-        print(table1)
+        print("Running RCCL collectives...")
+        # every message size is saved as soon as rccl-tests prints it
+        sink = stream_runner.CSVSink(self.dir_path + '/Outputs/RCCLBandwidth_' + self.machine_name + '.csv', collectives.FIELDS, collectives.row)
+        buffer = []
+        for collective, algo, proto in self.runs:
+            print("Running RCCL " + collective + " (algo " + algo + ", proto " + proto + ") on " + str(self.num_gpus) + " GPUs")
+            run_cmd = " ".join([self.dir_path + "/rccl-tests/build/" + collectives.COLLECTIVES[collective]] + collectives.args(self.start, self.end, self.num_gpus))
+            result = stream_runner.exec_stream(
+                self.container,
+                run_cmd,
+                lambda line: collectives.parse_row(collective, algo, proto, line),
+                sink,
+                environment=collectives.env(algo, proto),
+                wall_timeout=self.wall_timeout,
+                idle_timeout=self.idle_timeout,
+            )
+            buffer += result.records
+        sink.close()
+
+        collectives.print_tables(buffer)
         self.buffer=buffer
-        self.container.kill()
-        self.save()
-
-    def save(self):
-        with open('Outputs/RCCLBandwidth_' + self.machine_name + '.csv', 'w') as csvFile:
-            writer = csv.writer(csvFile, delimiter=',', quotechar='"', quoting=csv.QUOTE_MINIMAL)
-            writer.writerow(["Message Size", "Tree", "Ring", "NVLS", "NVLSTree"])
-            for i in range(len(self.buffer[0])):
-                row = [self.buffer[0][i], self.buffer[1][i], self.buffer[2][i], self.buffer[3][i], self.buffer[4][i]]
-                writer.writerow(row)
+
+        print("Fitted latency and bandwidth:")
+        alpha_beta.report([sink.file.name], self.dir_path + '/Outputs/RCCLBandwidth_Fit_' + self.machine_name + '.csv', self.fit_baseline, self.fit_drift, self.fit_regimes)
+
+    # rccl-tests is built with MPI, every rank runs it on one GPU
+    def rank_command(self, collective, start, end):
+        return [self.dir_path + "/rccl-tests/build/" + collectives.COLLECTIVES[collective]] + collectives.args(start, end, 1)
+
+    # the launcher runs inside the container, where MPI is installed, with the job's variables set
+    def wrap(self, cmd, env):
+        variables = []
+        for name, value in sorted(env.items()):
+            variables += ["-e", name + "=" + value]
+        return ["docker", "exec"] + variables + [self.container.id] + cmd
+
+    def run_multinode(self):
+        if self.multinode.program != "nccl-tests":
+            print("RCCL multi-node runs only support the rccl-tests program")
+            return
+        self.multinode.run(self.runs, self.start, self.end, self.rank_command, self.wrap)
+
+    def run_bisect(self):
+        if self.multinode.program != "nccl-tests":
+            print("RCCL multi-node runs only support the rccl-tests program")
+            return
+        self.multinode.bisect(self.runs[0], self.rank_command, self.wrap)
@@ -1,20 +1,30 @@
 import json
 import os
-import statistics
-import subprocess
+import itertools
 import time
 import csv
-from Infra import tools
+from Infra import build_scheduler
+from Infra import artifact_cache
+from Infra import stream_runner
+from Infra import sampling
+from Infra import topology
 from prettytable import PrettyTable
 
 class CPUStream:
     def __init__(self, path:str, machine: str):
         self.name = "CPUStream"
         self.machine_name = machine
-        
-        self.num_runs, self.interval = 4, 4
-
-        self.buffer = []
+        config = self.get_config(path)
+        self.num_runs, self.interval = self.config_conversion(config)
+        self.sampling = sampling.from_config(config["inputs"], self.num_runs)
+        self.wall_timeout, self.idle_timeout = stream_runner.timeouts(config["inputs"], 600, 120)
+        self.threads = config["inputs"].get("threads", "auto")
+        self.cpus = config["inputs"].get("cpus", "auto")
+        self.array_size = config["inputs"].get("array_size", "auto")
+        self.scaling = config["inputs"].get("scaling", {})
+        self.cache = artifact_cache.from_config(path)
+
+        self.sampler = None
 
     def get_config(self, path: str):
         file = open(path)
@@ -31,108 +41,190 @@ class CPUStream:
     def config_conversion(self, config) -> tuple[list, list, list]:
         return self.parse_json(config)
 
-    def build(self):
+    def build_steps(self):
         current = os.getcwd()
+        path = os.path.join(current, "CPUStream")
+        babelstream_build_path = os.path.join(path, "build")
+
+        url = "https://github.com/UoB-HPC/BabelStream"
+        inputs = lambda: dict(artifact_cache.toolchain(), commit=artifact_cache.upstream_commit(url, path), cpu=artifact_cache.cpu_model(), flags="-DMODEL=omp")
+        cached = artifact_cache.CachedBuild(self.cache, "omp-stream", inputs, {"omp-stream": os.path.join(babelstream_build_path, "omp-stream")})
+        return cached.steps([
+            build_scheduler.BuildStep(
+                "cpustream-clone",
+                ["git", "clone", url,  path],
+                skip_if=lambda: os.path.isdir(path),
+            ),
+            build_scheduler.BuildStep(
+                "omp-stream-cmake",
+                ["cmake", "-S", path, "-B", babelstream_build_path, "-DMODEL=omp"],
+                deps=["cpustream-clone"],
+            ),
+            build_scheduler.BuildStep("omp-stream-make", ["make"], cwd=babelstream_build_path, deps=["omp-stream-cmake"]),
+        ])
 
-        path = "CPUStream"
-        isdir = os.path.isdir(path)
-        if not isdir:
-            results = subprocess.run(
-                ["git", "clone", "https://github.com/UoB-HPC/BabelStream",  path],
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-            )
-            tools.write_log(tools.check_error(results))
-
-        build_path = os.path.join(current, "CPUStream")
-        os.chdir(build_path)
+    def build(self):
+        build_scheduler.run_steps(self.build_steps())
 
-        babelstream_build_path = os.path.join(build_path, "build")
 
- 
-        if not os.path.isdir(babelstream_build_path):
-            os.mkdir(babelstream_build_path)
-            os.chdir(babelstream_build_path)
-            results = subprocess.run(
-                "cmake -DMODEL=omp ..",
-                shell=True,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-            )
-            tools.write_log(tools.check_error(results))
-           
-            results = subprocess.run(
-                ["make"], stdout=subprocess.PIPE, stderr=subprocess.PIPE
-            )
-            tools.write_log(tools.check_error(results))
-        else:
-            os.chdir(babelstream_build_path)
+    # threads, CPUs and array size from the machine's topology unless set in config.json: one thread per physical
+    # core, on the first hardware thread of each core, and arrays 4x the last level cache so every kernel streams
+    # from memory
+    def layout(self, topo: dict):
+        cpus = topology.primary_threads(topo) if self.cpus == "auto" else topology.parse_cpulist(self.cpus)
+        threads = len(cpus) if self.threads == "auto" else int(self.threads)
+        array_size = max(2**25, 4 * topology.last_level_cache(topo) // 8) if self.array_size == "auto" else int(self.array_size)
+        return threads, cpus, array_size
 
+    def command(self, threads: int, cpus: list, array_size: int):
+        return "OMP_NUM_THREADS=" + str(threads) + " OMP_PROC_BIND=spread OMP_PLACES=threads taskset -c " + topology.format_cpulist(cpus) + " ./omp-stream --arraysize " + str(array_size)
 
     def run(self):
         current = os.getcwd()
-        print("Running CPU Stream...")
+        topo = topology.discover()
+        threads, cpus, array_size = self.layout(topo)
+        print(topology.summary(topo))
+        topology.save(dict(topo, settings={"threads": threads, "cpus": topology.format_cpulist(cpus), "array_size": array_size}), os.path.join(current, "Outputs", "CPUStream_Topology_" + self.machine_name + ".json"))
+        os.chdir(os.path.join(current, "CPUStream", "build"))
+        print("Running CPU Stream on " + str(threads) + " threads, CPUs " + topology.format_cpulist(cpus) + "...")
 
         runs_executed = 0
-        buffer = []
-        while runs_executed < self.num_runs:
-            results = subprocess.run(
-                "OMP_NUM_THREADS=128 OMP_PROC_BIND=spread taskset -c 0-127 ./omp-stream", shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE
+        sampler = sampling.Sampler(stream_runner.BABELSTREAM_FUNCTIONS, **self.sampling)
+        # every result line is saved as soon as BabelStream prints it
+        sink = stream_runner.CSVSink(os.path.join(current, "Outputs", "CPUStream_Runs_" + self.machine_name + ".csv"), ["Run", "Operation", "MBytes/sec"])
+        # runs until the median of every kernel is known to the target precision
+        while not sampler.done():
+            result = stream_runner.run(
+                self.command(threads, cpus, array_size),
+                stream_runner.babelstream_row,
+                lambda row: sink([runs_executed] + row),
+                shell=True,
+                wall_timeout=self.wall_timeout,
+                idle_timeout=self.idle_timeout,
             )
-            tools.write_log(tools.check_error(results))
-            log = results.stdout.decode("utf-8").strip().split("\n")[10:15]
-            for i in range(len(log)):
-                temp = log[i].split()
-                log[i] = [temp[0], temp[1]]
-            buffer.append(log)
+            if len(result.records) == 5:
+                sampler.add({op: float(value) for op, value in result.records})
+            else:
+                sampler.add(None)
+                print("CPU Stream run " + str(runs_executed) + " failed, see logs for details.")
             runs_executed += 1
-            time.sleep(int(self.interval))
+            if not sampler.done():
+                time.sleep(int(self.interval))
+        sink.close()
 
-    
-        self.buffer = buffer
+        self.sampler = sampler
         os.chdir(current)
         self.save_results()
 
-    def process_stats(self, results):
-        mean = statistics.mean(results)/1000
-        maximum = max(results)/1000
-        minimum = min(results)/1000
-        return [round(minimum, 2), round(maximum, 2), round(mean, 2)]
-    
+    # one omp-stream run, {kernel: MBytes/sec} or None when it failed
+    def measure(self, sink, label: list, threads: int, cpus: list, array_size: int):
+        result = stream_runner.run(
+            self.command(threads, cpus, array_size),
+            stream_runner.babelstream_row,
+            lambda row: sink(label + [threads, array_size * 8] + row),
+            shell=True,
+            wall_timeout=self.wall_timeout,
+            idle_timeout=self.idle_timeout,
+        )
+        if len(result.records) != 5:
+            print("CPU Stream failed on " + str(threads) + " threads with " + str(array_size) + " elements, see logs for details.")
+            return None
+        return {op: float(value) for op, value in result.records}
+
+    # bandwidth curves over the thread count (per NUMA node and across all of them) and over the array size
+    # (from in-cache to well beyond the last level cache), with the thread count where every kernel saturates
+    # and the array sizes where it falls out of cache
+    def run_scaling(self):
+        current = os.getcwd()
+        topo = topology.discover()
+        threads, cpus, array_size = self.layout(topo)
+        saturation = self.scaling.get("saturation", 0.95)
+        print(topology.summary(topo))
+        topology.save(dict(topo, settings={"threads": threads, "cpus": topology.format_cpulist(cpus), "array_size": array_size}), os.path.join(current, "Outputs", "CPUStream_Topology_" + self.machine_name + ".json"))
+        os.chdir(os.path.join(current, "CPUStream", "build"))
+
+        # threads are added round robin over the nodes, so "all" spreads across them from the start
+        scopes = [("node" + str(node), topology.primary_threads(topo, node)) for node in topology.cpu_nodes(topo)]
+        if len(scopes) > 1:
+            scopes.append(("all", [cpu for group in itertools.zip_longest(*[group for _, group in scopes]) for cpu in group if cpu is not None]))
+
+        sink = stream_runner.CSVSink(os.path.join(current, "Outputs", "CPUStream_Scaling_" + self.machine_name + ".csv"), ["Sweep", "Scope", "Threads", "Array Size (B)", "Operation", "MBytes/sec"])
+        summary = []
+        for scope, scope_cpus in scopes:
+            counts = sorted(set([2**i for i in range(len(scope_cpus).bit_length()) if 2**i <= len(scope_cpus)] + [len(scope_cpus)]))
+            print("Running CPU Stream thread scaling on " + scope + ", " + str(len(scope_cpus)) + " cores...")
+            curve = {}
+            for count in counts:
+                curve[count] = self.measure(sink, ["threads", scope], count, scope_cpus[:count], array_size)
+            self.print_curve(scope + " bandwidth (GB/s) by thread count", "Threads", curve)
+            for op in stream_runner.BABELSTREAM_FUNCTIONS:
+                points = [(count, values[op]) for count, values in curve.items() if values is not None]
+                if points:
+                    summary.append(["threads", scope, op, round(max(value for _, value in points) / 1000, 2), saturation_point(points, saturation), "-"])
+
+        # elements per array, from 128 KiB arrays to 16x the last level cache
+        llc = topology.last_level_cache(topo)
+        sizes = []
+        size = self.scaling.get("min_array_size", 2**14)
+        while size * 8 <= max(self.scaling.get("llc_multiple", 16) * llc, 8 * 2**25):
+            sizes.append(size)
+            size *= 2
+        print("Running CPU Stream array size scaling on " + str(threads) + " threads...")
+        curve = {}
+        for size in sizes:
+            curve[size * 8] = self.measure(sink, ["array_size", "all"], threads, cpus, size)
+        sink.close()
+        self.print_curve("Bandwidth (GB/s) by array size, last level cache " + str(llc // 1024**2) + " MiB", "Array Size (B)", curve)
+        for op in stream_runner.BABELSTREAM_FUNCTIONS:
+            points = [(size, values[op]) for size, values in curve.items() if values is not None]
+            if points:
+                summary.append(["array_size", "all", op, round(max(value for _, value in points) / 1000, 2), "-", ";".join(str(size) for size in transitions(points))])
+        os.chdir(current)
+
+        table1 = PrettyTable()
+        table1.field_names = ["Sweep", "Scope", "Operation", "Peak (GB/s)", "Saturation Threads", "Transitions (B)"]
+        for row in summary:
+            table1.add_row(row)
+        print(table1)
+        with open('Outputs/CPUStream_Scaling_Summary_' + self.machine_name + '.csv', 'w') as csvFile:
+            writer = csv.writer(csvFile, delimiter=',', quotechar='"', quoting=csv.QUOTE_MINIMAL)
+            writer.writerow(["Sweep", "Scope", "Operation", "Peak (GB/s)", "Saturation Threads", "Transitions (B)"])
+            for row in summary:
+                writer.writerow(row)
+
+    def print_curve(self, title: str, label: str, curve: dict):
+        table1 = PrettyTable()
+        table1.field_names = [label] + stream_runner.BABELSTREAM_FUNCTIONS
+        for point, values in curve.items():
+            table1.add_row([point] + (["-"] * 5 if values is None else [round(values[op] / 1000, 2) for op in stream_runner.BABELSTREAM_FUNCTIONS]))
+        print(title)
+        print(table1)
 
     def save_results(self):
-        copy = ["Copy"]
-        mul = ["Mul"]
-        add = ["Add"]
-        triad = ["Triad"]
-        dot = ["Dot"]
-        for log in self.buffer:
-            copy.append(float(log[0][1]))
-            mul.append(float(log[1][1]))
-            add.append(float(log[2][1]))
-            triad.append(float(log[3][1]))
-            dot.append(float(log[4][1]))
-
-        copy[1:] = self.process_stats(copy[1:])
-        mul[1:] = self.process_stats(mul[1:])
-        add[1:] = self.process_stats(add[1:])
-        triad[1:] = self.process_stats(triad[1:])
-        dot[1:] = self.process_stats(dot[1:])
-        
+        fields = ["Operation"] + sampling.fields("GB/s")
+        rows = self.sampler.rows(1000)
+
         table1 = PrettyTable()
-        table1.field_names = ["Operation","Min (GB/s)", "Max (GB/s)", "Mean (GB/s)"]
-        table1.add_row(copy)
-        table1.add_row(mul)
-        table1.add_row(add)
-        table1.add_row(triad)
-        table1.add_row(dot)
+        table1.field_names = fields
+        for row in rows:
+            table1.add_row(row)
         print(table1)
 
-        with open('../../Outputs/CPUStream_Performance_results_' + self.machine_name +'.csv', 'w') as csvFile:
+        with open('Outputs/CPUStream_Performance_results_' + self.machine_name +'.csv', 'w') as csvFile:
             writer = csv.writer(csvFile, delimiter=',', quotechar='"', quoting=csv.QUOTE_MINIMAL)
-            writer.writerow(["Operation","Min (TB/s)", "Max (TB/s)", "Mean (TB/s)"])
-            writer.writerow(copy)
-            writer.writerow(mul)
-            writer.writerow(add)
-            writer.writerow(triad)
-            writer.writerow(dot)
\ No newline at end of file
+            writer.writerow(fields)
+            for row in rows:
+                writer.writerow(row)
+
+
+# smallest thread count reaching the given fraction of the peak bandwidth, points are (threads, bandwidth)
+def saturation_point(points: list, fraction: float):
+    peak = max(value for _, value in points)
+    return min(count for count, value in points if value >= fraction * peak)
+
+
+# array sizes where the bandwidth drops by more than drop to the next size: the edges of the cache levels the
+# arrays fall out of, the last one being the move to DRAM. points are (array bytes, bandwidth)
+def transitions(points: list, drop: float = 0.25):
+    points = sorted(points)
+    return [size for (size, value), (_, after) in zip(points, points[1:]) if value > 0 and (value - after) / value > drop]
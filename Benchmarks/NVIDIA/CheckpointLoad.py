@@ -0,0 +1,130 @@
+import os
+import json
+from prettytable import PrettyTable
+from Infra import tools
+from Infra import checkpoint
+from Infra import sampling
+from Infra import storage
+from Infra import stream_runner
+
+FIELDS = ["Strategy", "Cache", "Run", "Bytes", "Seconds", "Throughput (GB/s)", "Time to First Tensor (ms)"]
+
+
+# how fast model weights are read back from local storage, the cold start of an inference replica. CPU and
+# storage only: the shards of directory, or synthetic safetensors shards on the local NVMe scratch mount,
+# loaded with each strategy of Infra/checkpoint.py from a cold and a warm page cache
+class CheckpointLoad:
+    def __init__(self, path: str, machine: str):
+        self.name = "CheckpointLoad"
+        self.machine_name = machine
+        config = self.get_config(path)
+        self.inputs = config["inputs"]
+        self.directory, self.strategies, self.caches, self.num_runs = self.config_conversion(config)
+        self.block = tools.parse_size(self.inputs.get("block_size", "16M"))
+        self.threads = self.inputs.get("threads", 8)
+        self.chunk = tools.parse_size(self.inputs.get("chunk_size", "256M"))
+        self.synthetic = self.inputs.get("synthetic", {})
+        self.sampling = sampling.from_config(self.inputs, self.num_runs)
+        self.samplers = {}
+        self.created = False
+
+    def get_config(self, path: str):
+        file = open(path)
+        data = json.load(file)
+        file.close()
+        try:
+            return data[self.name]
+        except KeyError:
+            raise KeyError("no value found")
+
+    def parse_json(self, config):
+        inputs = config['inputs']
+        return inputs.get('directory', ""), inputs.get('strategies', checkpoint.STRATEGIES), inputs.get('cache', ["cold", "warm"]), inputs.get('num_runs', 3)
+
+    def config_conversion(self, config):
+        return self.parse_json(config)
+
+    # the shards of the configured directory, or synthetic shards written to synthetic.directory (the local
+    # NVMe scratch mount when empty)
+    def shards(self):
+        if self.directory:
+            paths = checkpoint.shards(self.directory)
+            if not paths:
+                print("No checkpoint shards (" + ", ".join(checkpoint.PATTERNS) + ") found under " + self.directory)
+            return paths, None
+        directory = self.synthetic.get("directory") or os.path.join(storage.scratch(default=os.path.join(os.getcwd(), 'Outputs')), 'checkpoint-load')
+        self.created = not os.path.exists(directory)
+        paths = checkpoint.write_synthetic(
+            directory, self.synthetic.get("shards", 8), tools.parse_size(self.synthetic.get("shard_size", "2G")),
+            tools.parse_size(self.synthetic.get("tensor_size", "64M")),
+        )
+        return paths, directory
+
+    def run(self):
+        paths, synthetic = self.shards()
+        if not paths:
+            return
+        total = sum(os.path.getsize(path) for path in paths)
+        print("Running Checkpoint Load on " + str(len(paths)) + " shards, " + str(round(total / 1e9, 2)) + " GB...")
+        available = os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+
+        sink = stream_runner.CSVSink('Outputs/CheckpointLoad_Runs_' + self.machine_name + '.csv', FIELDS)
+        for strategy in self.strategies:
+            for cache in self.caches:
+                if cache == "warm" and total > 0.8 * available:
+                    print("Skipping warm " + strategy + ", the shards do not fit in the free memory")
+                    continue
+                sampler = sampling.Sampler(["Throughput (GB/s)", "Time to First Tensor (ms)"], **self.sampling)
+                while not sampler.done():
+                    if cache == "cold":
+                        checkpoint.evict(paths, self.inputs.get("drop_caches", True))
+                    else:
+                        checkpoint.warm(paths, self.block)
+                    print("Loading checkpoint with " + strategy + " reads, " + cache + " page cache...")
+                    try:
+                        size, seconds, first = checkpoint.load(strategy, paths, self.block, self.threads, self.chunk)
+                    except OSError as error:
+                        # e.g. O_DIRECT on a filesystem without direct I/O support
+                        print(strategy + " checkpoint load failed: " + str(error))
+                        tools.write_log(strategy + " checkpoint load failed: " + str(error))
+                        sampler.add(None)
+                        break
+                    first = seconds if first is None else first
+                    sink([strategy, cache, sampler.attempts + 1, size, round(seconds, 3), round(size / seconds / 1e9, 2), round(first * 1000, 2)])
+                    sampler.add({"Throughput (GB/s)": size / seconds / 1e9, "Time to First Tensor (ms)": first * 1000})
+                self.samplers[(strategy, cache)] = sampler
+        sink.close()
+
+        if synthetic is not None and not self.synthetic.get("keep", False):
+            self.remove(paths, synthetic)
+        self.save_results()
+
+    # removes the synthetic shards, and their directory only when this run created it, as synthetic.directory
+    # may be an existing scratch mount with other data
+    def remove(self, paths, directory):
+        for path in paths:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        if self.created:
+            try:
+                os.rmdir(directory)
+            except OSError:
+                pass
+
+    def save_results(self):
+        fields = ["Strategy", "Cache", "Metric"] + sampling.FIELDS
+        rows = [[strategy, cache] + row for (strategy, cache), sampler in self.samplers.items() for row in sampler.rows()]
+
+        table1 = PrettyTable()
+        table1.field_names = ["Strategy", "Cache", "Throughput (GB/s)", "Time to First Tensor (ms)", "Runs"]
+        for (strategy, cache), sampler in self.samplers.items():
+            throughput, first = sampler.rows()
+            table1.add_row([strategy, cache, throughput[1], first[1], throughput[-2]])
+        print(table1)
+
+        sink = stream_runner.CSVSink('Outputs/CheckpointLoad_' + self.machine_name + '.csv', fields)
+        for row in rows:
+            sink(row)
+        sink.close()
@@ -1,13 +1,27 @@
+import csv
 import subprocess
 import os
 from Infra import tools
+from Infra import build_scheduler
+from Infra import device_fanout
 
 class FlashAttention:
     def __init__(self, path:str, machine: str):
         self.name='FlashAttention'
         self.machine_name = machine
+        self.outlier_band = device_fanout.outlier_band(path)
+        self.wall_timeout, self.idle_timeout = device_fanout.timeouts(path)
         self.buffer = []
-      
+
+    def build_steps(self):
+        path = os.path.join(os.getcwd(), 'flash-attention')
+        return [
+            build_scheduler.BuildStep('flash-attention-clone', ['git', 'clone', 'https://github.com/Dao-AILab/flash-attention.git', path], skip_if=lambda: os.path.isdir(path)),
+        ]
+
+    def build(self):
+        build_scheduler.run_steps(self.build_steps())
+
     def run(self):
         current = os.getcwd()
         path ='flash-attention'
@@ -28,3 +42,22 @@ class FlashAttention:
         print(res[2])
         file.write(res[1] + "\n")
         file.write(res[2])
+
+
+    # runs the benchmark on every GPU at once and compares the Flash2 fwd + bwd TFLOPS of the
+    # batch_size=2, seqlen=8192 case between them
+    def run_pergpu(self):
+        current = os.getcwd()
+        devices = device_fanout.gpus("nvidia")
+        print("Running Flash Attention on " + str(len(devices)) + " GPUs at once...")
+        results = device_fanout.run(["python3", "benchmark_flash_attention.py"], devices, "nvidia", device_fanout.tflops_parser, cwd=os.path.join(current, 'flash-attention/benchmarks'), wall_timeout=self.wall_timeout, idle_timeout=self.idle_timeout)
+
+        values = {}
+        for index, result in results.items():
+            values[index] = result.records[0] if result.records else None
+
+        with open("Outputs/FlashAttention_PerGPU_" + self.machine_name + ".csv", "w") as csvFile:
+            writer = csv.writer(csvFile, delimiter=',', quotechar='"', quoting=csv.QUOTE_MINIMAL)
+            writer.writerow(["GPU", "NUMA", "TFLOPS", "Deviation (%)", "Outlier"])
+            for row in device_fanout.compare("TFLOPS", values, devices, self.outlier_band):
+                writer.writerow(row)
@@ -6,6 +6,12 @@ import datetime
 import time
 import csv
 from Infra import tools
+from Infra import build_scheduler
+from Infra import artifact_cache
+from Infra import adaptive_sweep
+from Infra import soak
+from Infra import device_fanout
+from Benchmarks.NVIDIA import gemm_batch_worker
 from prettytable import PrettyTable
 
 class GEMMCublastLt:
@@ -13,17 +19,30 @@ class GEMMCublastLt:
         self.name = "GEMMCublasLt"
         config = self.get_config(path)
         self.m, self.n, self.k, self.duration, self.datatype = self.config_conversion(config)
+        self.sweep_budget, self.sweep_threshold, self.coarse_points = self.parse_json(config, "sweep")
+        self.batched, self.batch_devices, self.batch_warmup = self.parse_json(config, "batch")
+        self.calibrate_counts, self.min_iters, self.max_iters, self.warmup_fraction = self.parse_json(config, "calibration")
+        self.soak_shapes, self.soak_interval, self.soak_threshold = self.parse_json(config, "soak")
+        self.pergpu_shapes = self.parse_json(config, "pergpu")
+        self.outlier_band = device_fanout.outlier_band(path)
+        self.wall_timeout, self.idle_timeout = device_fanout.timeouts(path)
+        self.pool = None
         self.b = b
         self.i = i
         self.w = w
-        self.bindir = ''
+        self.bindir = os.path.join(os.getcwd(), "bin")
         self.machine_name = machine
         self.buffer = []
+        self.cache = artifact_cache.from_config(path)
 
         # A100 does not support fp8
         if "A100" in machine:
             self.datatype = "fp16"
 
+        if self.batched and self.datatype not in gemm_batch_worker.DTYPES:
+            print("The batched GEMM workers do not support " + self.datatype + ", measuring with cublaslt_gemm")
+            self.batched = False
+
     def get_config(self, path: str):
         file = open(path)
         data = json.load(file)
@@ -38,6 +57,20 @@ class GEMMCublastLt:
             return config["inputs"]["duration"]
         if var == "datatype":
             return config["inputs"]["datatype"]
+        if var == "sweep":
+            sweep = config["inputs"].get("sweep", {})
+            return sweep.get("budget", 3600), sweep.get("threshold", 0.1), sweep.get("coarse_points", 5)
+        if var == "batch":
+            batch = config["inputs"].get("batch", {})
+            return batch.get("enabled", False), batch.get("devices", 0), batch.get("warmup", 10)
+        if var == "soak":
+            soak = config["inputs"].get("soak", {})
+            return soak.get("shapes", [[8192, 8192, 8192]]), soak.get("interval", 1.0), soak.get("threshold", 0.05)
+        if var == "pergpu":
+            return config["inputs"].get("pergpu", {}).get("shapes", [[8192, 8192, 8192]])
+        if var == "calibration":
+            calibration = config["inputs"].get("calibration", {})
+            return calibration.get("enabled", True), calibration.get("min_iters", 20), calibration.get("max_iters", 100000), calibration.get("warmup_fraction", 0.2)
         start = config["inputs"][var]["start"]
         end = config["inputs"][var]["end"]
         interval = config["inputs"][var]["interval"]
@@ -54,46 +87,216 @@ class GEMMCublastLt:
         datatype = self.parse_json(config, "datatype")
         return m, n, k, duration, datatype
 
-    def build(self):
-        bindir = tools.create_dir("bin")
-        self.bindir = bindir
-        path = "superbenchmark"
-        isdir = os.path.isdir(path)
-        if not isdir:
-            results = subprocess.run(
-                [
-                    "git",
-                    "clone",
-                    "https://github.com/gitaumark/superbenchmark",
-                    path,
-                ],
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-            )
-            tools.write_log(tools.check_error(results))
+    def build_steps(self):
+        self.bindir = tools.create_dir("bin")
         current = os.getcwd()
+        path = os.path.join(current, "superbenchmark")
         build_path = os.path.join(
-            current,
-            "superbenchmark/superbench/benchmarks/micro_benchmarks/cublaslt_gemm",
+            path,
+            "superbench/benchmarks/micro_benchmarks/cublaslt_gemm",
         )
-        os.chdir(build_path)
+        url = "https://github.com/gitaumark/superbenchmark"
+        inputs = lambda: dict(artifact_cache.toolchain(), commit=artifact_cache.upstream_commit(url, path), arch=artifact_cache.gpu_arch(), flags="cmake -S ./")
+        cached = artifact_cache.CachedBuild(self.cache, "cublaslt_gemm", inputs, {"cublaslt_gemm": os.path.join(self.bindir, "cublaslt_gemm")})
+        return cached.steps([
+            build_scheduler.BuildStep(
+                "superbenchmark-clone",
+                ["git", "clone", url, path],
+                skip_if=lambda: os.path.isdir(path),
+            ),
+            build_scheduler.BuildStep("cublaslt_gemm-cmake", ["cmake", "-S", "./"], cwd=build_path, deps=["superbenchmark-clone"]),
+            build_scheduler.BuildStep("cublaslt_gemm-make", ["make"], cwd=build_path, deps=["cublaslt_gemm-cmake"]),
+            build_scheduler.BuildStep("cublaslt_gemm-install", ["mv", "cublaslt_gemm", self.bindir], cwd=build_path, deps=["cublaslt_gemm-make"]),
+        ])
 
-        results = subprocess.run(
-            ["cmake", "-S", "./"], stdout=subprocess.PIPE, stderr=subprocess.PIPE
-        )
-        tools.write_log(tools.check_error(results))
+    def build(self):
+        build_scheduler.run_steps(self.build_steps())
 
-        results = subprocess.run(
-            ["make"], stdout=subprocess.PIPE, stderr=subprocess.PIPE
-        )
+    def shape_cmd(self, m: int, n: int, k: int, w: int = None, i: int = None):
+        return [
+            os.path.join(self.bindir, "cublaslt_gemm"),
+            "-m",
+            str(m),
+            "-n",
+            str(n),
+            "-k",
+            str(k),
+            "-b",
+            str(self.b),
+            "-i",
+            str(self.i if i is None else i),
+            "-w",
+            str(self.w if w is None else w),
+            "-t",
+            self.datatype,
+        ]
+
+    # parses the [M, N, K, Batch, Time(us), TFLOPS] row of a finished run, None if the run failed
+    def parse_shape(self, results):
         tools.write_log(tools.check_error(results))
-        print(results.stderr.decode('utf-8'))
-        results = subprocess.run(
-            ["mv", "cublaslt_gemm", bindir],
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-        )
-        os.chdir(current)
+        log = results.stdout.decode('utf-8').split()
+        if results.returncode != 0 or len(log) < 6:
+            return None
+        return log
+
+    # cublaslt_gemm result line, m n k batch time(us) TFLOPS
+    def shape_row(self, line: str):
+        fields = line.split()
+        try:
+            float(fields[5])
+        except (IndexError, ValueError):
+            return None
+        return fields
+
+    # runs a single shape on the default GPU
+    def run_shape(self, m: int, n: int, k: int, w: int = None, i: int = None):
+        results = subprocess.run(self.shape_cmd(m, n, k, w, i), stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        return self.parse_shape(results)
+
+    # times a short run of the shape and scales the warmup and measurement counts so the shape takes
+    # about target seconds, which keeps run time bounded and noise even across small and large shapes
+    def calibrate(self, m: int, n: int, k: int, target: float):
+        log = self.run_shape(m, n, k, 5, self.min_iters)
+        if log is None or float(log[4]) <= 0:
+            return self.w, self.i
+        total = target / (float(log[4]) / 1e6)
+        w = int(min(self.w, max(5, total * self.warmup_fraction)))
+        i = int(min(self.max_iters, max(self.min_iters, total * (1 - self.warmup_fraction))))
+        return w, i
+
+    # limit caps the number of GPUs used, 0 means all of them
+    def start_workers(self, limit: int = None):
+        limit = self.batch_devices if limit is None else limit
+        if self.pool is None:
+            num_gpus = len(subprocess.run(["nvidia-smi", "-L"], stdout=subprocess.PIPE, stderr=subprocess.PIPE).stdout.decode('utf-8').strip().split("\n"))
+            if limit:
+                num_gpus = min(num_gpus, limit)
+            print("Starting batched GEMM workers on " + str(num_gpus) + " GPUs...")
+            self.pool = gemm_batch_worker.BatchWorkerPool(list(range(num_gpus)), os.path.dirname(self.bindir))
+        return self.pool
+
+    def stop_workers(self):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool = None
+
+    # yields ((m, n, k), row) as shapes complete, row is None if the shape failed
+    # the batched path sends the whole list to one warm worker per GPU instead of one process per shape
+    # with calibration on, every shape is measured for about target seconds and the row records the counts used
+    def measure(self, shapes: list, target: float):
+        if not self.calibrate_counts:
+            target = None
+
+        if not self.batched:
+            for m, n, k in shapes:
+                w, i = self.calibrate(m, n, k, target) if target else (self.w, self.i)
+                log = self.run_shape(m, n, k, w, i)
+                yield (m, n, k), None if log is None else log[:6] + [str(w), str(i), "cublaslt_gemm"]
+            return
+
+        options = {
+            "datatype": self.datatype,
+            "b": self.b,
+            "warmup": self.batch_warmup,
+            "iters": self.i,
+            "target_time": target,
+            "min_iters": self.min_iters,
+            "max_iters": self.max_iters,
+            "warmup_fraction": self.warmup_fraction,
+        }
+        for device, record in self.start_workers().run(shapes, options):
+            shape = (record["m"], record["n"], record["k"])
+            if "error" in record:
+                tools.write_log("GEMM " + str(shape) + " failed on GPU " + str(device) + ": " + record["error"])
+                yield shape, None
+            else:
+                yield shape, [str(value) for value in shape] + [str(record[key]) for key in ["b", "time_us", "tflops", "warmup", "iters", "engine"]]
+
+    # samples the M/N/K grid from config.json coarsely, then refines where TFLOPS changes sharply
+    # (tile and wave quantization cliffs) until the sweep budget is used up
+    def run_sweep(self):
+        print("Running CublasLt sweep with datatype " + self.datatype + " for up to " + str(self.sweep_budget) + " s...")
+        path = 'Outputs/GEMMCublasLt_Sweep_' + self.machine_name + '_' + self.datatype + '.csv'
+        with open(path, 'w') as csvFile:
+            writer = csv.writer(csvFile, delimiter=',', quotechar='"', quoting=csv.QUOTE_MINIMAL)
+            writer.writerow(["M", "N", "K", "Batch", "Time(us)", "TFLOPS", "Warmup", "Iterations", "Engine", "Phase"])
+
+            # the duration from config.json is spread over the coarse grid
+            coarse = 1
+            for axis in [self.m, self.n, self.k]:
+                coarse *= min(len(axis), self.coarse_points)
+
+            def measure(shapes, phase):
+                for shape, log in self.measure(shapes, self.duration / coarse):
+                    if log is None:
+                        yield shape, None
+                        continue
+                    # stream every point so an interrupted sweep keeps what it measured
+                    writer.writerow(log + [phase])
+                    csvFile.flush()
+                    yield shape, float(log[5])
+
+            batch_size = 4 * self.start_workers().size() if self.batched else 1
+            sweep = adaptive_sweep.AdaptiveSweep([self.m, self.n, self.k], measure, self.sweep_budget, self.sweep_threshold, self.coarse_points, batch_size)
+            results = sweep.run()
+        self.stop_workers()
+
+        measured = [value for value in results.values() if value is not None]
+        print("Measured " + str(len(results)) + " shapes, peak " + str(max(measured, default=0)) + " TFLOPS. Results in " + path)
+
+    # holds the soak shapes on every GPU for duration seconds and records a TFLOPS time series per GPU,
+    # which shows the clock and power throttling that short peak runs hide
+    def run_soak(self):
+        if self.datatype not in gemm_batch_worker.DTYPES:
+            print("The GEMM soak runs on the batched GEMM workers, which do not support " + self.datatype + ", skipping")
+            return
+        print("Running CublasLt soak with datatype " + self.datatype + " for " + str(self.duration) + " s on every GPU...")
+        pool = self.start_workers(0)
+
+        series = {}
+        request = {"mode": "soak", "shapes": self.soak_shapes, "duration": self.duration, "interval": self.soak_interval, "datatype": self.datatype, "b": self.b}
+        with open('Outputs/GEMMCublasLt_Soak_' + self.machine_name + '_' + self.datatype + '.csv', 'w') as csvFile:
+            writer = csv.writer(csvFile, delimiter=',', quotechar='"', quoting=csv.QUOTE_MINIMAL)
+            writer.writerow(["GPU", "Time(s)", "TFLOPS"])
+            for device, record in pool.broadcast(request):
+                if "error" in record:
+                    print("Soak failed on GPU " + str(device) + ": " + record["error"])
+                    continue
+                series.setdefault(device, []).append((record["t"], record["tflops"]))
+                writer.writerow([device, record["t"], record["tflops"]])
+                csvFile.flush()
+        self.stop_workers()
+
+        table1 = PrettyTable()
+        fields = ["GPU", "Initial TFLOPS", "Sustained TFLOPS", "Min TFLOPS", "Drop (%)", "Time to throttle (s)"]
+        table1.field_names = fields
+        with open('Outputs/GEMMCublasLt_Soak_Summary_' + self.machine_name + '_' + self.datatype + '.csv', 'w') as csvFile:
+            writer = csv.writer(csvFile, delimiter=',', quotechar='"', quoting=csv.QUOTE_MINIMAL)
+            writer.writerow(fields)
+            for device in sorted(series):
+                summary = soak.summarize(series[device], self.soak_threshold)
+                row = [device, summary["initial"], summary["sustained"], summary["min"], summary["drop"], summary["throttle"] if summary["throttle"] is not None else "-"]
+                writer.writerow(row)
+                table1.add_row(row)
+        print(table1)
+
+    # runs the pergpu shapes on every GPU at once with the same warmup and iteration counts and flags the GPUs
+    # whose TFLOPS fall outside the configured band around the node median
+    def run_pergpu(self):
+        devices = device_fanout.gpus("nvidia")
+        print("Running CublasLt with datatype " + self.datatype + " on " + str(len(devices)) + " GPUs at once...")
+        with open('Outputs/GEMMCublasLt_PerGPU_' + self.machine_name + '_' + self.datatype + '.csv', 'w') as csvFile:
+            writer = csv.writer(csvFile, delimiter=',', quotechar='"', quoting=csv.QUOTE_MINIMAL)
+            writer.writerow(["M", "N", "K", "GPU", "NUMA", "TFLOPS", "Deviation (%)", "Outlier"])
+            for m, n, k in self.pergpu_shapes:
+                w, i = self.calibrate(m, n, k, self.duration / len(self.pergpu_shapes)) if self.calibrate_counts else (self.w, self.i)
+                results = device_fanout.run(self.shape_cmd(m, n, k, w, i), devices, "nvidia", lambda: self.shape_row, wall_timeout=self.wall_timeout, idle_timeout=self.idle_timeout)
+                values = {}
+                for index, result in results.items():
+                    values[index] = float(result.records[-1][5]) if result.ok() and result.records else None
+                print("M=" + str(m) + " N=" + str(n) + " K=" + str(k))
+                for row in device_fanout.compare("TFLOPS", values, devices, self.outlier_band):
+                    writer.writerow([m, n, k] + row)
 
     # run GEMM with predetermined matrix sizes that are commonly used in transformers
     def run_model_sizes(self):
@@ -112,38 +315,16 @@ class GEMMCublastLt:
             n_dims = [1024, 2048, 4096, 8192, 16384, 2145, 12288, 192, 192]
             k_dims = [1024, 2048, 4096, 8192, 16384, 1024, 12288, 192, 768]
         os.chdir(self.bindir)
-        buffer = []
-        for i in range(len(m_dims)):
-            results = subprocess.run(
-                [
-                    "./cublaslt_gemm",
-                    "-m",
-                    str(m_dims[i]),
-                    "-n",
-                    str(n_dims[i]),
-                    "-k",
-                    str(k_dims[i]),
-                    "-b",
-                    str(self.b),
-                    "-i",
-                    str(self.i),
-                    "-w",
-                    str(self.w),
-                    "-t",
-                    self.datatype,
-                ],
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-            )
-            log = results.stdout.decode('utf-8').split()
-            buffer.append(log)
-            tools.write_log(tools.check_error(results))
+        shapes = list(zip(m_dims, n_dims, k_dims))
+        logs = dict(self.measure(shapes, self.duration / len(shapes)))
+        self.stop_workers()
+        buffer = [logs[shape] for shape in shapes if logs.get(shape) is not None]
         table1 = PrettyTable()
 
         with open('../Outputs/GEMMCublasLt_Performance_' + self.machine_name + '_' + self.datatype+'.csv', 'w') as csvFile:
             writer = csv.writer(csvFile, delimiter=',', quotechar='"', quoting=csv.QUOTE_MINIMAL)
-            writer.writerow(["M", "N", "K", "Batch", "Time(us)", "TFLOPS"])
-            table1.field_names = ["M", "N", "K", "Batch Size", "Time(us)", "TFLOPS"]
+            writer.writerow(["M", "N", "K", "Batch", "Time(us)", "TFLOPS", "Warmup", "Iterations", "Engine"])
+            table1.field_names = ["M", "N", "K", "Batch Size", "Time(us)", "TFLOPS", "Warmup", "Iterations", "Engine"]
             for item in buffer:
                 writer.writerow(item)
                 table1.add_row(item)
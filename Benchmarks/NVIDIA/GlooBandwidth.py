@@ -0,0 +1,239 @@
+import os
+import sys
+import json
+import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor
+from Infra import tools
+from Infra import multinode
+from Infra import collectives
+from Infra import stream_runner
+from Infra import alpha_beta
+
+# bus bandwidth factor of each collective, as defined by nccl-tests
+BUS_FACTORS = {
+    "all_reduce": lambda n: 2 * (n - 1) / n,
+    "all_gather": lambda n: (n - 1) / n,
+    "reduce_scatter": lambda n: (n - 1) / n,
+}
+
+# upper bound of the iterations sized to target_time, for the smallest messages
+MAX_ITERS = 10000
+
+
+# host-side collective bandwidth over the torch.distributed gloo backend between local processes. It needs no
+# GPU, so it runs on CPU-only head nodes, and writes the same rows as NCCLBandwidth so the same tables, fits
+# and comparisons apply
+class GlooBandwidth:
+    def __init__(self, path: str, machine: str):
+        self.name = "GlooBandwidth"
+        self.machine_name = machine
+        config = self.get_config(path)
+        self.start, self.end, self.num_procs, self.collectives, self.target_time = self.config_conversion(config)
+        self.wall_timeout, self.idle_timeout = stream_runner.timeouts(config['inputs'], 3600, 600)
+        self.fit_baseline, self.fit_drift, self.fit_regimes = alpha_beta.from_config(path)
+
+    def get_config(self, path: str):
+        file = open(path)
+        data = json.load(file)
+        file.close()
+        try:
+            return data[self.name]
+        except KeyError:
+            raise KeyError("no value found")
+
+    def parse_json(self, config):
+        inputs = config['inputs']
+        return inputs['start'], inputs['end'], inputs['num_procs'], inputs.get('collectives', list(BUS_FACTORS)), inputs.get('target_time', 1.0)
+
+    def config_conversion(self, config):
+        return self.parse_json(config)
+
+    # message sizes from start to end doubling, skipping the ones whose buffers do not fit in the free memory
+    def sizes(self):
+        sizes = []
+        size = collectives.parse_size(self.start)
+        end = collectives.parse_size(self.end)
+        available = available_memory()
+        while size <= end:
+            # every process holds an input and an output buffer of the full size
+            if available is not None and 2 * self.num_procs * size > 0.8 * available:
+                print("Skipping message sizes from " + collectives.format_size(size) + " up, they do not fit in the free memory")
+                break
+            sizes.append(size)
+            size *= 2
+        return sizes
+
+    # every rank is a python3 -m Benchmarks.NVIDIA.GlooBandwidth process started like the local launcher of
+    # Infra.multinode does, so the ranks never import the runner. Rank 0 saves the rows and prints the tables,
+    # the output of a failed rank goes to the log
+    def run(self):
+        sizes = self.sizes()
+        if not sizes:
+            return
+        print("Running gloo " + ", ".join(self.collectives) + " on " + str(self.num_procs) + " local processes")
+        path = os.path.join(os.getcwd(), 'Outputs', 'GlooBandwidth_' + self.machine_name + '.csv')
+        cmd = [sys.executable, '-m', 'Benchmarks.NVIDIA.GlooBandwidth', '--collective'] + self.collectives + [
+            '--start', str(sizes[0]), '--end', str(sizes[-1]), '--backend', 'gloo', '--target_time', str(self.target_time), '--output', path]
+        env = {"MASTER_ADDR": "127.0.0.1", "MASTER_PORT": str(multinode.free_port())}
+        units = multinode.LocalLauncher().units([self.machine_name], self.num_procs, cmd, env)
+        root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+        def start_unit(unit):
+            rank, cmd, environment = unit
+            return stream_runner.run(cmd, print if rank == 0 else lambda line: None, cwd=root, env=environment, wall_timeout=self.wall_timeout, idle_timeout=self.idle_timeout)
+
+        with ThreadPoolExecutor(max_workers=len(units)) as pool:
+            results = list(pool.map(start_unit, units))
+        if not all(result.ok() for result in results):
+            print("gloo ranks failed, see Outputs/log.txt for details")
+            return
+
+        print("Fitted latency and bandwidth:")
+        alpha_beta.report([path], 'Outputs/GlooBandwidth_Fit_' + self.machine_name + '.csv', self.fit_baseline, self.fit_drift, self.fit_regimes)
+
+
+def available_memory():
+    try:
+        with open("/proc/meminfo") as file:
+            for line in file:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+# one rank of the sweep, rank 0 saves every row as soon as it is measured (options["path"]) or prints it as an
+# nccl-tests result row for Infra.multinode to parse (options["print_rows"])
+def worker(rank: int, options: dict):
+    import torch
+    import torch.distributed as dist
+
+    torch.set_num_threads(options["threads"])
+    world_size = options["world_size"]
+    device = torch.device("cpu")
+    if options["backend"] == "nccl":
+        device = torch.device("cuda", options.get("local_rank", 0))
+        torch.cuda.set_device(device)
+    dist.init_process_group(options["backend"], init_method=options["init_method"], rank=rank, world_size=world_size)
+
+    sink = None
+    if rank == 0 and options.get("path"):
+        sink = stream_runner.CSVSink(options["path"], collectives.FIELDS, collectives.row)
+    results = []
+
+    for collective in options["collectives"]:
+        if collective not in BUS_FACTORS:
+            if rank == 0:
+                print("gloo benchmark does not support " + collective + ", skipping")
+            continue
+        counts = []
+        for size in options["sizes"]:
+            # buffers are split evenly between the ranks, so the smallest sizes round up to the same count
+            count = max(world_size, size // 4 // world_size * world_size)
+            if count in counts:
+                continue
+            counts.append(count)
+            try:
+                oop = measure(torch, dist, collective, count, world_size, rank, False, options["target_time"], device)
+                ip = measure(torch, dist, collective, count, world_size, rank, True, options["target_time"], device)
+            except (RuntimeError, ValueError) as e:
+                if rank == 0:
+                    print("gloo " + collective + " failed: " + str(e))
+                    tools.write_log("gloo " + collective + " failed: " + str(e))
+                break
+            if rank == 0:
+                nbytes = count * 4
+                fields = [collective, options["backend"], "default", nbytes, count, "float", "none" if collective == "all_gather" else "sum", -1]
+                for time_us in [oop, ip]:
+                    algbw = nbytes / time_us / 1e3
+                    fields += [round(time_us, 2), round(algbw, 2), round(algbw * BUS_FACTORS[collective](world_size), 2), "N/A"]
+                result = collectives.CollectiveResult(*fields)
+                if sink is not None:
+                    sink(result)
+                if options.get("print_rows"):
+                    print(" ".join(str(value) for value in result[3:]), flush=True)
+                results.append(result)
+
+    if sink is not None:
+        sink.close()
+        collectives.print_tables(results)
+    dist.destroy_process_group()
+
+
+# average time of one collective in us, the slowest rank counts
+# count is the number of float elements of the full buffer (nccl-tests convention): the all_reduce buffer,
+# the all_gather output and the reduce_scatter input
+def measure(torch, dist, collective, count, world_size, rank, in_place, target_time, device):
+    chunk = count // world_size
+    full = torch.ones(count, dtype=torch.float32, device=device)
+    if collective == "all_reduce":
+        data = full if in_place else full.clone()
+        op = lambda: dist.all_reduce(data)
+    elif collective == "all_gather":
+        part = full.narrow(0, rank * chunk, chunk) if in_place else torch.ones(chunk, dtype=torch.float32, device=device)
+        op = lambda: dist.all_gather_into_tensor(full, part)
+    else:
+        part = full.narrow(0, rank * chunk, chunk) if in_place else torch.empty(chunk, dtype=torch.float32, device=device)
+        op = lambda: dist.reduce_scatter_tensor(part, full)
+
+    def sync():
+        if device.type == "cuda":
+            torch.cuda.synchronize(device)
+
+    # one warmup iteration also sizes the measurement to about target_time, agreed on by all ranks
+    start = time.perf_counter()
+    op()
+    sync()
+    elapsed = torch.tensor([time.perf_counter() - start], dtype=torch.float64, device=device)
+    dist.all_reduce(elapsed, op=dist.ReduceOp.MAX)
+    iters = int(min(MAX_ITERS, max(2, target_time / max(elapsed.item(), 1e-9))))
+
+    dist.barrier()
+    start = time.perf_counter()
+    for _ in range(iters):
+        op()
+    sync()
+    elapsed = torch.tensor([(time.perf_counter() - start) / iters], dtype=torch.float64, device=device)
+    dist.all_reduce(elapsed, op=dist.ReduceOp.MAX)
+    return elapsed.item() * 1e6
+
+
+# a rank of a multi-node job started by Infra.multinode, or of the local gloo run, the rank comes from the
+# launcher's environment
+#   python3 -m Benchmarks.NVIDIA.GlooBandwidth --collective all_reduce --start 8 --end 8G --backend nccl
+def main(argv: list):
+    parser = argparse.ArgumentParser(description="One rank of a torch.distributed collective size sweep")
+    parser.add_argument("--collective", nargs="+", default=["all_reduce"], choices=list(BUS_FACTORS))
+    parser.add_argument("--start", default="8")
+    parser.add_argument("--end", default="8G")
+    parser.add_argument("--backend", default="nccl", choices=["nccl", "gloo"])
+    parser.add_argument("--target_time", type=float, default=1.0)
+    parser.add_argument("--output", help="CSV rank 0 saves the rows to, instead of printing them as result rows")
+    args = parser.parse_args(argv)
+
+    env = lambda names, default: next((os.environ[name] for name in names if name in os.environ), default)
+    rank = int(env(["RANK", "OMPI_COMM_WORLD_RANK"], 0))
+    local_world_size = int(env(["LOCAL_WORLD_SIZE", "OMPI_COMM_WORLD_LOCAL_SIZE"], 1))
+    sizes = []
+    size = collectives.parse_size(args.start)
+    while size <= collectives.parse_size(args.end):
+        sizes.append(size)
+        size *= 2
+    worker(rank, {
+        "init_method": "tcp://" + os.environ["MASTER_ADDR"] + ":" + os.environ["MASTER_PORT"],
+        "backend": args.backend,
+        "world_size": int(env(["WORLD_SIZE", "OMPI_COMM_WORLD_SIZE"], 1)),
+        "local_rank": int(env(["LOCAL_RANK", "OMPI_COMM_WORLD_LOCAL_RANK"], 0)),
+        "sizes": sizes,
+        "collectives": args.collective,
+        "target_time": args.target_time,
+        "threads": max(1, (os.cpu_count() or 1) // local_world_size),
+        "path": args.output,
+        "print_rows": args.output is None,
+    })
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
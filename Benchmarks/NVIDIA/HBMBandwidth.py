@@ -1,10 +1,13 @@
 import json
 import os
 import statistics
-import subprocess
 import time
 import csv
-from Infra import tools
+from Infra import build_scheduler
+from Infra import artifact_cache
+from Infra import device_fanout
+from Infra import stream_runner
+from Infra import sampling
 from prettytable import PrettyTable
 
 class HBMBandwidth:
@@ -13,8 +16,12 @@ class HBMBandwidth:
         self.machine_name = machine
         config = self.get_config(path)
         self.num_runs, self.interval = self.config_conversion(config)
+        self.sampling = sampling.from_config(config["inputs"], self.num_runs)
+        self.outlier_band = device_fanout.outlier_band(path)
+        self.wall_timeout, self.idle_timeout = stream_runner.timeouts(config["inputs"], 600, 120)
+        self.cache = artifact_cache.from_config(path)
 
-        self.buffer = []
+        self.sampler = None
 
     def get_config(self, path: str):
         file = open(path)
@@ -31,116 +38,102 @@ class HBMBandwidth:
     def config_conversion(self, config) -> tuple[list, list, list]:
         return self.parse_json(config)
 
-    def build(self):
+    def build_steps(self):
         current = os.getcwd()
-
-        path = "BabelStream"
-        isdir = os.path.isdir(path)
-        if not isdir:
-            results = subprocess.run(
-                ["git", "clone", "https://github.com/gitaumark/BabelStream",  path],
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-            )
-            tools.write_log(tools.check_error(results))
-
-        build_path = os.path.join(current, "BabelStream")
-        os.chdir(build_path)
-
-        babelstream_build_path = os.path.join(build_path, "build")
+        path = os.path.join(current, "BabelStream")
+        babelstream_build_path = os.path.join(path, "build")
 
         arch ="sm_90"
         if "A100" in self.machine_name:
             arch = "sm_80"
 
-        if not os.path.isdir(babelstream_build_path):
-            os.mkdir(babelstream_build_path)
-            os.chdir(babelstream_build_path)
-            results = subprocess.run(
-                [
-                    "cmake",
-                    "../",
-                    "-DMODEL=cuda",
-                    "-DCUDA_ARCH=" + arch,
-                    "-DCMAKE_CUDA_COMPILER=/usr/local/cuda/bin/nvcc",
-                ],
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-            )
-            tools.write_log(tools.check_error(results))
-
-            results = subprocess.run(
-                ["make"], stdout=subprocess.PIPE, stderr=subprocess.PIPE
-            )
-            tools.write_log(tools.check_error(results))
-        else:
-            os.chdir(babelstream_build_path)
+        url = "https://github.com/gitaumark/BabelStream"
+        flags = ["-DMODEL=cuda", "-DCUDA_ARCH=" + arch, "-DCMAKE_CUDA_COMPILER=/usr/local/cuda/bin/nvcc"]
+        inputs = lambda: dict(artifact_cache.toolchain(), commit=artifact_cache.upstream_commit(url, path), arch=arch, flags=" ".join(flags))
+        cached = artifact_cache.CachedBuild(self.cache, "cuda-stream", inputs, {"cuda-stream": os.path.join(babelstream_build_path, "cuda-stream")})
+        return cached.steps([
+            build_scheduler.BuildStep(
+                "babelstream-clone",
+                ["git", "clone", url,  path],
+                skip_if=lambda: os.path.isdir(path),
+            ),
+            build_scheduler.BuildStep(
+                "cuda-stream-cmake",
+                ["cmake", "-S", path, "-B", babelstream_build_path] + flags,
+                deps=["babelstream-clone"],
+            ),
+            build_scheduler.BuildStep("cuda-stream-make", ["make"], cwd=babelstream_build_path, deps=["cuda-stream-cmake"]),
+        ])
+
+    def build(self):
+        build_scheduler.run_steps(self.build_steps())
 
 
     def run(self):
         current = os.getcwd()
+        os.chdir(os.path.join(current, "BabelStream", "build"))
         print("Running HBM Bandwidth...")
 
         runs_executed = 0
-        buffer = []
-        while runs_executed < self.num_runs:
-            results = subprocess.run(
-                ["./cuda-stream"], stdout=subprocess.PIPE, stderr=subprocess.PIPE
-            )
-            tools.write_log(tools.check_error(results))
-            log = results.stdout.decode("utf-8").strip().split("\n")[14:19]
-            for i in range(len(log)):
-                temp = log[i].split()
-                log[i] = [temp[0], temp[1]]
-            buffer.append(log)
+        sampler = sampling.Sampler(stream_runner.BABELSTREAM_FUNCTIONS, **self.sampling)
+        # every result line is saved as soon as BabelStream prints it
+        sink = stream_runner.CSVSink(os.path.join(current, "Outputs", "HBMBandwidth_Runs_" + self.machine_name + ".csv"), ["Run", "Operation", "MBytes/sec"])
+        # runs until the median of every kernel is known to the target precision
+        while not sampler.done():
+            result = stream_runner.run(["./cuda-stream"], stream_runner.babelstream_row, lambda row: sink([runs_executed] + row), wall_timeout=self.wall_timeout, idle_timeout=self.idle_timeout)
+            if len(result.records) == 5:
+                sampler.add({op: float(value) for op, value in result.records})
+            else:
+                sampler.add(None)
+                print("HBM Bandwidth run " + str(runs_executed) + " failed, see logs for details.")
             runs_executed += 1
-            time.sleep(int(self.interval))
-
+            if not sampler.done():
+                time.sleep(int(self.interval))
+        sink.close()
 
-        self.buffer = buffer
+        self.sampler = sampler
         os.chdir(current)
         self.save_results()
 
-    def process_stats(self, results):
-        mean = statistics.mean(results)/1000000
-        maximum = max(results)/1000000
-        minimum = min(results)/1000000
-        return [round(minimum, 2), round(maximum, 2), round(mean, 2)]
+    # runs cuda-stream on every GPU at once for num_runs rounds and flags the GPUs whose mean bandwidth
+    # falls outside the configured band around the node median
+    def run_pergpu(self):
+        current = os.getcwd()
+        devices = device_fanout.gpus("nvidia")
+        print("Running HBM Bandwidth on " + str(len(devices)) + " GPUs at once...")
+        cwd = os.path.join(current, "BabelStream", "build")
+        buffers = {device["index"]: [] for device in devices}
+        for _ in range(self.num_runs):
+            for index, result in device_fanout.run(["./cuda-stream"], devices, "nvidia", lambda: stream_runner.babelstream_row, cwd=cwd, wall_timeout=self.wall_timeout, idle_timeout=self.idle_timeout).items():
+                if len(result.records) == 5:
+                    buffers[index].append(result.records)
+                else:
+                    print("HBM Bandwidth failed on GPU " + str(index) + ", see logs for details.")
+            time.sleep(int(self.interval))
 
+        with open('Outputs/HBMBandwidth_PerGPU_' + self.machine_name + '.csv', 'w') as csvFile:
+            writer = csv.writer(csvFile, delimiter=',', quotechar='"', quoting=csv.QUOTE_MINIMAL)
+            writer.writerow(["Operation", "GPU", "NUMA", "Mean (TB/s)", "Deviation (%)", "Outlier"])
+            for op, name in enumerate(["Copy", "Mul", "Add", "Triad", "Dot"]):
+                values = {}
+                for index, buffer in buffers.items():
+                    values[index] = statistics.mean(float(log[op][1]) for log in buffer) / 1000000 if buffer else None
+                print(name)
+                for row in device_fanout.compare("Mean (TB/s)", values, devices, self.outlier_band):
+                    writer.writerow([name] + row)
 
     def save_results(self):
-        copy = ["Copy"]
-        mul = ["Mul"]
-        add = ["Add"]
-        triad = ["Triad"]
-        dot = ["Dot"]
-        for log in self.buffer:
-            copy.append(float(log[0][1]))
-            mul.append(float(log[1][1]))
-            add.append(float(log[2][1]))
-            triad.append(float(log[3][1]))
-            dot.append(float(log[4][1]))
-
-        copy[1:] = self.process_stats(copy[1:])
-        mul[1:] = self.process_stats(mul[1:])
-        add[1:] = self.process_stats(add[1:])
-        triad[1:] = self.process_stats(triad[1:])
-        dot[1:] = self.process_stats(dot[1:])
+        fields = ["Operation"] + sampling.fields("TB/s")
+        rows = self.sampler.rows(1000000)
 
         table1 = PrettyTable()
-        table1.field_names = ["Operation","Min (TB/s)", "Max (TB/s)", "Mean (TB/s)"]
-        table1.add_row(copy)
-        table1.add_row(mul)
-        table1.add_row(add)
-        table1.add_row(triad)
-        table1.add_row(dot)
+        table1.field_names = fields
+        for row in rows:
+            table1.add_row(row)
         print(table1)
 
-        with open('../../Outputs/HBMBandwidth_Performance_results_' + self.machine_name +'.csv', 'w') as csvFile:
+        with open('Outputs/HBMBandwidth_Performance_results_' + self.machine_name +'.csv', 'w') as csvFile:
             writer = csv.writer(csvFile, delimiter=',', quotechar='"', quoting=csv.QUOTE_MINIMAL)
-            writer.writerow(["Operation","Min (TB/s)", "Max (TB/s)", "Mean (TB/s)"])
-            writer.writerow(copy)
-            writer.writerow(mul)
-            writer.writerow(add)
-            writer.writerow(triad)
-            writer.writerow(dot)
+            writer.writerow(fields)
+            for row in rows:
+                writer.writerow(row)
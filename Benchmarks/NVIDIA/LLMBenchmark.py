@@ -1,5 +1,7 @@
 import os
 from Infra import tools
+from Infra import build_scheduler
+from Infra import manifest
 import subprocess
 import json
 from prettytable import PrettyTable
@@ -45,8 +47,14 @@ class LLMBenchmark:
         # Clone TensorRT-LLM repo
         if not os.path.exists(os.path.join(self.dir_path, 'TensorRT-LLM')):
             print("Cloning TensorRT-LLM reopsitory from https://github.com/NVIDIA/TensorRT-LLM.git")
-            i4 = subprocess.run("git clone https://github.com/NVIDIA/TensorRT-LLM.git && cd TensorRT-LLM && git checkout v0.18.2", shell=True,stdout=subprocess.PIPE,stderr=subprocess.PIPE)
-            tools.write_log(tools.check_error(i4))
+        build_scheduler.run_steps(self.build_steps())
+
+    def build_steps(self):
+        path = os.path.join(self.dir_path, 'TensorRT-LLM')
+        return [
+            build_scheduler.BuildStep('tensorrt-llm-clone', ['git', 'clone', 'https://github.com/NVIDIA/TensorRT-LLM.git', path], skip_if=lambda: os.path.exists(path)),
+            build_scheduler.BuildStep('tensorrt-llm-checkout', ['git', 'checkout', 'v0.18.2'], cwd=path, deps=['tensorrt-llm-clone']),
+        ]
 
     def download_models(self):
         for model_name in self.config['models']:
@@ -100,30 +108,41 @@ class LLMBenchmark:
                     be2 = subprocess.run(build_engine_command, shell=True,stdout=subprocess.PIPE,stderr=subprocess.PIPE)
                     tools.write_log(tools.check_error(be2))
 
-    def run_benchmark(self):
-        for model_name in self.config['models']:
-            if self.config['models'][model_name]['use_model'] and self.config['models'][model_name]['type'] == "nvidia":
-                print("Benchmarking ", model_name)
-                for i in range(len(self.config['models'][model_name]['input_sizes'])):
-                    isl = self.config['models'][model_name]['input_sizes'][i]
-                    osl = self.config['models'][model_name]['output_sizes'][i]
-                    tp = self.config['models'][model_name]['tp_size']
-                    name = model_name.split('/')[1]
-
-                    print(name + " input/output: " + str(isl) + "/" + str(osl) + " tp size: " + str(tp))
-                    dataset_path = self.dir_path + "/datasets/" + name + "_synthetic_" + str(isl) + "_" + str(osl) + ".txt"
-                    results_path = self.dir_path + "/Outputs/results_" + name + "_" + str(isl) + "_" + str(osl) + ".txt"
-
-                    run_benchmark_command = f'''
-                        trtllm-bench \
-                        --model {model_name} throughput\
-                        --dataset {dataset_path} \
-                        --engine_dir {self.dir_path + "/engines/" + model_name + "/tp_" + str(tp) + "_pp_1"} > {results_path}
-                        '''
+    # every model and input/output size is a unit of the run manifest, a resumed run skips the ones that are done
+    def unit(self, model_name, isl, osl):
+        return self.name + "/" + model_name + "/" + str(isl) + "_" + str(osl)
 
+    def run_benchmark(self):
+        models = [model_name for model_name in self.config['models'] if self.config['models'][model_name]['use_model'] and self.config['models'][model_name]['type'] == "nvidia"]
+        manifest.runs.plan([self.unit(model_name, isl, osl) for model_name in models for isl, osl in zip(self.config['models'][model_name]['input_sizes'], self.config['models'][model_name]['output_sizes'])])
+        for model_name in models:
+            print("Benchmarking ", model_name)
+            for i in range(len(self.config['models'][model_name]['input_sizes'])):
+                isl = self.config['models'][model_name]['input_sizes'][i]
+                osl = self.config['models'][model_name]['output_sizes'][i]
+                tp = self.config['models'][model_name]['tp_size']
+                name = model_name.split('/')[1]
+                unit = self.unit(model_name, isl, osl)
+                if manifest.runs.skip(unit):
+                    continue
+
+                print(name + " input/output: " + str(isl) + "/" + str(osl) + " tp size: " + str(tp))
+                dataset_path = self.dir_path + "/datasets/" + name + "_synthetic_" + str(isl) + "_" + str(osl) + ".txt"
+                results_path = self.dir_path + "/Outputs/results_" + name + "_" + str(isl) + "_" + str(osl) + ".txt"
+
+                run_benchmark_command = f'''
+                    trtllm-bench \
+                    --model {model_name} throughput\
+                    --dataset {dataset_path} \
+                    --engine_dir {self.dir_path + "/engines/" + model_name + "/tp_" + str(tp) + "_pp_1"} > {results_path}
+                    '''
+
+                with manifest.runs.unit(unit, ["results_" + name + "_" + str(isl) + "_" + str(osl) + ".txt"]):
                     be2 = subprocess.run(run_benchmark_command, shell=True,stdout=subprocess.PIPE,stderr=subprocess.PIPE)
                     self.extract_benchmark_info(results_path)
                     tools.write_log(tools.check_error(be2))
+                    if be2.returncode != 0:
+                        manifest.runs.fail(unit, "trtllm-bench exited with " + str(be2.returncode))
 
     def extract_benchmark_info(self, file_path):
         keywords = [
@@ -1,43 +1,283 @@
 import json
 import os
 import statistics
-import subprocess
-import time
 import csv
-from Infra import tools
+from typing import NamedTuple
+from Infra import build_scheduler
+from Infra import artifact_cache
+from Infra import stream_runner
+from Infra import topology
 from prettytable import PrettyTable
 
+# one pointer chase, latency in ns
+class LatencyRecord(NamedTuple):
+    cpu_node: int
+    cpu: int
+    memory_node: int
+    working_set: int
+    latency: float
+
+
+# multichase prints the best sample latency in ns as its only output line
+def parse_latency(line: str):
+    try:
+        return float(line.strip())
+    except ValueError:
+        return None
+
+
+# multiload prints a tab separated header and one row of values, e.g. ChaseNS (latency of the chase thread)
+# and LdAvgMibs (bandwidth of all load threads together); returns the row as {column: value}
+class MultiloadParser:
+    def __init__(self):
+        self.header = None
+
+    def __call__(self, line: str):
+        fields = line.split()
+        if "ChaseNS" in fields:
+            self.header = fields
+            return None
+        if self.header is None or len(fields) != len(self.header) or not fields[0].isdigit():
+            return None
+        return dict(zip(self.header, fields))
+
+
 class Multichase:
     def __init__(self, path:str, machine: str):
         self.name = "Multichase"
         self.machine_name = machine
-    
-    def build(self):
+        config = self.get_config(path)
+        self.samples, self.sweep_samples, self.stride = self.config_conversion(config)
+        self.loaded = config["inputs"].get("loaded", {})
+        self.wall_timeout, self.idle_timeout = stream_runner.timeouts(config["inputs"], 600, None)
+        self.cache = artifact_cache.from_config(path)
+        self.records = []
+
+    def get_config(self, path: str):
+        file = open(path)
+        data = json.load(file)
+        file.close()
+        try:
+            return data[self.name]
+        except KeyError:
+            raise KeyError("no value found")
+
+    def parse_json(self, config):
+        return config["inputs"]["samples"], config["inputs"]["sweep_samples"], config["inputs"]["stride"]
+
+    def config_conversion(self, config) -> tuple[list, list, list]:
+        return self.parse_json(config)
+
+    def build_steps(self):
         current = os.getcwd()
-        path = "multichase"
-        isdir = os.path.isdir(path)
-        if not isdir:
-            results = subprocess.run(
-                ["git", "clone", "https://github.com/google/multichase",  path],
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-            )
-            tools.write_log(tools.check_error(results))
-
-            build_path = os.path.join(current, "multichase")
-            os.chdir(build_path)
-            
-            results = subprocess.run("make", shell=True, stdout=subprocess.PIPE,stderr=subprocess.PIPE)
-            tools.write_log(tools.check_error(results))
-            os.chdir(current)
+        path = os.path.join(current, "multichase")
+        url = "https://github.com/google/multichase"
+        inputs = lambda: dict(artifact_cache.toolchain(), commit=artifact_cache.upstream_commit(url, path), cpu=artifact_cache.cpu_model(), flags="make")
+        cached = artifact_cache.CachedBuild(self.cache, "multichase", inputs, {"multichase": os.path.join(path, "multichase"), "multiload": os.path.join(path, "multiload")})
+        return cached.steps([
+            build_scheduler.BuildStep(
+                "multichase-clone",
+                ["git", "clone", url,  path],
+                skip_if=lambda: os.path.isdir(path),
+            ),
+            build_scheduler.BuildStep(
+                "multichase-make",
+                ["make"],
+                cwd=path,
+                deps=["multichase-clone"],
+            ),
+        ])
+
+    def build(self):
+        build_scheduler.run_steps(self.build_steps())
+
+    # pointer chase from one CPU over a working set bound to one NUMA node, every sample is about half a second
+    def measure(self, cpu_node: int, cpu: int, memory_node: int, working_set: int, samples: int):
+        result = stream_runner.run(
+            ["numactl", "-C", str(cpu), "-m", str(memory_node), "./multichase/multichase", "-s", str(self.stride), "-m", str(working_set // 1024) + "k", "-n", str(samples)],
+            parse_latency,
+            wall_timeout=self.wall_timeout,
+            idle_timeout=self.idle_timeout,
+        )
+        if not result.ok() or not result.records:
+            print("Multichase failed on CPU " + str(cpu) + " with node " + str(memory_node) + " memory, see logs for details.")
+            return None
+        record = LatencyRecord(cpu_node, cpu, memory_node, working_set, result.records[-1])
+        self.records.append(record)
+        return record
 
     def run(self):
-        current = os.getcwd()
+        topo = topology.discover()
         print("Running Multichase...")
+        print(topology.summary(topo))
+        cpus = {node: topology.primary_threads(topo, node)[0] for node in topology.cpu_nodes(topo)}
+        nodes = topology.memory_nodes(topo)
+        # the matrix working set is 4x the last level cache, so every chase misses in cache
+        dram = max(2**30, 4 * topology.last_level_cache(topo))
+        topology.save(dict(topo, settings={"cpus": cpus, "nodes": nodes, "working_set": dram}), "Outputs/Multichase_Topology_" + self.machine_name + ".json")
+
+        print("Latency from every CPU node to every memory node, " + str(dram // 1024**2) + " MiB working set")
+        matrix = {}
+        for cpu_node, cpu in cpus.items():
+            for memory_node in nodes:
+                matrix[(cpu_node, memory_node)] = self.measure(cpu_node, cpu, memory_node, dram, self.samples)
+        self.save_matrix(cpus, nodes, matrix)
+
+        # the sweep runs on the first CPU node against its own memory and the nearest other node
+        cpu_node = min(cpus)
+        remote = [node for node in nodes if node != cpu_node]
+        targets = [("local", cpu_node)] + ([("remote", topology.nearest(topo, cpu_node, remote))] if remote else [])
+        caches = cache_levels(topo, cpus[cpu_node])
+        sizes = sweep_sizes(caches, dram)
+        curves = {}
+        for label, memory_node in targets:
+            print("Latency by working set, " + label + " memory (node " + str(memory_node) + ")")
+            curves[label] = [self.measure(cpu_node, cpus[cpu_node], memory_node, size, self.sweep_samples) for size in sizes]
+        self.save_curves(curves, caches, dram)
+
+    # latency of a pointer chase while load threads stream over memory of the same node, stepping the number of
+    # load threads from none to every other core of the node: the latency against bandwidth curve and its knee
+    def run_loaded(self):
+        topo = topology.discover()
+        print("Running Multichase loaded latency...")
+        print(topology.summary(topo))
+        load = self.loaded.get("load", "stream-sum")
+        knee = self.loaded.get("knee", 1.0)
+        working_set = max(2**30, 4 * topology.last_level_cache(topo))
+
+        sink = stream_runner.CSVSink("Outputs/Multichase_Loaded_" + self.machine_name + ".csv", ["Node", "Load", "Load Threads", "Bandwidth (MiB/s)", "Latency (ns)"])
+        summary = []
+        for node in topology.cpu_nodes(topo):
+            cpus = topology.primary_threads(topo, node)
+            steps = sorted(set([0] + [2**i for i in range(len(cpus).bit_length()) if 2**i < len(cpus)] + [len(cpus) - 1]))
+            print("Loaded latency on node " + str(node) + ", " + str(len(cpus)) + " cores, " + load + " load")
+            curve = []
+            for loads in steps:
+                # the chase is one of the -t threads, the others generate load
+                result = stream_runner.run(
+                    ["numactl", "-C", topology.format_cpulist(cpus[:loads + 1]), "-m", str(node), "./multichase/multiload",
+                     "-s", str(self.stride), "-m", str(working_set // 1024) + "k", "-n", str(self.sweep_samples), "-t", str(loads + 1), "-c", "chaseload", "-l", load],
+                    MultiloadParser(),
+                    wall_timeout=self.wall_timeout,
+                    idle_timeout=self.idle_timeout,
+                )
+                if not result.ok() or not result.records:
+                    print("Multiload failed with " + str(loads) + " load threads on node " + str(node) + ", see logs for details.")
+                    continue
+                row = result.records[-1]
+                bandwidth = float(row.get("LdAvgMibs", 0)) if loads else 0.0
+                point = [node, load, loads, round(bandwidth, 1), round(float(row["ChaseNS"]), 1)]
+                sink(point)
+                curve.append(point)
+
+            table1 = PrettyTable()
+            table1.field_names = ["Load Threads", "Bandwidth (MiB/s)", "Latency (ns)"]
+            for point in curve:
+                table1.add_row(point[2:])
+            print(table1)
+            if curve:
+                summary.append([node] + loaded_knee([(point[3], point[4]) for point in curve], knee))
+        sink.close()
+
+        fields = ["Node", "Idle Latency (ns)", "Knee Bandwidth (MiB/s)", "Knee Latency (ns)", "Max Bandwidth (MiB/s)", "Latency at Max (ns)"]
+        table1 = PrettyTable()
+        table1.field_names = fields
+        for row in summary:
+            table1.add_row(row)
+        print(table1)
+        with open("Outputs/Multichase_Loaded_Summary_" + self.machine_name + ".csv", "w") as csvFile:
+            writer = csv.writer(csvFile, delimiter=',', quotechar='"', quoting=csv.QUOTE_MINIMAL)
+            writer.writerow(fields)
+            for row in summary:
+                writer.writerow(row)
+
+    def save_matrix(self, cpus: dict, nodes: list, matrix: dict):
+        fields = ["CPU Node", "CPU"] + ["Node " + str(node) + " (ns)" for node in nodes]
+        rows = []
+        for cpu_node, cpu in cpus.items():
+            rows.append([cpu_node, cpu] + ["-" if matrix[(cpu_node, node)] is None else round(matrix[(cpu_node, node)].latency, 1) for node in nodes])
+
+        table1 = PrettyTable()
+        table1.field_names = fields
+        for row in rows:
+            table1.add_row(row)
+        print(table1)
+
+        with open("Outputs/Multichase_Matrix_" + self.machine_name + ".csv", "w") as csvFile:
+            writer = csv.writer(csvFile, delimiter=',', quotechar='"', quoting=csv.QUOTE_MINIMAL)
+            writer.writerow(fields)
+            for row in rows:
+                writer.writerow(row)
+
+    def save_curves(self, curves: dict, caches: list, dram: int):
+        with open("Outputs/Multichase_Curve_" + self.machine_name + ".csv", "w") as csvFile:
+            writer = csv.writer(csvFile, delimiter=',', quotechar='"', quoting=csv.QUOTE_MINIMAL)
+            writer.writerow(["Memory", "CPU Node", "CPU", "Memory Node", "Working Set (B)", "Latency (ns)"])
+            for label, records in curves.items():
+                for record in records:
+                    if record is not None:
+                        writer.writerow([label, record.cpu_node, record.cpu, record.memory_node, record.working_set, round(record.latency, 1)])
+
+        table1 = PrettyTable()
+        table1.field_names = ["Working Set (B)"] + [label + " (ns)" for label in curves]
+        for i, record in enumerate(next(iter(curves.values()))):
+            table1.add_row([record.working_set if record is not None else "-"] + ["-" if records[i] is None else round(records[i].latency, 1) for records in curves.values()])
+        print(table1)
+
+        rows = plateaus(curves, caches, dram)
+        table1 = PrettyTable()
+        table1.field_names = ["Level", "Capacity (B)", "Latency (ns)", "Points"]
+        for row in rows:
+            table1.add_row(row)
+        print(table1)
+        with open("Outputs/Multichase_Levels_" + self.machine_name + ".csv", "w") as csvFile:
+            writer = csv.writer(csvFile, delimiter=',', quotechar='"', quoting=csv.QUOTE_MINIMAL)
+            writer.writerow(["Level", "Capacity (B)", "Latency (ns)", "Points"])
+            for row in rows:
+                writer.writerow(row)
+
+
+# data and unified caches seen by one CPU as [(name, bytes)], smallest first
+def cache_levels(topo: dict, cpu: int):
+    levels = []
+    for cache in topo["caches"]:
+        if cache["type"] != "Instruction" and cpu in topology.parse_cpulist(cache["cpus"]):
+            levels.append(("L" + str(cache["level"]), cache["size"]))
+    return sorted(levels, key=lambda level: level[1])
+
+
+# working sets doubling from a quarter of the first level cache to 4x the largest working set of the matrix
+def sweep_sizes(caches: list, dram: int):
+    size = max(4096, caches[0][1] // 4 if caches else 4096)
+    sizes = []
+    while size <= 4 * dram:
+        sizes.append(size)
+        size *= 2
+    return sizes
+
+
+# median latency of the working sets that fit in each cache level but not in the one before it (at most half
+# its capacity, so the chase does not spill), then of the ones beyond 4x the last level for local and remote DRAM
+def plateaus(curves: dict, caches: list, dram: int):
+    local = [record for record in curves.get("local", []) if record is not None]
+    rows = []
+    previous = 0
+    for name, capacity in caches:
+        points = [record.latency for record in local if previous < record.working_set <= capacity // 2]
+        rows.append([name, capacity, round(statistics.median(points), 1) if points else "-", len(points)])
+        previous = capacity
+    limit = 4 * caches[-1][1] if caches else dram
+    for label in curves:
+        points = [record.latency for record in curves[label] if record is not None and record.working_set >= limit]
+        rows.append([label.capitalize() + " DRAM", "-", round(statistics.median(points), 1) if points else "-", len(points)])
+    return rows
 
-        results = subprocess.run("cd Benchmarks/NVIDIA && sudo chmod 777 run_multichase.sh && ./run_multichase.sh",shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        tools.write_log(tools.check_error(results))
-        print(results.stdout.decode("utf-8"))
 
-        file = open("Outputs/Multichase_" + self.machine_name + ".txt", "w")
-        file.write(results.stdout.decode("utf-8"))
+# points are (bandwidth, latency) from idle to full load. The knee is the last point before the latency rises
+# more than knee times above idle latency, i.e. the bandwidth a pipeline can use before latency blows up
+def loaded_knee(points: list, knee: float):
+    idle = points[0][1]
+    below = [point for point in points if point[1] <= idle * (1 + knee)]
+    at_knee = below[-1] if below else points[0]
+    at_max = max(points, key=lambda point: point[0])
+    return [idle, at_knee[0], at_knee[1], at_max[0], at_max[1]]
@@ -1,10 +1,13 @@
 import json
 import os
-import csv
+import sys
 import subprocess
-import csv
-from Infra import tools
-from prettytable import PrettyTable
+from Infra import build_scheduler
+from Infra import artifact_cache
+from Infra import stream_runner
+from Infra import collectives
+from Infra import alpha_beta
+from Infra import multinode
 
 class NCCLBandwidth:
     def __init__(self, path:str, machine: str):
@@ -12,8 +15,13 @@ class NCCLBandwidth:
         self.machine_name = machine
         config = self.get_config(path)
         self.start, self.end, self.num_gpus = self.config_conversion(config)
+        self.wall_timeout, self.idle_timeout = stream_runner.timeouts(config['inputs'], 3600, 600)
+        self.runs = list(collectives.runs(config['inputs'], {"all_reduce": {"algos": ["NVLS"]}}))
+        self.fit_baseline, self.fit_drift, self.fit_regimes = alpha_beta.from_config(path)
         self.buffer = []
-        self.algo = "NVLS"
+        self.cache = artifact_cache.from_config(path)
+        self.multinode = multinode.Multinode(path, self.name, machine)
+        self.mpi_home = config['inputs'].get('mpi_home', '')
 
     def get_config(self, path: str):
         file = open(path)
@@ -30,71 +38,93 @@ class NCCLBandwidth:
     def config_conversion(self, config)->tuple[list, list, list]:
         return self.parse_json(config)
 
-    def build(self):
+    def build_steps(self):
         current = os.getcwd()
-        path ='nccl'
-        isdir = os.path.isdir(path)
-        if not isdir:
-            print("Building NCCL Library...")
-            results = subprocess.run(['git', 'clone', 'https://github.com/NVIDIA/nccl.git', path], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-            build_path = os.path.join(current, 'nccl')
-            os.chdir(build_path)
-            results = subprocess.run('make -j src.build', shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-            tools.write_log(tools.check_error(results))
-            os.chdir(current)
-
-        results = subprocess.run('export NCCL_HOME=' + current + '/nccl/build', shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        results = subprocess.run('export LD_LIBRARY_PATH=' + current + '/nccl/build/lib:$LD_LIBRARY_PATH', shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        nccl_path = os.path.join(current, 'nccl')
+        tests_path = os.path.join(current, 'nccl-tests')
+        nccl_url = 'https://github.com/NVIDIA/nccl.git'
+        tests_url = 'https://github.com/NVIDIA/nccl-tests.git'
+        inputs = lambda: dict(
+            artifact_cache.toolchain(),
+            commit=artifact_cache.upstream_commit(tests_url, tests_path),
+            nccl_commit=artifact_cache.upstream_commit(nccl_url, nccl_path),
+            arch=artifact_cache.gpu_arch(),
+            flags='make',
+        )
+        artifacts = {binary: os.path.join(tests_path, 'build', binary) for binary in collectives.COLLECTIVES.values()}
+        cached = artifact_cache.CachedBuild(self.cache, 'nccl-tests', inputs, artifacts)
+        steps = cached.steps([
+            build_scheduler.BuildStep('nccl-clone', ['git', 'clone', nccl_url, nccl_path], skip_if=lambda: os.path.isdir(nccl_path)),
+            build_scheduler.BuildStep('nccl-make', ['make', 'src.build'], cwd=nccl_path, deps=['nccl-clone'], skip_if=lambda: os.path.isdir(os.path.join(nccl_path, 'build', 'lib'))),
+            build_scheduler.BuildStep('nccl-tests-clone', ['git', 'clone', tests_url, tests_path], skip_if=lambda: os.path.isdir(tests_path)),
+            build_scheduler.BuildStep('nccl-tests-make', ['make'], cwd=tests_path, deps=['nccl-tests-clone']),
+        ])
+        # multi-node runs through mpirun need the MPI build, kept next to the single node one
+        if self.mpi_home:
+            steps.append(build_scheduler.BuildStep(
+                'nccl-tests-mpi-make',
+                ['make', 'MPI=1', 'MPI_HOME=' + self.mpi_home, 'BUILDDIR=build_mpi'],
+                cwd=tests_path,
+                deps=['nccl-tests-cache-store'],
+                skip_if=lambda: os.path.isfile(os.path.join(tests_path, 'build_mpi', 'all_reduce_perf')),
+            ))
+        return steps
 
-        path ='nccl-tests'
-        isdir = os.path.isdir(path)
-        if not isdir:
-            print("Building NCCL Test..")
-            results = subprocess.run(['git', 'clone', 'https://github.com/NVIDIA/nccl-tests.git', path], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-            build_path = os.path.join(current, 'nccl-tests')
-            os.chdir(build_path)
-            results = subprocess.run(['make'], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-            tools.write_log(tools.check_error(results))
-        else:
-            build_path = os.path.join(current, 'nccl-tests')
-            os.chdir(build_path)
+    def build(self):
+        print("Building NCCL Library and NCCL Tests...")
+        build_scheduler.run_steps(self.build_steps())
 
     def run(self):
         current = os.getcwd()
-        buffer=[["8 ","16 ","32 ","64 ","128 ","256 ","512 ","1K","2K","4K","8K","16K","32K","65K","132K","256K", "524K","1M","2M","4M","8M","16M","33M","67M","134M","268M","536M","1G","2G","4G","8G"]]
+        os.chdir(os.path.join(current, 'nccl-tests'))
         num_gpus = str(subprocess.run("nvidia-smi --query-gpu=name --format=csv,noheader | wc -l", shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE).stdout.decode('utf-8')).strip()
-        if num_gpus == '4':
-            self.algo = "Ring"
 
-        print("Running NCCL AllReduce on " + num_gpus + " GPUs")
-      
-        results = subprocess.run('NCCL_ALGO='+ self.algo +' ./build/all_reduce_perf -b 8 -e 8G -f 2 -g ' + num_gpus + ' -n 40 | grep float', shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        tools.write_log(tools.check_error(results))
-        res = results.stdout.decode('utf-8').split('\n')
-        log = []
-        for line in res:
-            line = line.split()
-            if len(line) == 13:
-                log.append(line[11])
+        # every message size is saved as soon as nccl-tests prints it
+        sink = stream_runner.CSVSink(os.path.join(current, 'Outputs', 'NCCLBandwidth_' + self.machine_name + '.csv'), collectives.FIELDS, collectives.row)
+        buffer = []
+        for collective, algo, proto in self.runs:
+            # NVLS needs NVSwitch, 4 GPU systems fall back to Ring
+            if algo == "NVLS" and num_gpus == '4':
+                algo = "Ring"
+            print("Running NCCL " + collective + " (algo " + algo + ", proto " + proto + ") on " + num_gpus + " GPUs")
+            result = stream_runner.run(
+                ['./build/' + collectives.COLLECTIVES[collective]] + collectives.args(self.start, self.end, num_gpus),
+                lambda line: collectives.parse_row(collective, algo, proto, line),
+                sink,
+                env=dict(os.environ, **collectives.env(algo, proto)),
+                wall_timeout=self.wall_timeout,
+                idle_timeout=self.idle_timeout,
+            )
+            buffer += result.records
+        sink.close()
 
-        buffer.append(log)
-
-        table1 = PrettyTable()
-        runs = ["Message Size", "Bandwidth (" + self.algo + ")"]
-        for i in range(len(buffer)):
-            table1.add_column(runs[i], buffer[i])
-        print(table1)
+        collectives.print_tables(buffer)
         self.buffer=buffer
-        self.save()
         os.chdir(current)
 
+        print("Fitted latency and bandwidth:")
+        alpha_beta.report([sink.file.name], 'Outputs/NCCLBandwidth_Fit_' + self.machine_name + '.csv', self.fit_baseline, self.fit_drift, self.fit_regimes)
+
+    # what every rank of a multi-node job runs, one GPU per rank
+    def rank_command(self, collective, start, end):
+        if self.multinode.program == "nccl-tests":
+            return [os.path.join(os.getcwd(), 'nccl-tests', 'build_mpi', collectives.COLLECTIVES[collective])] + collectives.args(start, end, 1)
+        return [sys.executable, '-m', 'Benchmarks.NVIDIA.GlooBandwidth', '--collective', collective, '--start', str(start), '--end', str(end), '--backend', self.multinode.backend]
 
-    def save(self):
-        with open('../Outputs/NCCLBandwidth_' + self.machine_name + '.csv', 'w') as csvFile:
-            writer = csv.writer(csvFile, delimiter=',', quotechar='"', quoting=csv.QUOTE_MINIMAL)
-            writer.writerow(["Message Size", "Bandwidth (" + self.algo + ")"])
+    # the MPI build of nccl-tests is only built when inputs.mpi_home is set
+    def mpi_build(self):
+        if self.multinode.program != "nccl-tests" or os.path.isfile(self.rank_command(self.runs[0][0], self.start, self.end)[0]):
+            return True
+        if not self.mpi_home:
+            print("nccl-tests is not built with MPI, set NCCLBandwidth.inputs.mpi_home in config.json to the MPI installation (e.g. /usr/mpi/gcc/openmpi-4.1.7a1) to build it to nccl-tests/build_mpi")
+        else:
+            print("nccl-tests/build_mpi is missing, the MPI build with " + self.mpi_home + " failed, see Outputs/log.txt for details")
+        return False
 
-            for i in range(len(self.buffer[0])):
-                row = [self.buffer[0][i], self.buffer[1][i]]
-                writer.writerow(row)
+    def run_multinode(self):
+        if self.mpi_build():
+            self.multinode.run(self.runs, self.start, self.end, self.rank_command)
 
+    def run_bisect(self):
+        if self.mpi_build():
+            self.multinode.bisect(self.runs[0], self.rank_command)
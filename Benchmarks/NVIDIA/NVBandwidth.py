@@ -2,6 +2,8 @@ import json
 import subprocess
 import os
 from Infra import tools
+from Infra import build_scheduler
+from Infra import artifact_cache
 
 class NVBandwidth:
     def __init__(self, path:str, machine: str):
@@ -9,6 +11,7 @@ class NVBandwidth:
         self.machine_name = machine
         config = self.get_config(path)
         self.num_runs, self.interval = self.config_conversion(config)
+        self.cache = artifact_cache.from_config(path)
         self.buffer = []
 
     def get_config(self, path: str):
@@ -26,22 +29,46 @@ class NVBandwidth:
     def config_conversion(self, config)->tuple[list, list, list]:
         return self.parse_json(config)
 
-    def build(self):
+    def build_steps(self):
         current = os.getcwd()
-        path ='nvbandwidth'
-        isdir = os.path.isdir(path)
-        if not isdir:
-            results = subprocess.run(['git', 'clone', 'https://github.com/NVIDIA/nvbandwidth', path], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        build_path = os.path.join(current, 'nvbandwidth')
-        os.chdir(build_path)
-        results = subprocess.run(['sed', '-i', '2i\set(CMAKE_CUDA_COMPILER /usr/local/cuda/bin/nvcc)', 'CMakeLists.txt'], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-
-        if os.path.exists("/.dockerenv"):
-            results = subprocess.run('apt update && ./debian_install.sh', shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        else:
-            results = subprocess.run('sudo apt update && sudo ./debian_install.sh', shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        tools.write_log(tools.check_error(results))
-        os.chdir(current)
+        path = os.path.join(current, 'nvbandwidth')
+        cmakelists = os.path.join(path, 'CMakeLists.txt')
+
+        sudo = '' if os.path.exists("/.dockerenv") else 'sudo '
+        install_cmd = sudo + 'apt update && ' + sudo + './debian_install.sh'
+
+        url = 'https://github.com/NVIDIA/nvbandwidth'
+        inputs = lambda: dict(artifact_cache.toolchain(), commit=artifact_cache.upstream_commit(url, path), arch=artifact_cache.gpu_arch(), flags='debian_install.sh')
+        cached = artifact_cache.CachedBuild(self.cache, 'nvbandwidth', inputs, {'nvbandwidth': os.path.join(path, 'nvbandwidth')})
+        steps = cached.steps([
+            build_scheduler.BuildStep('nvbandwidth-clone', ['git', 'clone', url, path], skip_if=lambda: os.path.isdir(path)),
+            build_scheduler.BuildStep(
+                'nvbandwidth-nvcc',
+                ['sed', '-i', '2i\\set(CMAKE_CUDA_COMPILER /usr/local/cuda/bin/nvcc)', 'CMakeLists.txt'],
+                cwd=path,
+                deps=['nvbandwidth-clone'],
+                skip_if=lambda: 'CMAKE_CUDA_COMPILER' in open(cmakelists).read(),
+            ),
+            build_scheduler.BuildStep(
+                'nvbandwidth-install',
+                install_cmd,
+                cwd=path,
+                shell=True,
+                deps=['nvbandwidth-nvcc'],
+            ),
+        ])
+        # a restored binary still needs the boost runtime that debian_install.sh would have installed
+        steps.append(build_scheduler.BuildStep(
+            'nvbandwidth-runtime',
+            sudo + 'apt-get install -y libboost-program-options-dev',
+            shell=True,
+            deps=['nvbandwidth-cache-store'],
+            skip_if=lambda: not cached.hit,
+        ))
+        return steps
+
+    def build(self):
+        build_scheduler.run_steps(self.build_steps())
 
     def run(self):
         current = os.getcwd()
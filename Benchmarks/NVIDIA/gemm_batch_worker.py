@@ -0,0 +1,217 @@
+import os
+import sys
+import json
+import time
+import queue
+import threading
+import subprocess
+
+# Long-lived GEMM worker, one per GPU. It creates the CUDA context and warms the device up once, then reads
+# requests from stdin (one JSON object per line) and answers with one JSON line per measured shape:
+#   request: {"shapes": [[m, n, k], ...], "b": 1, "warmup": 10, "iters": 1000, "datatype": "fp8e4m3", "target_time": 2.0}
+#   results: {"m": m, "n": n, "k": k, "b": b, "time_us": t, "tflops": f, "warmup": w, "iters": i, "engine": e} or {"m": ..., "error": "..."}
+#   end:     {"done": true}
+# with target_time set, warmup and iters are calibrated per shape to take about target_time seconds
+#
+# soak request: {"mode": "soak", "shapes": [[m, n, k], ...], "duration": 120, "interval": 1.0, "datatype": "fp8e4m3"}
+# keeps the shapes running back to back for duration seconds and reports {"t": seconds, "tflops": f} every interval
+#
+# the GEMMs are torch.bmm and torch._scaled_mm (fp8), the engine of every result, not cublaslt_gemm, and there is
+# no fp4 GEMM in torch, so datatypes outside DTYPES are measured with cublaslt_gemm by GEMMCublasLt
+#
+# Run as: CUDA_VISIBLE_DEVICES=<gpu> python3 -m Benchmarks.NVIDIA.gemm_batch_worker
+
+DTYPES = {
+    "fp32": "float32",
+    "tf32": "float32",
+    "fp16": "float16",
+    "bf16": "bfloat16",
+    "fp8e4m3": "float8_e4m3fn",
+    "fp8e5m2": "float8_e5m2",
+}
+
+
+# returns the GEMM and the name of the torch function it runs
+def make_gemm(torch, m, n, k, b, datatype):
+    if datatype not in DTYPES:
+        raise ValueError("datatype " + datatype + " is not supported by the batched worker")
+    dtype = getattr(torch, DTYPES[datatype])
+    torch.backends.cuda.matmul.allow_tf32 = datatype == "tf32"
+
+    if dtype.is_floating_point and dtype.itemsize == 1:
+        if b != 1:
+            raise ValueError("fp8 GEMM only supports batch size 1")
+        a = torch.randn(m, k, device="cuda").to(dtype)
+        # _scaled_mm wants the second operand column-major
+        w = torch.randn(n, k, device="cuda").to(dtype).t()
+        scale = torch.tensor(1.0, device="cuda")
+        return lambda: torch._scaled_mm(a, w, scale, scale, out_dtype=torch.bfloat16), "torch._scaled_mm"
+
+    a = torch.randn(b, m, k, device="cuda", dtype=dtype)
+    w = torch.randn(b, k, n, device="cuda", dtype=dtype)
+    return lambda: torch.bmm(a, w), "torch.bmm"
+
+
+def time_gemm(torch, gemm, warmup, iters):
+    for _ in range(warmup):
+        gemm()
+    start = torch.cuda.Event(enable_timing=True)
+    end = torch.cuda.Event(enable_timing=True)
+    start.record()
+    for _ in range(iters):
+        gemm()
+    end.record()
+    end.synchronize()
+    return start.elapsed_time(end) * 1000 / iters
+
+
+def calibrate(torch, gemm, request):
+    per_iter = time_gemm(torch, gemm, 3, request.get("min_iters", 20)) / 1e6
+    total = request["target_time"] / per_iter
+    fraction = request.get("warmup_fraction", 0.2)
+    warmup = int(max(5, total * fraction))
+    iters = int(min(request.get("max_iters", 100000), max(request.get("min_iters", 20), total * (1 - fraction))))
+    return warmup, iters
+
+
+def soak(torch, request):
+    b = request.get("b", 1)
+    gemms = []
+    for m, n, k in request["shapes"]:
+        gemms.append((make_gemm(torch, m, n, k, b, request["datatype"])[0], 2 * m * n * k * b))
+    for gemm, _ in gemms:
+        time_gemm(torch, gemm, 10, 10)
+
+    interval = request.get("interval", 1.0)
+    start = time.perf_counter()
+    window = start
+    flops = 0
+    while window - start < request["duration"]:
+        for gemm, work in gemms:
+            for _ in range(10):
+                gemm()
+            flops += 10 * work
+        if time.perf_counter() - window >= interval:
+            # everything launched in the window has to finish before it is timed
+            torch.cuda.synchronize()
+            now = time.perf_counter()
+            emit({"t": round(now - start, 3), "tflops": round(flops / (now - window) / 1e12, 3)})
+            window = now
+            flops = 0
+
+
+def emit(record):
+    sys.stdout.write(json.dumps(record) + "\n")
+    sys.stdout.flush()
+
+
+def main():
+    import torch
+
+    # bring clocks and the cuBLAS handle up once for the whole shape list
+    warm, _ = make_gemm(torch, 4096, 4096, 4096, 1, "fp16")
+    time_gemm(torch, warm, 200, 200)
+    emit({"ready": True})
+
+    for line in sys.stdin:
+        if not line.strip():
+            continue
+        request = json.loads(line)
+        if request.get("mode") == "soak":
+            try:
+                soak(torch, request)
+            except Exception as e:
+                emit({"error": str(e)})
+            emit({"done": True})
+            continue
+
+        b = request.get("b", 1)
+        for m, n, k in request["shapes"]:
+            record = {"m": m, "n": n, "k": k, "b": b}
+            try:
+                gemm, record["engine"] = make_gemm(torch, m, n, k, b, request["datatype"])
+                warmup, iters = request.get("warmup", 10), request.get("iters", 1000)
+                if request.get("target_time"):
+                    warmup, iters = calibrate(torch, gemm, request)
+                time_us = time_gemm(torch, gemm, warmup, iters)
+                record["warmup"] = warmup
+                record["iters"] = iters
+                record["time_us"] = round(time_us, 3)
+                record["tflops"] = round(2 * m * n * k * b / time_us / 1e6, 3)
+                del gemm
+            except Exception as e:
+                record["error"] = str(e)
+            emit(record)
+        emit({"done": True})
+
+
+# parent side: keeps one worker process per GPU alive across requests and streams their results back
+class BatchWorkerPool:
+    def __init__(self, devices: list, cwd: str):
+        self.workers = []
+        for device in devices:
+            env = dict(os.environ, CUDA_VISIBLE_DEVICES=str(device))
+            worker = subprocess.Popen(
+                [sys.executable, "-m", "Benchmarks.NVIDIA.gemm_batch_worker"],
+                cwd=cwd,
+                env=env,
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                text=True,
+                bufsize=1,
+            )
+            self.workers.append((device, worker))
+        for device, worker in self.workers:
+            ready = worker.stdout.readline()
+            if not ready:
+                raise RuntimeError("GEMM worker for GPU " + str(device) + " exited during startup")
+
+    def size(self):
+        return len(self.workers)
+
+    # options holds the request fields other than shapes
+    def run(self, shapes: list, options: dict):
+        # spread shapes round-robin so large and small shapes are mixed on every GPU
+        requests = [dict(options, shapes=shapes[i::len(self.workers)]) for i in range(len(self.workers))]
+        return self.stream(requests)
+
+    # sends the same request, e.g. a soak, to every worker
+    def broadcast(self, request: dict):
+        return self.stream([request] * len(self.workers))
+
+    # yields (device, record) as soon as any worker reports a result
+    def stream(self, requests: list):
+        results = queue.Queue()
+
+        def read(device, worker):
+            for line in worker.stdout:
+                record = json.loads(line)
+                if record.get("done"):
+                    break
+                results.put((device, record))
+            results.put((device, None))
+
+        busy = 0
+        for (device, worker), request in zip(self.workers, requests):
+            if not request["shapes"]:
+                continue
+            worker.stdin.write(json.dumps(request) + "\n")
+            worker.stdin.flush()
+            threading.Thread(target=read, args=(device, worker), daemon=True).start()
+            busy += 1
+
+        while busy:
+            device, record = results.get()
+            if record is None:
+                busy -= 1
+                continue
+            yield device, record
+
+    def close(self):
+        for device, worker in self.workers:
+            worker.stdin.close()
+            worker.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+import time
+import heapq
+import itertools
+
+# samples a multi-dimensional grid coarsely, then keeps bisecting the grid lines where the measured
+# value changes sharply between neighbouring points, until the time budget is used up
+#
+# measure(points, phase) gets a list of grid points (tuples of axis values) and yields (point, value)
+# pairs as they complete, value is None when the measurement failed
+class AdaptiveSweep:
+    def __init__(self, axes: list, measure, budget: float, threshold: float = 0.1, coarse_points: int = 5, batch_size: int = 1):
+        self.axes = axes
+        self.measure = measure
+        self.budget = budget
+        self.threshold = threshold
+        # the two ends of every axis at least, bisection needs an interval to split
+        self.coarse_points = max(2, coarse_points)
+        self.batch_size = max(1, batch_size)
+        self.results = {}
+        self.edges = []
+        self.deadline = None
+
+    def coarse_indices(self, length: int):
+        if length <= self.coarse_points:
+            return list(range(length))
+        step = (length - 1) / (self.coarse_points - 1)
+        return sorted(set(int(round(i * step)) for i in range(self.coarse_points)))
+
+    def point(self, index: tuple):
+        return tuple(axis[i] for axis, i in zip(self.axes, index))
+
+    def expired(self):
+        return time.time() >= self.deadline
+
+    def evaluate(self, indices: list, phase: str):
+        by_point = {self.point(index): index for index in indices}
+        for point, value in self.measure(list(by_point), phase):
+            self.results[by_point[point]] = value
+
+    # relative change between two measured points, None if either failed
+    def score(self, a: tuple, b: tuple):
+        va, vb = self.results.get(a), self.results.get(b)
+        if va is None or vb is None or max(va, vb) <= 0:
+            return None
+        return abs(va - vb) / max(va, vb)
+
+    def push(self, a: tuple, b: tuple):
+        gap = max(abs(x - y) for x, y in zip(a, b))
+        score = self.score(a, b)
+        if gap > 1 and score is not None and score >= self.threshold:
+            heapq.heappush(self.edges, (-score, -gap, a, b))
+
+    def run(self):
+        self.deadline = time.time() + self.budget
+
+        coarse = [self.coarse_indices(len(axis)) for axis in self.axes]
+        grid = list(itertools.product(*coarse))
+        for i in range(0, len(grid), self.batch_size):
+            if self.expired():
+                return self.results
+            self.evaluate(grid[i:i + self.batch_size], "coarse")
+
+        # edges between neighbouring coarse points along each axis
+        for index in grid:
+            for axis in range(len(self.axes)):
+                position = coarse[axis].index(index[axis])
+                if position + 1 < len(coarse[axis]):
+                    neighbour = list(index)
+                    neighbour[axis] = coarse[axis][position + 1]
+                    self.push(index, tuple(neighbour))
+
+        while self.edges and not self.expired():
+            batch = []
+            midpoints = set()
+            while self.edges and len(batch) < self.batch_size:
+                _, _, a, b = heapq.heappop(self.edges)
+                mid = tuple((x + y) // 2 for x, y in zip(a, b))
+                batch.append((a, mid, b))
+                if mid not in self.results:
+                    midpoints.add(mid)
+            self.evaluate(sorted(midpoints), "refine")
+            for a, mid, b in batch:
+                self.push(a, mid)
+                self.push(mid, b)
+
+        return self.results
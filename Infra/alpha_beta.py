@@ -0,0 +1,228 @@
+import os
+import csv
+import sys
+import json
+import argparse
+import itertools
+import numpy as np
+from prettytable import PrettyTable
+
+# fits the alpha-beta cost model t(n) = alpha + n / beta to collective size sweeps, piecewise over the
+# protocol regimes (LL, LL128, Simple in NCCL), which a single line fits badly. Reported per sweep:
+#   latency:    alpha of the small message regime, the floor every tensor-parallel decode step pays
+#   bandwidth:  beta of the large message regime, the asymptotic algorithm bandwidth (and bus bandwidth)
+#   n_half:     message size where the model reaches half of the asymptotic bandwidth
+#
+# sweeps of the same length are fitted together: the weighted least squares line of every contiguous
+# segment comes from prefix sums, and all breakpoint choices of all sweeps are scored in one array
+# operation, so thousands of node sweeps fit in seconds
+#
+# Run offline on the parsed CSVs (the node name is taken from the file name):
+#   python3 -m Infra.alpha_beta Outputs/NCCLBandwidth_*.csv --baseline baseline.csv --output fit.csv
+
+FIELDS = [
+    "Node", "Collective", "Algorithm", "Protocol", "Points", "Latency (us)", "Bandwidth (GB/s)",
+    "Bus Bandwidth (GB/s)", "N1/2 (B)", "Breakpoints (B)", "Fit Error (%)",
+    "Latency Drift (%)", "Bandwidth Drift (%)", "Drifted",
+]
+
+
+# {(node, collective, algo, proto): [(size, time, algbw, busbw), ...]} from NCCLBandwidth/RCCLBandwidth CSVs
+def load(paths: list):
+    sweeps = {}
+    for path in paths:
+        node = os.path.splitext(os.path.basename(path))[0]
+        for prefix in ["NCCLBandwidth_", "RCCLBandwidth_", "GlooBandwidth_"]:
+            if node.startswith(prefix):
+                node = node[len(prefix):]
+        with open(path) as file:
+            for row in csv.DictReader(file):
+                try:
+                    point = (float(row["Size (B)"]), float(row["Time (us)"]), float(row["Algbw (GB/s)"]), float(row["Busbw (GB/s)"]))
+                except (KeyError, ValueError):
+                    continue
+                if point[0] <= 0 or point[1] <= 0:
+                    continue
+                key = (row.get("Node") or node, row["Collective"], row["Algorithm"], row["Protocol"])
+                sweeps.setdefault(key, []).append(point)
+    for key in sweeps:
+        sweeps[key].sort()
+    return sweeps
+
+
+# weighted least squares line over the points [i, j) of every sweep, i and j are (sweeps, segments) indices
+# into the prefix sums, returns the intercepts, slopes and squared errors of the segments
+def line(prefix, i, j):
+    w, wx, wy, wxx, wxy, wyy = [np.take_along_axis(s, j, axis=1) - np.take_along_axis(s, i, axis=1) for s in prefix]
+    det = w * wxx - wx * wx
+    with np.errstate(divide="ignore", invalid="ignore"):
+        slope = np.where(det > 0, (w * wxy - wx * wy) / det, 0.0)
+        intercept = np.where(w > 0, (wy - slope * wx) / w, 0.0)
+    sse = wyy - intercept * wy - slope * wxy
+    return intercept, slope, np.maximum(sse, 0.0)
+
+
+# x: (G, P) sizes scaled to [0, 1], y: (G, P) times, both sorted by size
+# returns intercepts, slopes (G, R) and the start index of every regime (G, R)
+def fit_bucket(x, y, regimes: int, min_points: int):
+    G, P = x.shape
+    regimes = max(1, min(regimes, P // min_points))
+    # relative residuals, so the microsecond floor counts as much as the multi-second large messages
+    w = 1.0 / (y * y)
+    zero = np.zeros((G, 1))
+    prefix = [np.concatenate([zero, np.cumsum(v, axis=1)], axis=1) for v in [w, w * x, w * y, w * x * x, w * x * y, w * y * y]]
+
+    candidates = [c for c in itertools.combinations(range(min_points, P - min_points + 1), regimes - 1)
+                  if all(b - a >= min_points for a, b in zip((0,) + c, c + (P,)))]
+    bounds = np.array([(0,) + c + (P,) for c in candidates])
+
+    # error of every (sweep, breakpoint choice)
+    total = np.zeros((G, len(bounds)))
+    for r in range(regimes):
+        total += line(prefix, np.broadcast_to(bounds[:, r], (G, len(bounds))), np.broadcast_to(bounds[:, r + 1], (G, len(bounds))))[2]
+    best = bounds[np.argmin(total, axis=1)]
+
+    intercepts = np.zeros((G, regimes))
+    slopes = np.zeros((G, regimes))
+    for r in range(regimes):
+        intercept, slope, _ = line(prefix, best[:, r:r + 1], best[:, r + 1:r + 2])
+        intercepts[:, r] = intercept[:, 0]
+        slopes[:, r] = slope[:, 0]
+    return intercepts, slopes, best[:, :-1], np.min(total, axis=1)
+
+
+def fit(sweeps: dict, regimes: int = 3, min_points: int = 3, grid: int = 512):
+    results = {}
+    buckets = {}
+    for key, points in sweeps.items():
+        if len(points) >= min_points:
+            buckets.setdefault(len(points), []).append(key)
+
+    for P, keys in buckets.items():
+        data = np.array([sweeps[key] for key in keys])
+        sizes, times, algbw, busbw = data[..., 0], data[..., 1], data[..., 2], data[..., 3]
+        scale = sizes[:, -1:]
+        intercepts, slopes, starts, sse = fit_bucket(sizes / scale, times, regimes, min_points)
+
+        latency = np.maximum(intercepts[:, 0], 0.0)
+        last = slopes[:, -1]
+        with np.errstate(divide="ignore"):
+            # slope is us per scaled size unit, 1 byte/us is 1e-3 GB/s
+            bandwidth = np.where(last > 0, scale[:, 0] / last * 1e-3, np.nan)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            bus_factor = np.nanmedian(np.where(algbw > 0, busbw / algbw, np.nan), axis=1)
+
+        # model bandwidth on a log grid, n_half is the first size reaching half of the asymptote
+        lo, hi = np.log(sizes[:, :1]), np.log(sizes[:, -1:])
+        n = np.exp(lo + (hi - lo) * np.linspace(0, 1, grid)[None, :])
+        start_sizes = np.take_along_axis(sizes, starts, axis=1)
+        regime = np.clip((n[:, :, None] >= start_sizes[:, None, :]).sum(axis=2) - 1, 0, None)
+        a = np.take_along_axis(intercepts, regime, axis=1)
+        b = np.take_along_axis(slopes, regime, axis=1)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            model_bw = n / (a + b * n / scale) * 1e-3
+            reached = model_bw >= 0.5 * bandwidth[:, None]
+        n_half = np.where(reached.any(axis=1), n[np.arange(len(keys)), reached.argmax(axis=1)], np.nan)
+
+        error = np.sqrt(sse / P) * 100
+        for g, key in enumerate(keys):
+            results[key] = {
+                "points": P,
+                "latency": round(float(latency[g]), 3),
+                "bandwidth": round(float(bandwidth[g]), 3),
+                "busbw": round(float(bandwidth[g] * bus_factor[g]), 3),
+                "n_half": int(n_half[g]) if np.isfinite(n_half[g]) else None,
+                "breakpoints": [int(size) for size in start_sizes[g, 1:]],
+                "error": round(float(error[g]), 2),
+            }
+    return results
+
+
+# baseline CSV written by this tool (a reference node of the SKU), the median is used when it has several nodes;
+# without one, the median of the fitted nodes is the baseline, and a single node has none to drift from
+def baseline(path: str = None, results: dict = None):
+    values = {}
+    if path is None and len(set(key[0] for key in results)) < 2:
+        return {}
+    if path is not None:
+        with open(path) as file:
+            for row in csv.DictReader(file):
+                try:
+                    values.setdefault((row["Collective"], row["Algorithm"], row["Protocol"]), []).append((float(row["Latency (us)"]), float(row["Bandwidth (GB/s)"])))
+                except (KeyError, ValueError):
+                    continue
+    else:
+        for (node, collective, algo, proto), result in results.items():
+            values.setdefault((collective, algo, proto), []).append((result["latency"], result["bandwidth"]))
+    return {key: tuple(float(value) for value in np.median(np.array(items), axis=0)) for key, items in values.items()}
+
+
+def drift(results: dict, reference: dict, tolerance: float):
+    rows = []
+    for key in sorted(results):
+        node, collective, algo, proto = key
+        result = results[key]
+        base = reference.get((collective, algo, proto))
+        latency_drift = bandwidth_drift = None
+        if base is not None:
+            if base[0] > 0:
+                latency_drift = round(100 * (result["latency"] - base[0]) / base[0], 2)
+            if base[1] > 0:
+                bandwidth_drift = round(100 * (result["bandwidth"] - base[1]) / base[1], 2)
+        drifted = any(value is not None and abs(value) > 100 * tolerance for value in [latency_drift, bandwidth_drift])
+        rows.append([
+            node, collective, algo, proto, result["points"], result["latency"], result["bandwidth"], result["busbw"],
+            result["n_half"] if result["n_half"] is not None else "-", ";".join(str(size) for size in result["breakpoints"]),
+            result["error"], "-" if latency_drift is None else latency_drift, "-" if bandwidth_drift is None else bandwidth_drift, drifted,
+        ])
+    return rows
+
+
+def from_config(path: str):
+    file = open(path)
+    data = json.load(file)
+    file.close()
+    config = data.get("CollectiveFit", {})
+    return config.get("baseline") or None, config.get("drift", 0.1), config.get("regimes", 3)
+
+
+def report(paths: list, output: str = None, baseline_path: str = None, tolerance: float = 0.1, regimes: int = 3):
+    results = fit(load(paths), regimes)
+    reference = baseline(baseline_path, results)
+    rows = drift(results, reference, tolerance)
+
+    # the drift columns are left out of the table when there is nothing to compare against
+    shown = len(FIELDS) if reference else len(FIELDS) - 3
+    table1 = PrettyTable()
+    table1.field_names = FIELDS[:shown]
+    for row in rows:
+        table1.add_row(row[:shown])
+    print(table1)
+    if not reference:
+        print("No baseline to check the drift against, set CollectiveFit.baseline to the fit CSV of a reference node of the SKU")
+    drifted = sorted(set(row[0] for row in rows if row[-1]))
+    if drifted:
+        print("Nodes drifting more than " + str(round(100 * tolerance, 2)) + "% from the baseline: " + ", ".join(drifted))
+
+    if output is not None:
+        with open(output, 'w') as csvFile:
+            writer = csv.writer(csvFile, delimiter=',', quotechar='"', quoting=csv.QUOTE_MINIMAL)
+            writer.writerow(FIELDS)
+            for row in rows:
+                writer.writerow(row)
+    return rows
+
+
+def main(argv: list):
+    parser = argparse.ArgumentParser(description="Fit latency and bandwidth to NCCL/RCCL size sweeps")
+    parser.add_argument("csv", nargs="+", help="NCCLBandwidth/RCCLBandwidth result CSVs, one per node")
+    parser.add_argument("--output", help="CSV to write the fitted parameters to, usable as a baseline")
+    parser.add_argument("--baseline", help="fit CSV of the SKU baseline, defaults to the median of the given nodes")
+    parser.add_argument("--drift", type=float, default=0.1, help="relative drift from the baseline that flags a node")
+    parser.add_argument("--regimes", type=int, default=3, help="number of protocol regimes fitted per sweep")
+    args = parser.parse_args(argv)
+    report(args.csv, args.output, args.baseline, args.drift, args.regimes)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
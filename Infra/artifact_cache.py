@@ -0,0 +1,224 @@
+import os
+import json
+import time
+import fcntl
+import shutil
+import hashlib
+import platform
+import subprocess
+from contextlib import contextmanager
+from Infra import tools
+from Infra import build_scheduler
+
+# content-addressed store for built benchmark binaries, shareable between nodes through a common directory
+#   <root>/blobs/<sha256 of file>          binary contents
+#   <root>/entries/<build key>.json        artifact name -> blob, the mtime of the entry is its last use
+class ArtifactCache:
+    def __init__(self, root: str, max_bytes: int):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.blobs = os.path.join(root, "blobs")
+        self.entries = os.path.join(root, "entries")
+        os.makedirs(self.blobs, exist_ok=True)
+        os.makedirs(self.entries, exist_ok=True)
+
+    @contextmanager
+    def lock(self):
+        with open(os.path.join(self.root, ".lock"), "a") as file:
+            fcntl.flock(file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(file, fcntl.LOCK_UN)
+
+    def entry_path(self, key: str):
+        return os.path.join(self.entries, key + ".json")
+
+    def restore(self, key: str, artifacts: dict) -> bool:
+        try:
+            with open(self.entry_path(key)) as file:
+                entry = json.load(file)
+        except (OSError, ValueError):
+            return False
+
+        for name, dest in artifacts.items():
+            item = entry["artifacts"].get(name)
+            if item is None or not os.path.isfile(os.path.join(self.blobs, item["sha256"])):
+                return False
+
+        for name, dest in artifacts.items():
+            item = entry["artifacts"][name]
+            os.makedirs(os.path.dirname(dest), exist_ok=True)
+            tmp = dest + ".tmp" + str(os.getpid())
+            shutil.copyfile(os.path.join(self.blobs, item["sha256"]), tmp)
+            os.chmod(tmp, item["mode"])
+            os.replace(tmp, dest)
+
+        # mark as recently used for LRU eviction
+        os.utime(self.entry_path(key))
+        return True
+
+    def store(self, key: str, inputs: dict, artifacts: dict):
+        entry = {"inputs": inputs, "created": time.time(), "artifacts": {}}
+        for name, src in artifacts.items():
+            sha = file_hash(src)
+            blob = os.path.join(self.blobs, sha)
+            if not os.path.isfile(blob):
+                tmp = blob + ".tmp" + str(os.getpid())
+                shutil.copyfile(src, tmp)
+                os.replace(tmp, blob)
+            entry["artifacts"][name] = {"sha256": sha, "size": os.path.getsize(src), "mode": os.stat(src).st_mode & 0o777}
+
+        with self.lock():
+            tmp = self.entry_path(key) + ".tmp" + str(os.getpid())
+            with open(tmp, "w") as file:
+                json.dump(entry, file, indent=4)
+            os.replace(tmp, self.entry_path(key))
+            self.evict()
+
+    # must be called with the lock held
+    def evict(self):
+        entries = []
+        for name in os.listdir(self.entries):
+            if not name.endswith(".json"):
+                continue
+            path = os.path.join(self.entries, name)
+            try:
+                with open(path) as file:
+                    entry = json.load(file)
+                entries.append([os.path.getmtime(path), path, entry])
+            except (OSError, ValueError):
+                os.remove(path)
+        entries.sort(key=lambda item: item[0])
+
+        def blob_sizes(entries):
+            sizes = {}
+            for _, _, entry in entries:
+                for item in entry["artifacts"].values():
+                    sizes[item["sha256"]] = item["size"]
+            return sizes
+
+        # least recently used entries go first until the referenced blobs fit in the size cap
+        while entries and sum(blob_sizes(entries).values()) > self.max_bytes:
+            _, path, _ = entries.pop(0)
+            os.remove(path)
+
+        referenced = blob_sizes(entries)
+        for name in os.listdir(self.blobs):
+            if name not in referenced and ".tmp" not in name:
+                os.remove(os.path.join(self.blobs, name))
+
+
+def from_config(path: str):
+    file = open(path)
+    data = json.load(file)
+    file.close()
+    config = data.get("ArtifactCache", {})
+    if not config.get("path"):
+        return None
+    return ArtifactCache(os.path.abspath(config["path"]), int(float(config.get("max_size_gb", 20)) * 1024**3))
+
+
+def file_hash(path: str):
+    sha = hashlib.sha256()
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(1 << 20), b""):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def command_output(cmd: str):
+    results = subprocess.run(cmd, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if results.returncode != 0:
+        return ""
+    return results.stdout.decode("utf-8").strip()
+
+
+# commit the binary will be built from: the local checkout if there is one, otherwise upstream HEAD
+def upstream_commit(url: str, checkout: str):
+    if os.path.isdir(checkout):
+        return command_output("git -C " + checkout + " rev-parse HEAD")
+    return command_output("git ls-remote " + url + " HEAD").split("\t")[0]
+
+
+def toolchain():
+    return {
+        "machine": platform.machine(),
+        "compiler": command_output("c++ --version").split("\n")[0],
+        "cuda": command_output("nvcc --version | grep release"),
+    }
+
+
+def gpu_arch():
+    caps = command_output("nvidia-smi --query-gpu=compute_cap --format=csv,noheader").split("\n")
+    return "sm_" + caps[0].replace(".", "") if caps[0] else ""
+
+
+def cpu_model():
+    return command_output("grep -m 1 'model name' /proc/cpuinfo").split(":")[-1].strip()
+
+
+# wraps a benchmark's build steps: restores the artifacts when a build with the same key was cached (or is
+# already on disk), otherwise runs the steps and stores the result
+class CachedBuild:
+    def __init__(self, cache: ArtifactCache, name: str, inputs, artifacts: dict):
+        self.cache = cache
+        self.name = name
+        self.inputs = inputs
+        self.artifacts = artifacts
+        self.key = None
+        self.hit = False
+
+    def stamp(self, path: str):
+        return os.path.join(os.path.dirname(path), "." + os.path.basename(path) + ".cachekey")
+
+    def local_hit(self):
+        for path in self.artifacts.values():
+            try:
+                with open(self.stamp(path)) as file:
+                    if not os.path.isfile(path) or file.read().strip() != self.key:
+                        return False
+            except OSError:
+                return False
+        return True
+
+    def write_stamps(self):
+        for path in self.artifacts.values():
+            with open(self.stamp(path), "w") as file:
+                file.write(self.key)
+
+    def restore(self):
+        self.inputs = self.inputs() if callable(self.inputs) else self.inputs
+        self.key = hashlib.sha256(json.dumps([self.name, self.inputs], sort_keys=True).encode("utf-8")).hexdigest()
+        if self.local_hit():
+            self.hit = True
+        elif self.cache is not None and self.cache.restore(self.key, self.artifacts):
+            print("Restored " + ", ".join(self.artifacts) + " from the artifact cache")
+            self.write_stamps()
+            self.hit = True
+        return True
+
+    def store(self):
+        if self.hit:
+            return True
+        missing = [name for name, path in self.artifacts.items() if not os.path.isfile(path)]
+        if missing:
+            tools.write_log("Build of " + self.name + " did not produce " + ", ".join(missing))
+            return False
+        self.write_stamps()
+        if self.cache is not None:
+            self.cache.store(self.key, self.inputs, self.artifacts)
+        return True
+
+    def steps(self, steps: list):
+        restore = build_scheduler.BuildStep(self.name + "-cache-restore", self.restore)
+        names = [step.name for step in steps]
+        for step in steps:
+            if not step.deps:
+                step.deps = [restore.name]
+            step.skip_if = self.skip(step.skip_if)
+        store = build_scheduler.BuildStep(self.name + "-cache-store", self.store, deps=[restore.name] + names)
+        return [restore] + steps + [store]
+
+    def skip(self, skip_if):
+        return lambda: self.hit or (skip_if is not None and skip_if())
@@ -0,0 +1,208 @@
+import os
+import csv
+import time
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from Infra import tools
+from Infra import tracing
+from prettytable import PrettyTable
+
+# a single clone/configure/compile command declared by a benchmark's build_steps()
+# cmd is either a command (list, or string with shell=True) or a python callable returning True on success
+class BuildStep:
+    def __init__(self, name: str, cmd, cwd: str = None, deps: list = None, shell: bool = False, skip_if=None):
+        self.name = name
+        self.cmd = cmd
+        self.cwd = cwd
+        self.deps = deps or []
+        self.shell = shell
+        self.skip_if = skip_if
+        self.status = "pending"
+        self.start = None
+        self.end = None
+        self.returncode = None
+
+    def duration(self):
+        if self.start is None or self.end is None:
+            return 0.0
+        return self.end - self.start
+
+    def execute(self, env):
+        if self.skip_if is not None and self.skip_if():
+            self.status = "skipped"
+            return True
+
+        self.status = "running"
+        self.start = time.time()
+        with tracing.tracer.span(self.name, "build") as span:
+            if callable(self.cmd):
+                ok = bool(self.cmd())
+                self.returncode = 0 if ok else 1
+            else:
+                results = subprocess.run(self.cmd, cwd=self.cwd, shell=self.shell, env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+                tools.write_log(tools.check_error(results))
+                self.returncode = results.returncode
+                ok = results.returncode == 0
+            span.args["returncode"] = self.returncode
+        self.end = time.time()
+        self.status = "done" if ok else "failed"
+        return ok
+
+
+# runs the build steps of several benchmarks as a DAG in a bounded worker pool, so clones and
+# compiles of independent benchmarks overlap and each benchmark can start as soon as its own steps are done
+class BuildScheduler:
+    def __init__(self, max_workers: int = None):
+        cpus = os.cpu_count() or 1
+        self.max_workers = max_workers or max(1, min(4, cpus))
+        # split the cores between concurrently running make jobs
+        self.env = dict(os.environ, MAKEFLAGS="-j" + str(max(1, cpus // self.max_workers)))
+        self.steps = {}
+        self.groups = {}
+        self.cond = threading.Condition()
+        self.pool = None
+        self.started = None
+
+    def add(self, group: str, steps: list):
+        with self.cond:
+            names = []
+            for step in steps:
+                # steps shared between benchmarks (e.g. the same clone) are declared once
+                if step.name not in self.steps:
+                    self.steps[step.name] = step
+                names.append(step.name)
+            self.groups[group] = names
+            self.check_graph()
+            if self.pool is not None:
+                self.submit_ready()
+
+    def check_graph(self):
+        visiting, visited = set(), set()
+
+        def visit(name):
+            if name in visited:
+                return
+            if name in visiting:
+                raise ValueError("Build step dependency cycle at " + name)
+            visiting.add(name)
+            for dep in self.steps[name].deps:
+                if dep not in self.steps:
+                    raise ValueError("Build step " + name + " depends on unknown step " + dep)
+                visit(dep)
+            visiting.discard(name)
+            visited.add(name)
+
+        for name in self.steps:
+            visit(name)
+
+    def start(self):
+        with self.cond:
+            if self.pool is not None:
+                return
+            self.started = time.time()
+            self.pool = ThreadPoolExecutor(max_workers=self.max_workers)
+            self.submit_ready()
+
+    # must be called with self.cond held
+    def submit_ready(self):
+        changed = True
+        while changed:
+            changed = False
+            for step in self.steps.values():
+                if step.status != "pending":
+                    continue
+                states = [self.steps[dep].status for dep in step.deps]
+                if any(state in ("failed", "blocked") for state in states):
+                    step.status = "blocked"
+                    changed = True
+                elif all(state in ("done", "skipped") for state in states):
+                    step.status = "queued"
+                    self.pool.submit(self.execute, step)
+        self.cond.notify_all()
+
+    def execute(self, step: BuildStep):
+        try:
+            step.execute(self.env)
+        except Exception as e:
+            tools.write_log("Build step " + step.name + " raised: " + str(e))
+            step.end = time.time()
+            step.status = "failed"
+        with self.cond:
+            self.submit_ready()
+
+    def finished(self, names):
+        return all(self.steps[name].status in ("done", "skipped", "failed", "blocked") for name in names)
+
+    # blocks until every step of the group has finished, returns True if all of them succeeded
+    def wait(self, group: str) -> bool:
+        self.start()
+        names = self.groups.get(group, [])
+        with tracing.tracer.span("wait for " + group + " build", "wait"), self.cond:
+            while not self.finished(names):
+                self.cond.wait()
+            return all(self.steps[name].status in ("done", "skipped") for name in names)
+
+    # blocks until every step of every group has finished, so no compile competes with a test that measures the
+    # CPU or memory bandwidth
+    def drain(self):
+        self.start()
+        with tracing.tracer.span("wait for all builds", "wait"), self.cond:
+            while not self.finished(self.steps):
+                self.cond.wait()
+
+    def shutdown(self):
+        self.drain()
+        self.pool.shutdown()
+
+    def critical_path(self):
+        executed = [step for step in self.steps.values() if step.end is not None]
+        if not executed:
+            return []
+        path = [max(executed, key=lambda step: step.end)]
+        while True:
+            deps = [self.steps[dep] for dep in path[-1].deps if self.steps[dep].end is not None]
+            if not deps:
+                break
+            path.append(max(deps, key=lambda step: step.end))
+        path.reverse()
+        return path
+
+    def report(self, path: str = None):
+        owners = {}
+        for group, names in self.groups.items():
+            for name in names:
+                owners.setdefault(name, []).append(group)
+
+        rows = []
+        for step in self.steps.values():
+            offset = round(step.start - self.started, 2) if step.start is not None else ""
+            rows.append([step.name, " ".join(owners.get(step.name, [])), step.status, offset, round(step.duration(), 2)])
+
+        table1 = PrettyTable()
+        table1.field_names = ["Step", "Benchmark", "Status", "Start (s)", "Duration (s)"]
+        for row in rows:
+            table1.add_row(row)
+        print(table1)
+
+        critical = self.critical_path()
+        if critical:
+            total = sum(step.duration() for step in critical)
+            print("Critical path (" + str(round(total, 2)) + " s): " + " -> ".join(step.name for step in critical))
+
+        if path is not None:
+            with open(path, 'w') as csvFile:
+                writer = csv.writer(csvFile, delimiter=',', quotechar='"', quoting=csv.QUOTE_MINIMAL)
+                writer.writerow(["Step", "Benchmark", "Status", "Start (s)", "Duration (s)", "Critical Path"])
+                names = [step.name for step in critical]
+                for row in rows:
+                    writer.writerow(row + [row[0] in names])
+
+
+# serial build used when a single benchmark is run on its own
+def run_steps(steps: list) -> bool:
+    scheduler = BuildScheduler(max_workers=1)
+    scheduler.add("build", steps)
+    ok = scheduler.wait("build")
+    scheduler.shutdown()
+    return ok
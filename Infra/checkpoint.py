@@ -0,0 +1,223 @@
+import os
+import glob
+import json
+import mmap
+import time
+import struct
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# reads model checkpoint shards (safetensors, PyTorch .bin/.pt) back from storage the way a loader would, to
+# measure cold start: end to end throughput and the time until the first tensor of the first shard is in memory.
+# Every strategy copies the bytes into a reused buffer, so only storage, the page cache and memcpy are timed:
+#   buffered:  read() through the page cache, one shard after the other
+#   mmap:      the shards mapped and copied out of the mapping, so every page comes in through a page fault
+#   direct:    O_DIRECT reads into an aligned buffer, bypassing the page cache
+#   parallel:  a thread pool reading ranges of every shard with pread() at once
+# Cold runs evict the shards from the page cache first (posix_fadvise, and /proc/sys/vm/drop_caches when
+# writable), warm runs read them once beforehand.
+PATTERNS = ["*.safetensors", "*.bin", "*.pt"]
+STRATEGIES = ["buffered", "mmap", "direct", "parallel"]
+ALIGNMENT = 4096
+
+
+# checkpoint shards under directory, following the symlinks of the Hugging Face cache to their blobs
+def shards(directory: str):
+    found = []
+    for pattern in PATTERNS:
+        for path in sorted(glob.glob(os.path.join(directory, "**", pattern), recursive=True)):
+            path = os.path.realpath(path)
+            if path not in found and os.path.getsize(path) > 0:
+                found.append(path)
+    return found
+
+
+# end offset of the first tensor of a shard: the lowest data offset in the safetensors header, the first
+# block for other formats
+def first_tensor_end(path: str, block: int):
+    if path.endswith(".safetensors"):
+        with open(path, "rb") as file:
+            header_size = struct.unpack("<Q", file.read(8))[0]
+            header = json.loads(file.read(header_size))
+        tensors = [tensor["data_offsets"] for name, tensor in header.items() if name != "__metadata__"]
+        if tensors:
+            start, end = min(tensors)
+            return 8 + header_size + end
+    return min(block, os.path.getsize(path))
+
+
+# safetensors shards of size bytes each, made of F16 tensors of tensor_size bytes filled with random data
+def write_synthetic(directory: str, count: int, size: int, tensor_size: int):
+    os.makedirs(directory, exist_ok=True)
+    tensors = max(1, size // tensor_size)
+    chunk = os.urandom(min(tensor_size, 16 * 1024**2))
+    paths = []
+    for shard in range(count):
+        header = {"__metadata__": {"format": "pt"}}
+        for tensor in range(tensors):
+            header["layers." + str(shard * tensors + tensor) + ".weight"] = {
+                "dtype": "F16", "shape": [tensor_size // 2], "data_offsets": [tensor * tensor_size, (tensor + 1) * tensor_size],
+            }
+        encoded = json.dumps(header).encode()
+        # the data starts aligned, as safetensors pads the header with spaces
+        encoded += b" " * (-(8 + len(encoded)) % 8)
+        path = os.path.join(directory, "model-" + str(shard + 1).zfill(5) + "-of-" + str(count).zfill(5) + ".safetensors")
+        paths.append(path)
+        if os.path.exists(path) and os.path.getsize(path) == 8 + len(encoded) + tensors * tensor_size:
+            continue
+        print("Writing synthetic shard " + path + "...")
+        with open(path, "wb") as file:
+            file.write(struct.pack("<Q", len(encoded)) + encoded)
+            data = tensors * tensor_size
+            for _ in range(data // len(chunk)):
+                file.write(chunk)
+            file.write(chunk[:data % len(chunk)])
+            file.flush()
+            os.fsync(file.fileno())
+    return paths
+
+
+def evict(paths: list, drop_caches: bool = True):
+    for path in paths:
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+        finally:
+            os.close(fd)
+    if drop_caches:
+        try:
+            with open("/proc/sys/vm/drop_caches", "w") as file:
+                file.write("1")
+        except OSError:
+            pass
+
+
+def warm(paths: list, block: int):
+    buffered(paths, block)
+
+
+# the timer starts before the header of the first shard is read, so time to first tensor includes reading
+# the header as it does for a real loader
+class Progress:
+    def __init__(self, path: str, block: int):
+        self.start = time.perf_counter()
+        self.first_end = first_tensor_end(path, block)
+        self.first = None
+
+    # offset: bytes of the first shard loaded so far, in order
+    def loaded(self, offset: int):
+        if self.first is None and offset >= self.first_end:
+            self.first = time.perf_counter() - self.start
+
+
+def buffered(paths: list, block: int, progress: Progress = None):
+    buffer = bytearray(block)
+    total = 0
+    for index, path in enumerate(paths):
+        offset = 0
+        with open(path, "rb", buffering=0) as file:
+            while True:
+                count = file.readinto(buffer)
+                if not count:
+                    break
+                offset += count
+                if index == 0 and progress is not None:
+                    progress.loaded(offset)
+        total += offset
+    return total
+
+
+def mapped(paths: list, block: int, progress: Progress = None):
+    buffer = memoryview(bytearray(block))
+    total = 0
+    for index, path in enumerate(paths):
+        with open(path, "rb") as file:
+            with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapping:
+                view = memoryview(mapping)
+                size = len(mapping)
+                for offset in range(0, size, block):
+                    count = min(block, size - offset)
+                    buffer[:count] = view[offset:offset + count]
+                    if index == 0 and progress is not None:
+                        progress.loaded(offset + count)
+                view.release()
+                total += size
+    return total
+
+
+def direct(paths: list, block: int, progress: Progress = None):
+    # an anonymous mapping is page aligned and the size a multiple of the alignment, as O_DIRECT requires
+    block = -(-block // ALIGNMENT) * ALIGNMENT
+    buffer = mmap.mmap(-1, block)
+    total = 0
+    try:
+        for index, path in enumerate(paths):
+            fd = os.open(path, os.O_RDONLY | os.O_DIRECT)
+            offset = 0
+            try:
+                while True:
+                    count = os.preadv(fd, [buffer], offset)
+                    if not count:
+                        break
+                    offset += count
+                    if index == 0 and progress is not None:
+                        progress.loaded(offset)
+                    if count < block:
+                        break
+            finally:
+                os.close(fd)
+            total += offset
+    finally:
+        buffer.close()
+    return total
+
+
+def parallel(paths: list, block: int, progress: Progress = None, threads: int = 8, chunk: int = 256 * 1024**2):
+    # ranges of the first shard first, the time to the first tensor is when the ranges covering it are done
+    ranges = [(index, path, offset, min(chunk, os.path.getsize(path) - offset)) for index, path in enumerate(paths) for offset in range(0, os.path.getsize(path), chunk)]
+    local = threading.local()
+    lock = threading.Lock()
+    done = set()
+
+    def read(task):
+        index, path, start, length = task
+        if not hasattr(local, "buffer"):
+            local.buffer = bytearray(block)
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            offset = start
+            while offset < start + length:
+                count = os.preadv(fd, [memoryview(local.buffer)[:min(block, start + length - offset)]], offset)
+                if not count:
+                    break
+                offset += count
+        finally:
+            os.close(fd)
+        if index == 0 and progress is not None:
+            with lock:
+                done.add(start)
+                # contiguous bytes of the first shard loaded from offset 0
+                loaded = 0
+                while loaded in done:
+                    loaded += chunk
+                progress.loaded(loaded)
+        return offset - start
+
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        return sum(pool.map(read, ranges))
+
+
+def load(strategy: str, paths: list, block: int, threads: int, chunk: int):
+    progress = Progress(paths[0], block)
+    if strategy == "buffered":
+        total = buffered(paths, block, progress)
+    elif strategy == "mmap":
+        total = mapped(paths, block, progress)
+    elif strategy == "direct":
+        total = direct(paths, block, progress)
+    elif strategy == "parallel":
+        total = parallel(paths, block, progress, threads, chunk)
+    else:
+        raise ValueError("unknown checkpoint load strategy " + strategy + ", expected one of " + ", ".join(STRATEGIES))
+    seconds = time.perf_counter() - progress.start
+    return total, seconds, progress.first
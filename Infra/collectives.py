@@ -0,0 +1,128 @@
+from typing import NamedTuple
+from prettytable import PrettyTable
+from Infra import tools
+
+# nccl-tests / rccl-tests binary of every supported collective
+COLLECTIVES = {
+    "all_reduce": "all_reduce_perf",
+    "all_gather": "all_gather_perf",
+    "reduce_scatter": "reduce_scatter_perf",
+    "alltoall": "alltoall_perf",
+    "broadcast": "broadcast_perf",
+    "sendrecv": "sendrecv_perf",
+}
+
+# one message size of one collective run, times in us and bandwidths in GB/s
+class CollectiveResult(NamedTuple):
+    collective: str
+    algo: str
+    proto: str
+    size: int
+    count: int
+    dtype: str
+    redop: str
+    root: int
+    oop_time: float
+    oop_algbw: float
+    oop_busbw: float
+    oop_wrong: str
+    ip_time: float
+    ip_algbw: float
+    ip_busbw: float
+    ip_wrong: str
+
+
+FIELDS = [
+    "Collective", "Algorithm", "Protocol", "Size (B)", "Count", "Type", "Redop", "Root",
+    "Time (us)", "Algbw (GB/s)", "Busbw (GB/s)", "#wrong",
+    "In-place Time (us)", "In-place Algbw (GB/s)", "In-place Busbw (GB/s)", "In-place #wrong",
+]
+
+UNITS = tools.SIZE_UNITS
+
+
+# "8", "512K", "8G" as used by the -b/-e options of nccl-tests
+def parse_size(size) -> int:
+    return tools.parse_size(size)
+
+
+def format_size(size: int) -> str:
+    for unit in ["T", "G", "M", "K"]:
+        if size >= UNITS[unit] and size % UNITS[unit] == 0:
+            return str(size // UNITS[unit]) + unit
+    return str(size)
+
+
+def number(field: str) -> float:
+    try:
+        return float(field)
+    except ValueError:
+        return None
+
+
+# parses a result row, the 13 columns
+#   size count type redop root | out-of-place time algbw busbw #wrong | in-place time algbw busbw #wrong
+# returns None for headers, comments and anything else that is not a result
+def parse_row(collective: str, algo: str, proto: str, line: str):
+    fields = line.split()
+    if len(fields) != 13 or not fields[0].isdigit():
+        return None
+    try:
+        return CollectiveResult(
+            collective, algo, proto,
+            int(fields[0]), int(fields[1]), fields[2], fields[3], int(fields[4]),
+            number(fields[5]), number(fields[6]), number(fields[7]), fields[8],
+            number(fields[9]), number(fields[10]), number(fields[11]), fields[12],
+        )
+    except ValueError:
+        return None
+
+
+def row(result: CollectiveResult) -> list:
+    return ["" if value is None else value for value in result]
+
+
+# config["inputs"]["collectives"] = {"all_reduce": {"algos": ["NVLS"], "protos": ["Simple"]}, ...}
+# yields (collective, algo, proto) for every configured combination, "default" leaves the choice to the library
+def runs(inputs: dict, default: dict = None):
+    configured = inputs.get("collectives", default or {"all_reduce": {}})
+    for collective, settings in configured.items():
+        if collective not in COLLECTIVES:
+            raise ValueError("unknown collective " + collective + ", expected one of " + ", ".join(COLLECTIVES))
+        for algo in settings.get("algos", ["default"]):
+            for proto in settings.get("protos", ["default"]):
+                yield collective, algo, proto
+
+
+def env(algo: str, proto: str) -> dict:
+    variables = {}
+    if algo != "default":
+        variables["NCCL_ALGO"] = algo
+    if proto != "default":
+        variables["NCCL_PROTO"] = proto
+    return variables
+
+
+def args(start, end, num_gpus, iters: int = 40) -> list:
+    return ["-b", str(start), "-e", str(end), "-f", "2", "-g", str(num_gpus), "-n", str(iters)]
+
+
+# one table per collective: message size against the out-of-place bus bandwidth of every algo/proto run
+def print_tables(results: list):
+    for collective in COLLECTIVES:
+        selected = [result for result in results if result.collective == collective]
+        if not selected:
+            continue
+        settings = []
+        for result in selected:
+            if (result.algo, result.proto) not in settings:
+                settings.append((result.algo, result.proto))
+        sizes = sorted(set(result.size for result in selected))
+        busbw = {(result.algo, result.proto, result.size): result.oop_busbw for result in selected}
+
+        table1 = PrettyTable()
+        table1.field_names = ["Message Size"] + [algo + ("/" + proto if proto != "default" else "") for algo, proto in settings]
+        for size in sizes:
+            table1.add_row([format_size(size)] + [busbw.get((algo, proto, size), "-") for algo, proto in settings])
+        print(collective + " bus bandwidth (GB/s)")
+        print(table1)
@@ -0,0 +1,196 @@
+import sys
+import json
+import atexit
+import signal
+import hashlib
+import threading
+import importlib
+from Infra import tools
+from Infra import tracing
+from Infra import storage
+
+# keeps one warm container per image and mounts for the whole runner process, so benchmarks on the same
+# image share it instead of each pulling, provisioning and killing their own:
+#   - devices and volumes (MATCH) must be the same to share a container, as they decide what it can see
+#   - the environment of a request is applied to every command it runs in the container instead
+#   - the other run options come from the first request, the ones a later request asks for differently are logged
+#   - requirements are shell commands run once per container, e.g. "pip install flash-attn", a later request
+#     only runs the ones that are not installed yet
+# The provisioned state is committed as an image per set of installed requirements, which later runs start from.
+#
+# docker is imported when the first container is requested, so the runner starts, and the tests without a
+# container run, where the docker package is not installed
+docker = None
+
+MATCH = ["devices", "volumes"]
+# options of one benchmark that a shared container does not take: a fixed name would clash, the pool removes it
+PRIVATE = ["name", "auto_remove", "environment"]
+
+
+class ContainerPool:
+    def __init__(self):
+        self.containers = {}
+        self.options = {}
+        self.installed = {}
+        self.lock = threading.Lock()
+        self.client = None
+        self.snapshots = True
+        self.repository = "ai-benchmarking-guide-warm"
+        atexit.register(self.close)
+
+    # reads the "ContainerPool" block of config.json and makes SIGTERM run the atexit teardown too
+    def configure(self, path: str):
+        file = open(path)
+        data = json.load(file)
+        file.close()
+        config = data.get("ContainerPool", {})
+        self.snapshots = config.get("snapshots", True)
+        self.repository = config.get("repository", self.repository)
+        if threading.current_thread() is threading.main_thread():
+            signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(128 + signum))
+
+    def docker(self):
+        global docker
+        if self.client is None:
+            docker = importlib.import_module("docker")
+            self.client = docker.from_env()
+        return self.client
+
+    # the base image id is part of the key, so a new upstream image invalidates its snapshots
+    def key(self, image: str, options: dict):
+        try:
+            base = self.docker().images.get(image)
+        except docker.errors.ImageNotFound:
+            print("Pulling docker container " + image + "...")
+            with tracing.tracer.span("docker pull", "docker", image=image):
+                base = self.docker().images.pull(image)
+        return digest([base.id] + [options.get(name) for name in MATCH])
+
+    def snapshot(self, key: str, requirements):
+        return self.repository + ":" + digest([key, sorted(requirements)])
+
+    def running(self, container):
+        try:
+            container.reload()
+            return container.status == "running"
+        except docker.errors.APIError:
+            return False
+
+    # returns a running container with the requirements installed, or None if provisioning failed
+    def get(self, image: str, options: dict, requirements: list = None):
+        requirements = requirements or []
+        shared = {name: value for name, value in options.items() if name not in PRIVATE}
+        with self.lock:
+            key = self.key(image, options)
+            container = self.containers.get(key)
+            if container is not None and self.running(container):
+                print(f"Reusing warm Docker Container ID: {container.id}")
+                created = False
+                different = sorted(name for name, value in shared.items() if self.options[key].get(name) != value)
+                if different:
+                    tools.write_log("Container " + container.id + " is shared, it keeps its own " + ", ".join(different))
+            else:
+                snapshot = self.snapshot(key, requirements)
+                provisioned = False
+                if self.snapshots and requirements:
+                    try:
+                        self.docker().images.get(snapshot)
+                        provisioned = True
+                    except docker.errors.ImageNotFound:
+                        pass
+                container = self.docker().containers.run(snapshot if provisioned else image, **shared)
+                print(f"Created Docker Container ID: {container.id}" + (" from snapshot " + snapshot if provisioned else ""))
+                self.containers[key] = container
+                self.options[key] = shared
+                self.installed[key] = set(requirements) if provisioned else set()
+                created = True
+
+            if not self.provision(key, container, requirements, created):
+                return None
+            return Pooled(container, options.get("environment", {}))
+
+    # runs the requirements that are not installed in the container yet, and snapshots the result
+    def provision(self, key: str, container, requirements: list, created: bool):
+        missing = [requirement for requirement in requirements if requirement not in self.installed[key]]
+        for requirement in missing:
+            print("Installing in the container: " + requirement)
+            with tracing.tracer.span("docker provision", "docker", cmd=requirement) as span:
+                results = container.exec_run(['/bin/sh', '-c', requirement], stderr=True)
+                span.args.update(returncode=results.exit_code, output_bytes=len(results.output or b""))
+            if results.exit_code != 0:
+                print(f"Failed to run {requirement}, see logs for details.")
+                tools.write_log(results.output.decode('utf-8'))
+                # a container that other benchmarks already use is kept for them
+                if created:
+                    self.remove(container)
+                    del self.containers[key]
+                return False
+            self.installed[key].add(requirement)
+        if self.snapshots and missing:
+            snapshot = self.snapshot(key, self.installed[key])
+            repository, tag = snapshot.rsplit(":", 1)
+            with tracing.tracer.span("docker commit", "docker", image=snapshot):
+                container.commit(repository=repository, tag=tag)
+            print("Saved the provisioned container as " + snapshot)
+        return True
+
+    def remove(self, container):
+        try:
+            container.remove(force=True)
+        except docker.errors.APIError:
+            pass
+
+    def close(self):
+        with self.lock:
+            for container in self.containers.values():
+                self.remove(container)
+            self.containers = {}
+
+
+# Hugging Face cache on the node's local NVMe mount, /mnt/resource_nvme when none is found
+def hf_cache():
+    return storage.scratch(default='/mnt/resource_nvme') + '/hf_cache'
+
+
+# run options of the ROCm benchmark containers, the same for every benchmark (the GPUs, the repository and the
+# Hugging Face cache mounted) so that the benchmarks on the same image share one container
+def rocm_options(dir_path: str):
+    return {
+        'ipc_mode': 'host',
+        'entrypoint': '/bin/bash',
+        'network': 'host',
+        'group_add': ['render'],
+        'privileged': True,
+        'security_opt': ['seccomp=unconfined', 'apparmor=unconfined'],
+        'cap_add': ['CAP_SYS_ADMIN', 'SYS_PTRACE'],
+        'devices': ['/dev/kfd', '/dev/dri', '/dev/mem'],
+        'volumes': {
+            str(dir_path): {'bind': str(dir_path), 'mode': 'rw'},
+            hf_cache(): {'bind': '/root/.cache/huggingface', 'mode': 'rw'},
+        },
+        'shm_size': '16G',
+        'tty': True,
+        'detach': True,
+    }
+
+
+def digest(data):
+    return hashlib.sha256(json.dumps(data, sort_keys=True, default=str).encode("utf-8")).hexdigest()[:16]
+
+
+# a shared container as one benchmark sees it: its commands run with the environment it asked for
+class Pooled:
+    def __init__(self, container, environment: dict):
+        self.container = container
+        self.environment = environment
+
+    def exec_run(self, cmd, **kwargs):
+        environment = dict(self.environment)
+        environment.update(kwargs.pop("environment", None) or {})
+        return self.container.exec_run(cmd, environment=environment or None, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self.container, name)
+
+
+pool = ContainerPool()
@@ -0,0 +1,153 @@
+import os
+import re
+import glob
+import json
+import shutil
+import statistics
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from prettytable import PrettyTable
+from Infra import stream_runner
+
+# runs one copy of a single-device benchmark on every GPU at the same time, each copy restricted to its GPU
+# and bound to the GPU's local NUMA node, then compares the GPUs against the node median
+VISIBLE_DEVICES = {"nvidia": "CUDA_VISIBLE_DEVICES", "amd": "HIP_VISIBLE_DEVICES"}
+
+
+def outlier_band(path: str):
+    file = open(path)
+    data = json.load(file)
+    file.close()
+    return data.get("DeviceFanout", {}).get("outlier_band", 0.05)
+
+
+# wall and idle timeouts of the benchmarks without their own, config["DeviceFanout"]["timeout"]
+def timeouts(path: str):
+    file = open(path)
+    data = json.load(file)
+    file.close()
+    return stream_runner.timeouts(data.get("DeviceFanout", {}), 3600, 600)
+
+
+def numa_node(bus_id: str):
+    try:
+        with open(os.path.join("/sys/bus/pci/devices", bus_id, "numa_node")) as file:
+            return int(file.read().strip())
+    except (OSError, ValueError):
+        return -1
+
+
+def nvidia_gpus():
+    results = subprocess.run(["nvidia-smi", "--query-gpu=index,pci.bus_id", "--format=csv,noheader"], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    gpus = []
+    for line in results.stdout.decode('utf-8').strip().split("\n"):
+        if not line.strip():
+            continue
+        index, bus_id = [field.strip() for field in line.split(",")]
+        # nvidia-smi prints an 8 digit PCI domain, sysfs uses 4
+        gpus.append({"index": int(index), "bus_id": bus_id.lower()[-12:]})
+    return gpus
+
+
+# HIP numbers the GPUs in KFD topology order, CPU nodes are the ones without SIMDs
+def amd_gpus():
+    nodes = glob.glob("/sys/class/kfd/kfd/topology/nodes/*/properties")
+    nodes.sort(key=lambda path: int(path.split("/")[-2]))
+    gpus = []
+    for path in nodes:
+        properties = {}
+        with open(path) as file:
+            for line in file:
+                fields = line.split()
+                if len(fields) == 2:
+                    properties[fields[0]] = int(fields[1])
+        if properties.get("simd_count", 0) == 0:
+            continue
+        location = properties.get("location_id", 0)
+        bus_id = "%04x:%02x:%02x.%x" % (properties.get("domain", 0), location >> 8, (location >> 3) & 0x1f, location & 0x7)
+        gpus.append({"index": len(gpus), "bus_id": bus_id})
+    return gpus
+
+
+def gpus(vendor: str):
+    devices = nvidia_gpus() if vendor == "nvidia" else amd_gpus()
+    for device in devices:
+        device["numa"] = numa_node(device["bus_id"])
+    return devices
+
+
+# prefixes cmd so it only sees the given GPU and runs on the CPUs and memory next to it
+def pin(cmd: list, device: dict, vendor: str):
+    prefix = ["env", VISIBLE_DEVICES[vendor] + "=" + str(device["index"])]
+    if device["numa"] >= 0 and shutil.which("numactl"):
+        prefix += ["numactl", "--cpunodebind=" + str(device["numa"]), "--membind=" + str(device["numa"])]
+    return prefix + cmd
+
+
+# calls func(device) for every device concurrently, returns {device index: result}
+def run_each(func, devices: list):
+    with ThreadPoolExecutor(max_workers=max(1, len(devices))) as pool:
+        futures = {device["index"]: pool.submit(func, device) for device in devices}
+    return {index: future.result() for index, future in futures.items()}
+
+
+# runs cmd on every device at once through Infra.stream_runner, so a hung GPU is killed after the timeouts instead
+# of blocking the others. parser() makes the line parser of one device, returns {device index: StreamResult}
+def run(cmd: list, devices: list, vendor: str, parser, cwd: str = None, prefix: list = None, wall_timeout: float = None, idle_timeout: float = None):
+    return run_each(
+        lambda device: stream_runner.run((prefix or []) + pin(cmd, device, vendor), parser(), cwd=cwd, wall_timeout=wall_timeout, idle_timeout=idle_timeout),
+        devices,
+    )
+
+
+# values maps device index to a result where higher is better, devices outside median * (1 +- band) are flagged
+# returns one [GPU, NUMA, value, Deviation (%), Outlier] row per device
+def compare(label: str, values: dict, devices: list, band: float):
+    measured = [value for value in values.values() if value is not None]
+    if not measured:
+        return []
+    median = statistics.median(measured)
+    numa = {device["index"]: device["numa"] for device in devices}
+
+    rows = []
+    outliers = []
+    for index in sorted(values):
+        value = values[index]
+        if value is None:
+            rows.append([index, numa.get(index, -1), "-", "-", True])
+            outliers.append(index)
+            continue
+        deviation = (value - median) / median if median else 0.0
+        outlier = abs(deviation) > band
+        if outlier:
+            outliers.append(index)
+        rows.append([index, numa.get(index, -1), round(value, 2), round(100 * deviation, 2), outlier])
+
+    table1 = PrettyTable()
+    table1.field_names = ["GPU", "NUMA", label, "Deviation (%)", "Outlier"]
+    for row in rows:
+        table1.add_row(row)
+    print(table1)
+    if outliers:
+        print("GPUs outside +-" + str(round(100 * band, 2)) + "% of the median " + str(round(median, 2)) + ": " + ", ".join(str(index) for index in outliers))
+    return rows
+
+
+# line parser of benchmark_flash_attention.py, the Flash2 fwd + bwd TFLOPS of the batch_size=2, seqlen=8192 cases
+# from the two lines after each case header. The first record is the one compared between GPUs
+def tflops_parser():
+    remaining = [0]
+
+    def parse(line: str):
+        if "batch_size=2, seqlen=8192 ###" in line:
+            remaining[0] = 2
+            return None
+        if remaining[0] == 0:
+            return None
+        remaining[0] -= 1
+        match = re.search(r"fwd \+ bwd: ([\d.]+) TFLOPs/s", line)
+        if match is None:
+            return None
+        remaining[0] = 0
+        return float(match.group(1))
+    return parse
@@ -0,0 +1,260 @@
+import os
+import glob
+import json
+import itertools
+from typing import NamedTuple
+from prettytable import PrettyTable
+from Infra import tools
+from Infra import stream_runner
+
+# runs fio from generated job files and reads its JSON output: bandwidth, IOPS and completion latency
+# percentiles for every job of a config matrix
+#
+# config["FIO"]["inputs"]:
+#   matrix:    list of {"rw": [...], "bs": [...], "iodepth": [...], "numjobs": [...]}, every combination is a job
+#   profiles:  {"full": {"runtime": 300, "ramp_time": 5, "size": "10G"}, "quick": {...}}, jobs are time based
+#
+# the test files are laid out once and shared by every job (filename_format), instead of each job laying out
+# and deleting its own
+#
+# scaling: the read jobs are run on raw block devices, read only, on each device alone and then on the first
+# 1..N devices at once, to see whether aggregate bandwidth and IOPS grow with the device count
+
+PERCENTILES = ["50", "99", "99.9"]
+
+FIELDS = [
+    "Job", "RW", "BS", "IODepth", "NumJobs", "Direction", "Bandwidth (MiB/s)", "IOPS",
+    "Mean Latency (us)", "P50 Latency (us)", "P99 Latency (us)", "P99.9 Latency (us)",
+]
+
+
+class FioJob(NamedTuple):
+    rw: str
+    bs: str
+    iodepth: int
+    numjobs: int
+
+    def name(self):
+        return self.rw + "-" + self.bs + "-qd" + str(self.iodepth) + "-j" + str(self.numjobs)
+
+
+# one direction (read or write) of a finished job
+class FioResult(NamedTuple):
+    job: str
+    rw: str
+    bs: str
+    iodepth: int
+    numjobs: int
+    direction: str
+    bandwidth: float
+    iops: float
+    mean: float
+    p50: float
+    p99: float
+    p999: float
+
+
+def jobs(matrix: list):
+    result = []
+    for entry in matrix:
+        for rw, bs, iodepth, numjobs in itertools.product(entry["rw"], entry["bs"], entry.get("iodepth", [255]), entry.get("numjobs", [4])):
+            job = FioJob(rw, bs, int(iodepth), int(numjobs))
+            if job not in result:
+                result.append(job)
+    return result
+
+
+def profile(inputs: dict, name: str):
+    profiles = inputs.get("profiles", {})
+    if name not in profiles:
+        raise ValueError("unknown fio profile " + name + ", expected one of " + ", ".join(profiles))
+    return profiles[name]
+
+
+# fio ini for one job, every job uses the same files: <directory>/fio-data.<job number>.<file number>
+def job_file(job: FioJob, directory: str, settings: dict, engine: str = "libaio"):
+    lines = [
+        "[global]",
+        "ioengine=" + engine,
+        "direct=1",
+        "directory=" + directory,
+        "filename_format=fio-data.$jobnum.$filenum",
+        "size=" + str(settings.get("size", "10G")),
+        "time_based=1",
+        "runtime=" + str(settings.get("runtime", 300)),
+        "ramp_time=" + str(settings.get("ramp_time", 5)),
+        "group_reporting=1",
+        "percentile_list=" + ":".join(PERCENTILES),
+    ]
+    # extra global options from the profile, e.g. {"numa_cpu_nodes": 0}
+    for option, value in settings.get("options", {}).items():
+        lines.append(option + "=" + str(value))
+    lines += [
+        "",
+        "[" + job.name() + "]",
+        "rw=" + job.rw,
+        "bs=" + job.bs,
+        "iodepth=" + str(job.iodepth),
+        "numjobs=" + str(job.numjobs),
+    ]
+    return "\n".join(lines) + "\n"
+
+
+# fio ini reading one job from every device at once, opened read only so a job can never write to a disk;
+# group_reporting merges the devices into one aggregate result
+def device_job_file(job: FioJob, devices: list, settings: dict, engine: str = "libaio"):
+    lines = [
+        "[global]",
+        "ioengine=" + engine,
+        "direct=1",
+        "readonly=1",
+        "time_based=1",
+        "runtime=" + str(settings.get("runtime", 300)),
+        "ramp_time=" + str(settings.get("ramp_time", 5)),
+        "group_reporting=1",
+        "percentile_list=" + ":".join(PERCENTILES),
+        "rw=" + job.rw,
+        "bs=" + job.bs,
+        "iodepth=" + str(job.iodepth),
+        "numjobs=" + str(job.numjobs),
+    ]
+    for option, value in settings.get("options", {}).items():
+        lines.append(option + "=" + str(value))
+    for device in devices:
+        lines += ["", "[" + job.name() + "-" + os.path.basename(device) + "]", "filename=" + device]
+    return "\n".join(lines) + "\n"
+
+
+def percentile(clat: dict, value: str):
+    for key, ns in clat.get("percentile", {}).items():
+        if abs(float(key) - float(value)) < 1e-6:
+            return round(ns / 1000, 2)
+    return None
+
+
+# the read and write sections of fio's JSON output that did any I/O
+def parse(job: FioJob, output: dict):
+    results = []
+    for entry in output.get("jobs", []):
+        for direction in ["read", "write"]:
+            section = entry.get(direction, {})
+            if not section.get("io_bytes"):
+                continue
+            clat = section.get("clat_ns", {})
+            results.append(FioResult(
+                job.name(), job.rw, job.bs, job.iodepth, job.numjobs, direction,
+                round(section.get("bw", 0) / 1024, 2), round(section.get("iops", 0), 2), round(clat.get("mean", 0) / 1000, 2),
+                percentile(clat, "50"), percentile(clat, "99"), percentile(clat, "99.9"),
+            ))
+    return results
+
+
+def row(result: FioResult) -> list:
+    return ["" if value is None else value for value in result]
+
+
+def wall_timeout(settings: dict):
+    return int(settings.get("runtime", 300)) + int(settings.get("ramp_time", 5)) + settings.get("layout_timeout", 1800)
+
+
+# writes the job file to output_dir/<name>.fio, runs it and parses the JSON report, [] when fio failed
+def execute(job: FioJob, text: str, name: str, output_dir: str, settings: dict, prefix: list = None):
+    path = os.path.join(output_dir, name + ".fio")
+    with open(path, "w") as file:
+        file.write(text)
+    output = os.path.join(output_dir, name + ".json")
+    print("Running fio " + name + "...")
+    # fio prints nothing until it writes the JSON report at the end, so there is no idle timeout, only the wall
+    # timeout: runtime, ramp_time and layout_timeout for laying out the test files
+    result = stream_runner.run((prefix or []) + ["fio", "--output-format=json", "--output=" + output, path], lambda line: None, wall_timeout=wall_timeout(settings))
+    try:
+        with open(output) as file:
+            parsed = parse(job, json.load(file))
+    except (OSError, ValueError):
+        parsed = []
+    if not result.ok() or not parsed:
+        print("fio " + name + " failed, see logs for details.")
+        tools.write_log("fio " + name + " failed\n" + result.output())
+        return []
+    return parsed
+
+
+# runs every job in order, writes its job file and JSON output to output_dir and every result to sink as soon
+# as the job is done
+def run(jobs: list, directory: str, output_dir: str, settings: dict, sink=None, engine: str = "libaio", prefix: list = None):
+    os.makedirs(output_dir, exist_ok=True)
+    results = []
+    for job in jobs:
+        parsed = execute(job, job_file(job, directory, settings, engine), job.name(), output_dir, settings, prefix)
+        for record in parsed:
+            if sink is not None:
+                sink(record)
+        results += parsed
+    return results
+
+
+# a scaling result: the devices read at once and the aggregate result, with the bandwidth per device and the
+# aggregate as a percentage of the sum of the same devices measured alone
+class ScalingResult(NamedTuple):
+    target: str
+    kind: str
+    devices: int
+    result: FioResult
+    per_device: float
+    efficiency: float
+
+
+SCALING_FIELDS = ["Target", "Kind", "Devices"] + FIELDS + ["Bandwidth per Device (MiB/s)", "Scaling Efficiency (%)"]
+
+
+def scaling_row(result: ScalingResult) -> list:
+    return [result.target, result.kind, result.devices] + row(result.result) + ["" if value is None else value for value in result[4:]]
+
+
+# targets: [{"name": "nvme0n1", "kind": "nvme", "devices": ["nvme0n1"], "paths": ["/dev/nvme0n1"]}, ...], the
+# single devices first: a target of several devices is compared against the sum of its devices alone. Write
+# jobs are skipped, the devices are only ever read.
+def run_scaling(jobs: list, targets: list, output_dir: str, settings: dict, sink=None, engine: str = "libaio", prefix: list = None):
+    os.makedirs(output_dir, exist_ok=True)
+    alone = {}
+    results = []
+    for job in jobs:
+        if job.rw not in ("read", "randread"):
+            print("Skipping fio " + job.name() + ", scaling only reads from the devices.")
+            continue
+        for target in targets:
+            parsed = execute(job, device_job_file(job, target["paths"], settings, engine), job.name() + "-" + target["name"], output_dir, settings, prefix)
+            for record in parsed:
+                count = len(target["devices"])
+                if count == 1:
+                    alone[(target["devices"][0], job)] = record.bandwidth
+                singles = [alone.get((device, job)) for device in target["devices"]]
+                efficiency = round(record.bandwidth / sum(singles) * 100, 1) if None not in singles and sum(singles) else None
+                result = ScalingResult(target["name"], target["kind"], count, record, round(record.bandwidth / count, 2), efficiency)
+                if sink is not None:
+                    sink(result)
+                results.append(result)
+    return results
+
+
+def cleanup(directory: str):
+    for path in glob.glob(os.path.join(directory, "fio-data.*")):
+        os.remove(path)
+
+
+def print_table(results: list):
+    table1 = PrettyTable()
+    table1.field_names = FIELDS
+    for result in results:
+        table1.add_row(row(result))
+    print(table1)
+
+
+def print_scaling(results: list):
+    table1 = PrettyTable()
+    table1.field_names = ["Target", "Kind", "Devices", "Job", "Bandwidth (MiB/s)", "IOPS", "P99 Latency (us)", "Bandwidth per Device (MiB/s)", "Scaling Efficiency (%)"]
+    for result in results:
+        table1.add_row([result.target, result.kind, result.devices, result.result.job, result.result.bandwidth, result.result.iops,
+                        "" if result.result.p99 is None else result.result.p99, "" if result.per_device is None else result.per_device,
+                        "" if result.efficiency is None else result.efficiency])
+    print(table1)
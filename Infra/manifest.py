@@ -0,0 +1,192 @@
+import os
+import glob
+import json
+import time
+import datetime
+import contextlib
+import functools
+
+# a manifest of every unit of work of a runner invocation (a test, or a model/shape/size of a test), with its
+# status and the output files it wrote, saved to Outputs/Runs/<run id>.json after every change. A crashed or
+# interrupted run continues with
+#   python3 NVIDIA_runner.py --resume <run id>
+# which runs the same arguments again, skipping every unit that is done: failed units and the ones that never
+# finished are run again, and the output files of the done units are left alone.
+#
+# status: pending -> running -> done | failed, a unit left running was interrupted
+# a test is only done when all its model/shape units are done
+
+EXCLUDED = ["log.txt", "system_specs.txt"]
+
+
+class Manifest:
+    def __init__(self, path: str, data: dict):
+        self.path = path
+        self.data = data
+
+    @classmethod
+    def create(cls, directory: str, arguments: list, machine: str):
+        run_id = datetime.datetime.now().strftime("%Y%m%d-%H%M%S")
+        data = {"run_id": run_id, "machine": machine, "arguments": arguments, "created": now(), "resumed": [], "units": []}
+        manifest = cls(os.path.join(directory, run_id + ".json"), data)
+        manifest.save()
+        return manifest
+
+    @classmethod
+    def load(cls, directory: str, run_id: str):
+        path = os.path.join(directory, run_id + ".json")
+        if not os.path.exists(path):
+            runs = sorted(os.path.splitext(os.path.basename(name))[0] for name in glob.glob(os.path.join(directory, "*.json")))
+            raise ValueError("no run " + run_id + " in " + directory + (", the runs are " + ", ".join(runs) if runs else ""))
+        with open(path) as file:
+            manifest = cls(path, json.load(file))
+        manifest.data["resumed"].append(now())
+        manifest.save()
+        return manifest
+
+    def run_id(self):
+        return self.data["run_id"]
+
+    # written to a temporary file and renamed over the manifest, so a crash never leaves it half written
+    def save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        temporary = self.path + ".tmp"
+        with open(temporary, "w") as file:
+            json.dump(self.data, file, indent=4)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temporary, self.path)
+
+    def find(self, unit: str):
+        for entry in self.data["units"]:
+            if entry["id"] == unit:
+                return entry
+        return None
+
+    # adds the units that are not in the manifest yet, in order
+    def plan(self, units: list):
+        added = False
+        for unit in units:
+            if self.find(unit) is None:
+                self.data["units"].append({"id": unit, "status": "pending", "attempts": 0, "started": None, "finished": None, "results": [], "error": None})
+                added = True
+        if added:
+            self.save()
+
+    def done(self, unit: str):
+        entry = self.find(unit)
+        return entry is not None and entry["status"] == "done"
+
+    def start(self, unit: str):
+        self.plan([unit])
+        entry = self.find(unit)
+        entry.update(status="running", attempts=entry["attempts"] + 1, started=now(), finished=None, error=None)
+        self.save()
+
+    def finish(self, unit: str, status: str, results: list, error: str = None):
+        entry = self.find(unit)
+        entry.update(status=status, finished=now(), results=results, error=error)
+        self.save()
+
+    def counts(self):
+        counts = {}
+        for entry in self.data["units"]:
+            counts[entry["status"]] = counts.get(entry["status"], 0) + 1
+        return counts
+
+
+def now():
+    return datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+
+# the output files written since a time, relative to the output directory
+def written(output: str, since: float):
+    results = []
+    for path in sorted(glob.glob(os.path.join(output, "**", "*"), recursive=True)):
+        name = os.path.relpath(path, output)
+        if os.path.isfile(path) and os.path.getmtime(path) >= since and name not in EXCLUDED and not name.startswith("Runs" + os.sep):
+            results.append(name)
+    return results
+
+
+class Runs:
+    def __init__(self):
+        self.manifest = None
+        self.output = None
+        self.failure = {}
+        self.open = []
+
+    # starts a new manifest, or loads the one of --resume <run id> and returns the arguments it was started with
+    def configure(self, arguments: list, machine: str):
+        self.output = os.path.join(os.getcwd(), "Outputs")
+        directory = os.path.join(self.output, "Runs")
+        if "--resume" in arguments:
+            index = arguments.index("--resume")
+            if index + 1 >= len(arguments):
+                raise ValueError("--resume needs a run id, see " + directory)
+            self.manifest = Manifest.load(directory, arguments[index + 1])
+            print("Resuming run " + self.manifest.run_id() + ": " + ", ".join(str(count) + " " + status for status, count in self.manifest.counts().items()))
+            return self.manifest.data["arguments"]
+        self.manifest = Manifest.create(directory, arguments, machine)
+        print("Run " + self.manifest.run_id() + ", continue it after a crash with --resume " + self.manifest.run_id())
+        return arguments
+
+    def plan(self, units: list):
+        if self.manifest is not None:
+            self.manifest.plan(units)
+
+    def done(self, unit: str):
+        return self.manifest is not None and self.manifest.done(unit)
+
+    # done, saying so
+    def skip(self, unit: str):
+        if not self.done(unit):
+            return False
+        print(unit + " is already done in run " + self.manifest.run_id() + ", skipping")
+        return True
+
+    # marks the unit that is running as failed without an exception, e.g. when its build failed
+    def fail(self, unit: str, error: str):
+        self.failure[unit] = error
+
+    # runs the body as a unit, done when it returns, failed when it raises or fail() was called
+    @contextlib.contextmanager
+    def unit(self, unit: str, results: list = None):
+        if self.manifest is None:
+            yield
+            return
+        since = time.time()
+        self.manifest.start(unit)
+        self.open.append(unit)
+        try:
+            yield
+        except BaseException as error:
+            self.finish(unit, "failed", results or written(self.output, since), type(error).__name__ + ": " + str(error))
+            raise
+        error = self.failure.pop(unit, None)
+        self.finish(unit, "failed" if error else "done", results or written(self.output, since), error)
+
+    # a failed unit fails the units it runs in, e.g. a failed model/shape its test, so a resumed run runs the test
+    # again (skipping the model/shapes that are done)
+    def finish(self, unit: str, status: str, results: list, error: str):
+        self.open.remove(unit)
+        self.failure.pop(unit, None)
+        self.manifest.finish(unit, status, results, error)
+        if status == "failed":
+            for parent in self.open:
+                self.failure.setdefault(parent, unit + " failed")
+
+    # decorator for the run_<test> functions of the runners, done tests are skipped
+    def tracked(self, name: str):
+        def decorate(fn):
+            @functools.wraps(fn)
+            def run(*args, **kwargs):
+                if self.skip(name):
+                    return None
+                with self.unit(name):
+                    return fn(*args, **kwargs)
+            return run
+        return decorate
+
+
+runs = Runs()
@@ -0,0 +1,361 @@
+import os
+import re
+import csv
+import json
+import shlex
+import socket
+import itertools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from prettytable import PrettyTable
+from Infra import tools
+from Infra import stream_runner
+from Infra import collectives
+
+# runs collective tests across the nodes of a hostfile. A launcher starts every rank of a job (one rank per GPU),
+# the output of every rank is saved to its own log, and the result rows printed by rank 0 are parsed the same way
+# as the single node runs. On top of the full job:
+#   pairs:   every node pair, in rounds of disjoint pairs that run at the same time
+#   bisect:  splits the allocation in halves that run at the same time and follows the slower half, so one slow
+#            node (or its NIC/rail) among N is found in log2(N) rounds
+#
+# launchers, selected by "launcher" in the "Multinode" block of config.json:
+#   mpirun:  one mpirun for the whole job, needed by the MPI builds of nccl-tests/rccl-tests
+#   ssh:     one ssh per rank with RANK/WORLD_SIZE/LOCAL_RANK/MASTER_ADDR/MASTER_PORT set, for torch.distributed
+#   local:   same as ssh, but every host of the hostfile is a group of local processes, for testing
+
+TAG = re.compile(r"^\[\d+,(\d+)\]<(?:stdout|stderr)>:\s?(.*)$")
+
+
+# OpenMPI style hostfile, "node1 slots=8" or just "node1" per line, # starts a comment
+def read_hostfile(path: str, slots: int):
+    hosts = []
+    with open(path) as file:
+        for line in file:
+            fields = line.split("#")[0].split()
+            if not fields:
+                continue
+            count = slots
+            for field in fields[1:]:
+                if field.startswith("slots="):
+                    count = int(field.split("=")[1])
+            hosts.append((fields[0], count))
+    return hosts
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+# the rank variables torch.distributed and the collective workers read
+def rank_env(rank: int, local_rank: int, world_size: int, slots: int, host: str):
+    return {
+        "RANK": str(rank),
+        "WORLD_SIZE": str(world_size),
+        "LOCAL_RANK": str(local_rank),
+        "LOCAL_WORLD_SIZE": str(slots),
+        "NODE_NAME": host,
+    }
+
+
+# a launcher turns a job into the processes to start, as (rank, cmd, env) units. rank None means the process
+# prints the output of several ranks, tagged as [job,rank]<stdout>: (mpirun --tag-output)
+class MpirunLauncher:
+    def __init__(self, mpirun: str = "mpirun", args: list = None):
+        self.mpirun = mpirun
+        self.args = args or []
+
+    def master(self, hosts: list):
+        return hosts[0]
+
+    def units(self, hosts: list, slots: int, cmd: list, env: dict):
+        mpi = [
+            self.mpirun, "-np", str(len(hosts) * slots),
+            "--host", ",".join(host + ":" + str(slots) for host in hosts),
+            "--map-by", "ppr:" + str(slots) + ":node", "--bind-to", "none", "--tag-output",
+        ] + self.args
+        for name in sorted(env):
+            mpi += ["-x", name]
+        return [(None, mpi + cmd, dict(os.environ, **env))]
+
+
+class SSHLauncher:
+    def __init__(self, args: list = None):
+        self.args = args or ["-o", "BatchMode=yes"]
+
+    def master(self, hosts: list):
+        return hosts[0]
+
+    def units(self, hosts: list, slots: int, cmd: list, env: dict):
+        units = []
+        for node, host in enumerate(hosts):
+            for local_rank in range(slots):
+                rank = node * slots + local_rank
+                variables = dict(env, **rank_env(rank, local_rank, len(hosts) * slots, slots, host))
+                remote = "cd " + shlex.quote(os.getcwd()) + " && env " + " ".join(shlex.quote(name + "=" + value) for name, value in sorted(variables.items())) + " " + " ".join(shlex.quote(arg) for arg in cmd)
+                units.append((rank, ["ssh"] + self.args + [host, remote], None))
+        return units
+
+
+# stand-in for a cluster: the "hosts" are only names, every rank is a local process
+class LocalLauncher:
+    def master(self, hosts: list):
+        return "127.0.0.1"
+
+    def units(self, hosts: list, slots: int, cmd: list, env: dict):
+        units = []
+        for node, host in enumerate(hosts):
+            for local_rank in range(slots):
+                rank = node * slots + local_rank
+                units.append((rank, cmd, dict(os.environ, **env, **rank_env(rank, local_rank, len(hosts) * slots, slots, host))))
+        return units
+
+
+def launcher(config: dict):
+    name = config.get("launcher", "mpirun")
+    if name == "mpirun":
+        return MpirunLauncher(config.get("mpirun", "mpirun"), config.get("mpirun_args"))
+    if name == "ssh":
+        return SSHLauncher(config.get("ssh_args"))
+    if name == "local":
+        return LocalLauncher()
+    raise ValueError("unknown launcher " + name + ", expected mpirun, ssh or local")
+
+
+# writes every line to the log of the rank that printed it, only the lines of rank 0 are parsed
+class RankOutput:
+    def __init__(self, directory: str, parser):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.parser = parser
+        self.files = {}
+        self.lock = threading.Lock()
+
+    def __call__(self, rank, line: str):
+        if rank is None:
+            match = TAG.match(line)
+            if match is not None:
+                rank, line = int(match.group(1)), match.group(2)
+        with self.lock:
+            name = "launcher" if rank is None else "rank_" + str(rank)
+            if name not in self.files:
+                self.files[name] = open(os.path.join(self.directory, name + ".log"), "w")
+            self.files[name].write(line + "\n")
+        return self.parser(line) if rank == 0 else None
+
+    def close(self):
+        for file in self.files.values():
+            file.close()
+
+
+# out-of-place bus bandwidth of the largest message size, the figure nodes are compared by
+def busbw(records: list):
+    if not records:
+        return None
+    return max(records, key=lambda record: record.size).oop_busbw
+
+
+# circle method: N - 1 rounds of disjoint pairs that cover every pair once
+def pair_rounds(hosts: list):
+    nodes = list(hosts) + ([None] if len(hosts) % 2 else [])
+    rounds = []
+    for _ in range(len(nodes) - 1):
+        pairs = [(nodes[i], nodes[len(nodes) - 1 - i]) for i in range(len(nodes) // 2)]
+        rounds.append([pair for pair in pairs if None not in pair])
+        nodes = [nodes[0], nodes[-1]] + nodes[1:-1]
+    return rounds
+
+
+# groups that share a node cannot run at the same time, they go to later waves
+def waves(groups: list):
+    scheduled = []
+    for group in groups:
+        for wave in scheduled:
+            if not any(set(group) & set(other) for other in wave):
+                wave.append(group)
+                break
+        else:
+            scheduled.append([group])
+    return scheduled
+
+
+class Multinode:
+    def __init__(self, path: str, name: str, machine: str):
+        file = open(path)
+        data = json.load(file)
+        file.close()
+        config = data.get("Multinode", {})
+        self.name = name
+        self.machine_name = machine
+        self.hostfile = config.get("hostfile", "hostfile")
+        self.slots = config.get("gpus_per_node", 8)
+        self.program = config.get("program", "nccl-tests")
+        self.backend = config.get("backend", "nccl")
+        self.env = config.get("env", {})
+        self.probe_size = config.get("probe_size", "1G")
+        self.band = config.get("band", 0.1)
+        self.pairs = config.get("pairs", True)
+        self.port = config.get("port", 29500)
+        self.wall_timeout, self.idle_timeout = stream_runner.timeouts(config, 3600, 600)
+        self.launcher = launcher(config)
+        self.ports = itertools.count()
+        self.lock = threading.Lock()
+
+    def hosts(self):
+        hosts = read_hostfile(self.hostfile, self.slots)
+        if len(set(slots for _, slots in hosts)) > 1:
+            raise ValueError("every host of " + self.hostfile + " needs the same number of slots")
+        if hosts:
+            self.slots = hosts[0][1]
+        return [host for host, _ in hosts]
+
+    def output_dir(self, label: str):
+        return os.path.join(os.getcwd(), "Outputs", self.name + "_Multinode_" + self.machine_name, label)
+
+    def master_port(self):
+        if isinstance(self.launcher, LocalLauncher):
+            return free_port()
+        # concurrent jobs of a round share the master node only when padded, every job gets its own port
+        with self.lock:
+            return self.port + next(self.ports) % 1000
+
+    # runs one collective on the given hosts. command(collective, start, end) is what every rank runs and
+    # wrap(cmd, env) lets the benchmark run the launcher somewhere else (e.g. inside its container)
+    def job(self, label: str, hosts: list, run: tuple, start, end, command, wrap=None, sink=None):
+        collective, algo, proto = run
+        env = dict(self.env, **collectives.env(algo, proto))
+        env["MASTER_ADDR"] = self.launcher.master(hosts)
+        env["MASTER_PORT"] = str(self.master_port())
+
+        output = RankOutput(os.path.join(self.output_dir(label), collective), lambda line: collectives.parse_row(collective, algo, proto, line))
+        units = self.launcher.units(hosts, self.slots, command(collective, start, end), env)
+
+        def start_unit(unit):
+            rank, cmd, environment = unit
+            if wrap is not None:
+                cmd = wrap(cmd, env)
+            return stream_runner.run(cmd, lambda line: output(rank, line), sink, env=environment, wall_timeout=self.wall_timeout, idle_timeout=self.idle_timeout)
+
+        with ThreadPoolExecutor(max_workers=len(units)) as pool:
+            results = list(pool.map(start_unit, units))
+        output.close()
+        if not all(result.ok() for result in results):
+            print("Multi-node " + collective + " on " + ",".join(hosts) + " failed, see " + self.output_dir(label))
+        return [record for result in results for record in result.records]
+
+    # runs groups of hosts at the same time with a single message size, returns the bus bandwidth of every group
+    def probe(self, label: str, groups: list, run: tuple, command, wrap=None):
+        values = {}
+        for wave in waves(groups):
+            with ThreadPoolExecutor(max_workers=len(wave)) as pool:
+                futures = {tuple(group): pool.submit(self.job, label + "_" + "-".join(group), group, run, self.probe_size, self.probe_size, command, wrap) for group in wave}
+            for group, future in futures.items():
+                values[group] = busbw(future.result())
+        return values
+
+    # the whole allocation with the full size sweep of every configured run, then every node pair
+    def run(self, runs: list, start, end, command, wrap=None):
+        hosts = self.hosts()
+        print("Running " + self.name + " on " + str(len(hosts)) + " nodes x " + str(self.slots) + " GPUs through " + type(self.launcher).__name__)
+        sink = stream_runner.CSVSink(os.path.join(os.getcwd(), "Outputs", self.name + "_Multinode_" + self.machine_name + ".csv"), collectives.FIELDS, collectives.row)
+        results = []
+        for run in runs:
+            print("Running " + run[0] + " (algo " + run[1] + ", proto " + run[2] + ") on all nodes")
+            results += self.job("job", hosts, run, start, end, command, wrap, sink)
+        sink.close()
+        collectives.print_tables(results)
+
+        if self.pairs and len(hosts) > 2:
+            self.run_pairs(hosts, runs[0], command, wrap)
+        return results
+
+    def run_pairs(self, hosts: list, run: tuple, command, wrap=None):
+        print("Running " + run[0] + " on every node pair at " + self.probe_size)
+        values = {}
+        for pairs in pair_rounds(hosts):
+            values.update(self.probe("pair", [list(pair) for pair in pairs], run, command, wrap))
+
+        with open(os.path.join(os.getcwd(), "Outputs", self.name + "_Pairs_" + self.machine_name + ".csv"), "w") as csvFile:
+            writer = csv.writer(csvFile, delimiter=',', quotechar='"', quoting=csv.QUOTE_MINIMAL)
+            writer.writerow(["Node A", "Node B", "Collective", "Algorithm", "Protocol", "Size", "Busbw (GB/s)"])
+            for (a, b), value in sorted((tuple(sorted(pair)), value) for pair, value in values.items()):
+                writer.writerow([a, b, run[0], run[1], run[2], self.probe_size, "" if value is None else value])
+
+        table1 = PrettyTable()
+        table1.field_names = ["Node"] + hosts
+        for a in hosts:
+            table1.add_row([a] + ["-" if a == b else values.get((a, b), values.get((b, a))) for b in hosts])
+        print(run[0] + " bus bandwidth (GB/s) between node pairs")
+        print(table1)
+        return values
+
+    # every pair of 2 or 3 nodes: a node is slow when all its pairs are slower than the fastest pair by more than
+    # the band. Two nodes make a single pair, which tells whether the pair is slow but not which node
+    def triangulate(self, suspects: list, rows: list, run: tuple, command, wrap=None):
+        pairs = [[a, b] for i, a in enumerate(suspects) for b in suspects[i + 1:]]
+        values = self.probe("bisect1", pairs, run, command, wrap)
+        measured = {tuple(pair): values[tuple(pair)] or 0.0 for pair in pairs}
+        fast = max(measured.values())
+        slow = [pair for pair, value in measured.items() if fast > 0 and (fast - value) / fast > self.band]
+        for pair, value in measured.items():
+            rows.append([1, " ".join(pair), value, pair in slow])
+        if len(pairs) == 1:
+            print("Two nodes cannot be split, the pair runs at " + str(fast) + " GB/s, compare it with nodes known to be good")
+            return suspects
+        found = [host for host in suspects if slow and all(pair in slow for pair in measured if host in pair)]
+        if not found:
+            print("No single slow node among: " + ", ".join(suspects))
+        return found or suspects
+
+    # follows the slower half of the suspects until one node is left. Halves of a single node are padded with a
+    # node already cleared, so every test still goes through the network; 2 or 3 nodes, where no node is cleared
+    # yet, are tested pair by pair instead. Stops when both halves are within band
+    def bisect(self, run: tuple, command, wrap=None):
+        hosts = self.hosts()
+        suspects = list(hosts)
+        rows = []
+        round_number = 0
+        print("Bisecting " + str(len(hosts)) + " nodes with " + run[0] + " at " + self.probe_size)
+        while len(suspects) > 1:
+            round_number += 1
+            cleared = [host for host in hosts if host not in suspects]
+            halves = [suspects[:len(suspects) // 2], suspects[len(suspects) // 2:]]
+            groups = []
+            if not cleared and len(suspects) <= 3:
+                suspects = self.triangulate(suspects, rows, run, command, wrap)
+                break
+            for i, half in enumerate(halves):
+                if len(half) == 1:
+                    half = half + [cleared[i % len(cleared)]]
+                groups.append(half)
+
+            values = self.probe("bisect" + str(round_number), groups, run, command, wrap)
+            measured = [values[tuple(group)] or 0.0 for group in groups]
+            fast = max(measured)
+            slow = measured.index(min(measured))
+            for group, value in zip(groups, measured):
+                rows.append([round_number, " ".join(group), value, group is groups[slow] and fast > 0 and (fast - value) / fast > self.band])
+            if fast == 0:
+                print("Both halves failed, stopping")
+                break
+            if (fast - measured[slow]) / fast <= self.band:
+                print("Both halves are within " + str(round(100 * self.band, 2)) + "% of each other, no single slow node among: " + ", ".join(suspects))
+                break
+            suspects = halves[slow]
+
+        table1 = PrettyTable()
+        table1.field_names = ["Round", "Nodes", "Busbw (GB/s)", "Slower"]
+        for row in rows:
+            table1.add_row(row)
+        print(table1)
+        with open(os.path.join(os.getcwd(), "Outputs", self.name + "_Bisect_" + self.machine_name + ".csv"), "w") as csvFile:
+            writer = csv.writer(csvFile, delimiter=',', quotechar='"', quoting=csv.QUOTE_MINIMAL)
+            writer.writerow(["Round", "Nodes", "Busbw (GB/s)", "Slower"])
+            for row in rows:
+                writer.writerow(row)
+        if len(suspects) == 1:
+            print("Slow node: " + suspects[0])
+            tools.write_log("Bisection found slow node " + suspects[0])
+        return suspects
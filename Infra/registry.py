@@ -0,0 +1,115 @@
+import os
+import json
+import time
+import inspect
+import importlib
+import importlib.util
+from typing import NamedTuple
+from Infra import tracing
+from Infra import manifest
+from Infra import telemetry
+
+# the benchmarks of a runner, declared with the subcommand that selects them, the module they live in and the
+# python packages they need, and imported only when selected: `python3 NVIDIA_runner.py fio` never imports
+# torch, numpy or huggingface_hub, and a missing optional package only skips the tests that need it.
+#
+#   tests = registry.Registry("nvidia")
+#
+#   @tests.benchmark("nccl", "NCCLBandwidth", "Benchmarks.NVIDIA.NCCLBandwidth", requires=["numpy"],
+#                    usage=[("NCCL Bandwidth", "nccl"), ...])
+#   def run_NCCLBandwidth(NCCL, scheduler=None):
+#       test = NCCL.NCCLBandwidth("config.json", host_name)
+#
+# the entry point gets the imported module as its first argument. It is a unit of the run manifest, traced, and
+# sampled by the telemetry while it runs, and the classes of the module are traced method by method.
+#
+# `--import-only` imports the selected benchmarks and prints the import times as json instead of running them,
+# for the startup time budget checked by Infra/startup.py
+
+
+class Benchmark(NamedTuple):
+    subcommand: str
+    name: str
+    vendor: str
+    module: str
+    requires: list
+    usage: list
+    run: object
+
+
+class Registry:
+    def __init__(self, vendor: str):
+        self.vendor = vendor
+        self.benchmarks = {}
+        self.modules = {}
+        self.imported = {}
+
+    def benchmark(self, subcommand: str, name: str, module: str, requires: list = None, usage: list = None):
+        def decorate(fn):
+            def run(*args):
+                missing = self.missing(name)
+                if missing:
+                    print(name + " needs " + ", ".join(missing) + ", which is not installed, skipping")
+                    manifest.runs.fail(name, "missing " + ", ".join(missing))
+                    return None
+                return fn(self.load(name), *args)
+            run = manifest.runs.tracked(name)(tracing.tracer.traced(name)(telemetry.monitor.attached(name)(run)))
+            self.benchmarks[name] = Benchmark(subcommand, name, self.vendor, module, requires or [], usage or [], run)
+            return run
+        return decorate
+
+    # the packages of the benchmark that cannot be imported, found without importing them
+    def missing(self, name: str):
+        return [package for package in self.benchmarks[name].requires if importlib.util.find_spec(package) is None]
+
+    # imports the module of the benchmark on first use and traces its classes
+    def load(self, name: str):
+        if name not in self.modules:
+            benchmark = self.benchmarks[name]
+            start = time.perf_counter()
+            with tracing.tracer.span("import " + benchmark.module, "import"):
+                module = importlib.import_module(benchmark.module)
+            self.imported[name] = time.perf_counter() - start
+            tracing.tracer.instrument(*[value for value in vars(module).values() if inspect.isclass(value) and value.__module__ == module.__name__])
+            self.modules[name] = module
+        return self.modules[name]
+
+    # the benchmarks whose subcommand is in the arguments, in the order they were declared
+    def selected(self, arguments: list):
+        return [benchmark for benchmark in self.benchmarks.values() if benchmark.subcommand in arguments]
+
+    # runs the selected benchmarks one after the other, returns whether any was selected
+    def run(self, arguments: list, directory: str):
+        selected = self.selected(arguments)
+        for benchmark in selected:
+            benchmark.run()
+            os.chdir(directory)
+        return len(selected) > 0
+
+    def import_only(self, arguments: list):
+        selected = self.benchmarks.values() if "all" in arguments else self.selected(arguments)
+        missing = {}
+        for benchmark in selected:
+            missing[benchmark.name] = self.missing(benchmark.name)
+            if not missing[benchmark.name]:
+                self.load(benchmark.name)
+        print(json.dumps({
+            "vendor": self.vendor,
+            "subcommands": [benchmark.subcommand for benchmark in self.benchmarks.values()],
+            "imported": {name: round(seconds, 4) for name, seconds in self.imported.items()},
+            "missing": {name: packages for name, packages in missing.items() if packages},
+        }))
+
+    def usage(self, runner: str):
+        lines = [
+            "Usage: python3 " + runner + " [arg]",
+            "   or: python3 " + runner + " [arg1] [arg2] ... to run more than one test e.g python3 " + runner + " hbm " + ("nccl" if self.vendor == "nvidia" else "rccl"),
+            "Arguments are as follows, and are case insensitive:",
+            "All tests:  all",
+            "Resume an interrupted run, skipping the finished tests:  --resume <run id>",
+            "Import the selected tests without running them, to time the startup:  --import-only",
+        ]
+        for benchmark in self.benchmarks.values():
+            for description, arguments in benchmark.usage:
+                lines.append(description + ":  " + arguments)
+        return "\n".join(lines)
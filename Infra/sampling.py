@@ -0,0 +1,133 @@
+import math
+import statistics
+
+# repeats a benchmark until the confidence interval of the median of every metric is narrower than target
+# (relative to the median), between min_runs and max_runs runs. The interval comes from order statistics, so
+# it assumes nothing about the distribution; at 95% it needs at least 6 kept runs. Leading runs far from the
+# rest (cold caches, clocks ramping up) are discarded as warmup before the statistics are computed.
+#
+# config["inputs"]["sampling"] = {"target": 0.01, "confidence": 0.95, "min_runs": 6, "max_runs": 30}
+# without it the test runs num_runs times, as before
+
+FIELDS = ["Median", "CI Low", "CI High", "CI (+-%)", "CoV (%)", "Min", "Max", "Mean", "Runs", "Warmup Discarded"]
+UNITLESS = ["CI (+-%)", "CoV (%)", "Runs", "Warmup Discarded"]
+
+
+# FIELDS with the unit on the value columns
+def fields(unit: str):
+    return [field if field in UNITLESS else field + " (" + unit + ")" for field in FIELDS]
+
+
+def from_config(inputs: dict, num_runs: int):
+    sampling = inputs.get("sampling")
+    if sampling is None:
+        return {"target": None, "confidence": 0.95, "min_runs": num_runs, "max_runs": num_runs}
+    return {
+        "target": sampling.get("target", 0.01),
+        "confidence": sampling.get("confidence", 0.95),
+        "min_runs": sampling.get("min_runs", 6),
+        "max_runs": sampling.get("max_runs", 30),
+    }
+
+
+# ranks (1-based) of the order statistics bounding the median with at least the given confidence,
+# None when n is too small for any interval to reach it
+def median_ci_ranks(n: int, confidence: float):
+    if n < 1:
+        return None
+    # P(X < j) for X ~ Binomial(n, 1/2), the interval [x_j, x_(n+1-j)] misses the median with 2 * P(X < j)
+    tail = 0.0
+    best = None
+    for j in range(1, n // 2 + 1):
+        tail += math.comb(n, j - 1) / 2 ** n
+        if 2 * tail > 1 - confidence:
+            break
+        best = j
+    if best is None:
+        return None
+    return best, n + 1 - best
+
+
+def median_ci(values: list, confidence: float = 0.95):
+    ranks = median_ci_ranks(len(values), confidence)
+    if ranks is None:
+        return None
+    ordered = sorted(values)
+    return ordered[ranks[0] - 1], ordered[ranks[1] - 1]
+
+
+# number of leading runs that are outliers against the median absolute deviation of the runs after them
+def warmup(values: list, threshold: float = 3.5):
+    discarded = 0
+    while len(values) - discarded > 3:
+        rest = values[discarded + 1:]
+        median = statistics.median(rest)
+        mad = statistics.median(abs(value - median) for value in rest)
+        # modified z-score, with a 1% floor so a perfectly quiet tail does not flag tiny differences
+        scale = max(mad / 0.6745, 0.01 * abs(median) / threshold)
+        if scale == 0 or abs(values[discarded] - median) / scale <= threshold:
+            break
+        discarded += 1
+    return discarded
+
+
+class Sampler:
+    def __init__(self, metrics: list, target: float = 0.01, confidence: float = 0.95, min_runs: int = 6, max_runs: int = 30):
+        self.metrics = metrics
+        self.target = target
+        self.confidence = confidence
+        self.min_runs = min_runs
+        self.max_runs = max(min_runs, max_runs)
+        self.samples = {metric: [] for metric in metrics}
+        self.attempts = 0
+
+    # one run, {metric: value}, or None when the run failed
+    def add(self, sample: dict):
+        self.attempts += 1
+        if sample is None:
+            return
+        for metric in self.metrics:
+            self.samples[metric].append(sample[metric])
+
+    def runs(self):
+        return len(self.samples[self.metrics[0]])
+
+    # relative half width of the interval of every metric, None when there is no interval yet
+    def widths(self):
+        widths = {}
+        for metric, values in self.samples.items():
+            kept = values[warmup(values):]
+            ci = median_ci(kept, self.confidence)
+            median = statistics.median(kept) if kept else 0
+            widths[metric] = (ci[1] - ci[0]) / 2 / median if ci is not None and median else None
+        return widths
+
+    def done(self):
+        if self.attempts >= self.max_runs:
+            return True
+        if self.runs() < self.min_runs:
+            return False
+        if self.target is None:
+            return True
+        return all(width is not None and width <= self.target for width in self.widths().values())
+
+    # [metric, FIELDS...] per metric, values divided by scale
+    def rows(self, scale: float = 1):
+        rows = []
+        for metric, values in self.samples.items():
+            if not values:
+                rows.append([metric] + ["-"] * (len(FIELDS) - 2) + [0, 0])
+                continue
+            discarded = warmup(values)
+            kept = [value / scale for value in values[discarded:]]
+            median = statistics.median(kept)
+            mean = statistics.mean(kept)
+            ci = median_ci(kept, self.confidence)
+            cov = statistics.stdev(kept) / mean * 100 if len(kept) > 1 and mean else 0.0
+            rows.append([
+                metric, round(median, 2),
+                "-" if ci is None else round(ci[0], 2), "-" if ci is None else round(ci[1], 2),
+                "-" if ci is None or not median else round((ci[1] - ci[0]) / 2 / median * 100, 2),
+                round(cov, 2), round(min(kept), 2), round(max(kept), 2), round(mean, 2), len(kept), discarded,
+            ])
+        return rows
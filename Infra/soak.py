@@ -0,0 +1,33 @@
+import statistics
+
+# summarizes a throughput time series [(seconds since start, value), ...] recorded under sustained load
+#   initial:    mean of the first samples, before clocks and power have settled
+#   sustained:  mean of the second half of the run
+#   drop:       percent lost from initial to sustained
+#   throttle:   first time the throughput fell below initial * (1 - threshold) and stayed there for `hold` samples
+def summarize(series: list, threshold: float = 0.05, hold: int = 3):
+    values = [value for _, value in series]
+    if not values:
+        return None
+
+    head = max(1, min(5, len(values) // 10))
+    initial = statistics.mean(values[:head])
+    sustained = statistics.mean(values[len(values) // 2:])
+
+    throttle = None
+    limit = initial * (1 - threshold)
+    for i in range(len(values)):
+        window = values[i:i + hold]
+        if len(window) == hold and all(value < limit for value in window):
+            throttle = series[i][0]
+            break
+
+    return {
+        "samples": len(values),
+        "initial": round(initial, 2),
+        "sustained": round(sustained, 2),
+        "min": round(min(values), 2),
+        "max": round(max(values), 2),
+        "drop": round(100 * (initial - sustained) / initial, 2) if initial else 0.0,
+        "throttle": None if throttle is None else round(throttle, 1),
+    }
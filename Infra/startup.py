@@ -0,0 +1,118 @@
+import os
+import sys
+import csv
+import json
+import argparse
+import statistics
+import subprocess
+import time
+from prettytable import PrettyTable
+from Infra import tools
+
+# startup time of a runner per subcommand: the runner is started with --import-only, which imports the selected
+# benchmarks and exits before anything runs, so the time is the interpreter, the Infra modules and the
+# benchmark modules with their packages. Every subcommand of the registry is timed runs times (and the runner
+# with none, the base cost), the median is compared against its budget, and the packages with the most import
+# time (python -X importtime) are listed for the subcommands over budget:
+#   python3 -m Infra.startup NVIDIA_runner.py
+#   python3 -m Infra.startup AMD_runner.py fio hbm --runs 10
+# The results go to Outputs/Startup_<runner>_<hostname>.csv, and the exit code is 1 when a subcommand is over
+# its budget, so it can gate a change that imports something heavy at module level.
+#
+# config["Startup"] = {"runs": 5, "budget": 2.0, "budgets": {"llm": 5.0}}
+
+FIELDS = ["Runner", "Subcommand", "Runs", "Median (s)", "Min (s)", "Max (s)", "Budget (s)", "Over Budget", "Benchmark Import (s)", "Heaviest Imports"]
+
+
+def get_config(path: str):
+    file = open(path)
+    data = json.load(file)
+    file.close()
+    return data.get("Startup", {})
+
+
+# time of one runner start, and the json line --import-only prints
+def measure(runner: str, subcommand: str):
+    command = [sys.executable, runner] + ([subcommand] if subcommand else []) + ["--import-only"]
+    start = time.perf_counter()
+    results = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    seconds = time.perf_counter() - start
+    if results.returncode != 0:
+        raise RuntimeError(" ".join(command) + " failed: " + results.stderr.decode('utf-8').strip())
+    return seconds, json.loads(results.stdout.decode('utf-8').strip().split("\n")[-1])
+
+
+# the top level packages with the most self import time, from python -X importtime
+def heaviest(runner: str, subcommand: str, top: int = 5):
+    command = [sys.executable, "-X", "importtime", runner] + ([subcommand] if subcommand else []) + ["--import-only"]
+    results = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    packages = {}
+    for line in results.stderr.decode('utf-8').split("\n"):
+        # import time: self [us] | cumulative | imported package
+        fields = line.split("|")
+        if not line.startswith("import time:") or len(fields) != 3 or not fields[0].split(":")[1].strip().isdigit():
+            continue
+        package = fields[2].strip().split(".")[0]
+        packages[package] = packages.get(package, 0) + int(fields[0].split(":")[1])
+    return sorted(packages.items(), key=lambda item: -item[1])[:top]
+
+
+def run(runner: str, subcommands: list, runs: int, budget: float, budgets: dict):
+    seconds, info = measure(runner, "")
+    if not subcommands:
+        subcommands = [""] + info["subcommands"]
+    name = os.path.splitext(os.path.basename(runner))[0]
+
+    rows = []
+    for subcommand in subcommands:
+        times = []
+        for _ in range(runs):
+            seconds, info = measure(runner, subcommand)
+            times.append(seconds)
+        if info["missing"]:
+            print(subcommand + " is missing " + ", ".join(package for packages in info["missing"].values() for package in packages) + ", its import time is not measured")
+        limit = budgets.get(subcommand, budget)
+        median = statistics.median(times)
+        over = median > limit
+        sinks = ", ".join(package + " " + str(round(us / 1e6, 3)) + "s" for package, us in heaviest(runner, subcommand)) if over else ""
+        rows.append([name, subcommand or "(none)", runs, round(median, 3), round(min(times), 3), round(max(times), 3), limit, over, round(sum(info["imported"].values()), 3), sinks])
+    return rows
+
+
+def save(rows: list, path: str):
+    table1 = PrettyTable()
+    table1.field_names = FIELDS[1:-1]
+    for row in rows:
+        table1.add_row(row[1:-1])
+    print(table1)
+    for row in rows:
+        if row[7]:
+            print(row[1] + " is over its startup budget, the heaviest imports are " + row[-1])
+
+    with open(path, "w") as csvFile:
+        writer = csv.writer(csvFile, delimiter=',', quotechar='"', quoting=csv.QUOTE_MINIMAL)
+        writer.writerow(FIELDS)
+        for row in rows:
+            writer.writerow(row)
+
+
+def main(argv: list):
+    parser = argparse.ArgumentParser(description="Measure and enforce the startup time budget of a runner per subcommand")
+    parser.add_argument("runner", help="NVIDIA_runner.py or AMD_runner.py")
+    parser.add_argument("subcommands", nargs="*", help="subcommands to time, defaults to every subcommand of the runner")
+    parser.add_argument("--config", default="config.json", help="config.json with the Startup budgets")
+    parser.add_argument("--runs", type=int, help="starts timed per subcommand")
+    parser.add_argument("--budget", type=float, help="budget in seconds for the subcommands without their own")
+    args = parser.parse_args(argv)
+    config = get_config(args.config)
+    runs = args.runs or config.get("runs", 5)
+    budget = args.budget or config.get("budget", 2.0)
+
+    rows = run(args.runner, args.subcommands, runs, budget, config.get("budgets", {}))
+    tools.create_dir("Outputs")
+    save(rows, "Outputs/Startup_" + os.path.splitext(os.path.basename(args.runner))[0] + "_" + tools.get_hostname() + ".csv")
+    return 1 if any(row[7] for row in rows) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
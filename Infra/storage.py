@@ -0,0 +1,159 @@
+import os
+import json
+import subprocess
+from prettytable import PrettyTable
+from Infra import topology
+
+# block devices and filesystems of the node, from /sys/block, /proc/mounts and lsblk:
+#   disks:        whole disks (NVMe or not) with model, size, transport, NUMA node, the mount points of the disk
+#                 and its partitions, and the md/dm volumes built on it
+#   volumes:      md RAID and device mapper volumes, with their RAID level and member disks
+#   filesystems:  network filesystem mounts (NFS, Lustre, BeeGFS, ...)
+# loop, ram and zram devices and optical drives are skipped
+BLOCK_ROOT = "/sys/block"
+MOUNTS = "/proc/mounts"
+
+SKIPPED = ("loop", "ram", "zram", "sr", "fd")
+NETWORK_FILESYSTEMS = ("nfs", "nfs4", "cifs", "smb3", "lustre", "beegfs", "wekafs", "gpfs", "glusterfs", "ceph", "fuse.blobfuse", "fuse.blobfuse2")
+
+FIELDS = ["Name", "Kind", "Model", "Size (GiB)", "Transport", "NUMA Node", "Members", "Mounts"]
+
+
+def mounts(path: str = MOUNTS):
+    result = []
+    for line in (topology.read(path, "") or "").split("\n"):
+        fields = line.split()
+        if len(fields) < 3:
+            continue
+        # /proc/mounts escapes spaces in mount points as \040
+        result.append({"source": fields[0], "mount": fields[1].replace("\\040", " "), "fstype": fields[2]})
+    return result
+
+
+# {name: {"transport": ..., "model": ...}} from lsblk, empty when lsblk is missing
+def lsblk():
+    try:
+        results = subprocess.run(["lsblk", "-J", "-d", "-o", "NAME,TRAN,MODEL"], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        devices = json.loads(results.stdout.decode("utf-8")).get("blockdevices", [])
+    except (OSError, ValueError):
+        return {}
+    return {device["name"]: {"transport": device.get("tran"), "model": (device.get("model") or "").strip()} for device in devices}
+
+
+def partitions(root: str, name: str):
+    path = os.path.join(root, name)
+    return [entry for entry in sorted(os.listdir(path)) if entry.startswith(name) and os.path.exists(os.path.join(path, entry, "partition"))]
+
+
+# the whole disks behind a volume, following md/dm slaves, partitions and stacked volumes down to the disks
+def members(root: str, name: str):
+    slaves = os.path.join(root, name, "slaves")
+    result = []
+    for slave in sorted(os.listdir(slaves)) if os.path.isdir(slaves) else []:
+        if not os.path.isdir(os.path.join(root, slave)):
+            # a partition, listed under its disk
+            slave = next((disk for disk in sorted(os.listdir(root)) if slave in partitions(root, disk)), slave)
+        disks = members(root, slave) if os.path.isdir(os.path.join(root, slave, "slaves")) and os.listdir(os.path.join(root, slave, "slaves")) else [slave]
+        result += [disk for disk in disks if disk not in result]
+    return result
+
+
+def discover(root: str = BLOCK_ROOT, mounts_path: str = MOUNTS):
+    mounted = {}
+    filesystems = []
+    for entry in mounts(mounts_path):
+        if entry["fstype"] in NETWORK_FILESYSTEMS:
+            filesystems.append(entry)
+        elif entry["source"].startswith("/dev/"):
+            name = os.path.basename(os.path.realpath(entry["source"]))
+            mounted.setdefault(name, []).append(entry["mount"])
+
+    extra = lsblk()
+    disks = []
+    volumes = []
+    for name in sorted(os.listdir(root)) if os.path.isdir(root) else []:
+        if name.startswith(SKIPPED):
+            continue
+        path = os.path.join(root, name)
+        size = int(topology.read(os.path.join(path, "size"), "0") or 0) * 512
+        if size == 0:
+            continue
+        parts = partitions(root, name)
+        device = {
+            "name": name,
+            "path": "/dev/" + name,
+            "size": size,
+            "mounts": mounted.get(name, []) + [mount for part in parts for mount in mounted.get(part, [])],
+            "holders": sorted(os.listdir(os.path.join(path, "holders"))) if os.path.isdir(os.path.join(path, "holders")) else [],
+        }
+        for part in parts:
+            holders = os.path.join(path, part, "holders")
+            device["holders"] += sorted(os.listdir(holders)) if os.path.isdir(holders) else []
+        if name.startswith(("md", "dm-")):
+            device["kind"] = "raid" if name.startswith("md") else "volume"
+            device["level"] = topology.read(os.path.join(path, "md", "level"), "")
+            device["members"] = members(root, name)
+            volumes.append(device)
+            continue
+        transport = extra.get(name, {}).get("transport") or ("nvme" if name.startswith("nvme") else None)
+        numa_node = topology.read(os.path.join(path, "device", "numa_node")) or topology.read(os.path.join(path, "device", "device", "numa_node"), "-1")
+        device.update({
+            "kind": "nvme" if transport == "nvme" else "disk",
+            "model": (topology.read(os.path.join(path, "device", "model"), "") or extra.get(name, {}).get("model") or "").strip(),
+            "transport": transport,
+            "rotational": topology.read(os.path.join(path, "queue", "rotational"), "0") == "1",
+            "numa_node": int(numa_node),
+        })
+        disks.append(device)
+    return {"disks": disks, "volumes": volumes, "filesystems": filesystems}
+
+
+def nvme_disks(storage: dict):
+    return [disk for disk in storage["disks"] if disk["kind"] == "nvme"]
+
+
+# fio scaling targets for the selected disks ("auto" is every NVMe disk): each disk alone, the first 2..N disks
+# at once, and every md/dm volume built only from selected disks, read through the volume
+def targets(storage: dict, devices="auto"):
+    disks = nvme_disks(storage) if devices == "auto" else [disk for disk in storage["disks"] if disk["name"] in devices]
+    names = [disk["name"] for disk in disks]
+    result = [{"name": disk["name"], "kind": disk["kind"], "devices": [disk["name"]], "paths": [disk["path"]]} for disk in disks]
+    for count in range(2, len(disks) + 1):
+        result.append({"name": names[0] + ".." + names[count - 1], "kind": "together", "devices": names[:count], "paths": [disk["path"] for disk in disks[:count]]})
+    for volume in storage["volumes"]:
+        if volume["members"] and all(member in names for member in volume["members"]):
+            result.append({"name": volume["name"], "kind": volume.get("level") or volume["kind"], "devices": volume["members"], "paths": [volume["path"]]})
+    return result
+
+
+# a mount point on local NVMe for scratch data (model caches, checkpoint staging): the biggest mounted
+# volume built only from NVMe disks, else the biggest mounted NVMe disk, else default
+def scratch(storage: dict = None, default: str = None):
+    storage = storage or discover()
+    nvme = [disk["name"] for disk in nvme_disks(storage)]
+    candidates = [volume for volume in storage["volumes"] if volume["mounts"] and volume["members"] and all(member in nvme for member in volume["members"])]
+    candidates = candidates or [disk for disk in nvme_disks(storage) if disk["mounts"]]
+    for device in sorted(candidates, key=lambda device: -device["size"]):
+        for mount in device["mounts"]:
+            if mount not in ("/", "/boot", "/boot/efi"):
+                return mount
+    return default
+
+
+def print_table(storage: dict):
+    table1 = PrettyTable()
+    table1.field_names = FIELDS
+    for device in storage["disks"] + storage["volumes"]:
+        table1.add_row([
+            device["name"], device.get("level") or device["kind"], device.get("model", ""),
+            round(device["size"] / 1024**3, 1), device.get("transport") or "", device.get("numa_node", ""),
+            " ".join(device.get("members", [])), " ".join(device["mounts"]),
+        ])
+    for entry in storage["filesystems"]:
+        table1.add_row([entry["source"], entry["fstype"], "", "", "network", "", "", entry["mount"]])
+    print(table1)
+
+
+def save(storage: dict, path: str):
+    with open(path, "w") as file:
+        json.dump(storage, file, indent=4)
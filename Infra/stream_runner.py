@@ -0,0 +1,190 @@
+import os
+import csv
+import time
+import queue
+import signal
+import threading
+import subprocess
+from collections import deque
+from Infra import tools
+from Infra import telemetry
+from Infra import tracing
+
+# runs a benchmark and hands its output to an incremental parser line by line as it is produced, so results
+# show up (and are saved by the sink) while the tool is still running and memory is bounded to the parsed
+# records plus the last tail_lines lines of raw output. A hung tool is killed after wall_timeout seconds in
+# total or idle_timeout seconds without output
+#
+# parser(line) returns a record or None for lines that are not results, sink(record) persists a record
+class StreamResult:
+    def __init__(self):
+        self.returncode = None
+        self.timed_out = None
+        self.records = []
+        self.tail = None
+        self.bytes = 0
+
+    def ok(self):
+        return self.returncode == 0 and self.timed_out is None
+
+    def output(self):
+        return "\n".join(self.tail)
+
+
+# config["inputs"]["timeout"] = {"wall": seconds, "idle": seconds}, None disables a timeout
+def timeouts(inputs: dict, wall: float = None, idle: float = None):
+    timeout = inputs.get("timeout", {})
+    return timeout.get("wall", wall), timeout.get("idle", idle)
+
+
+def pump(lines, parser, sink, wall_timeout, idle_timeout, tail_lines):
+    result = StreamResult()
+    result.tail = deque(maxlen=tail_lines)
+    received = queue.Queue()
+
+    def read():
+        try:
+            for line in lines:
+                received.put(line)
+        finally:
+            received.put(None)
+
+    threading.Thread(target=read, daemon=True).start()
+    start = time.time()
+    while True:
+        waits = []
+        if wall_timeout is not None:
+            waits.append(start + wall_timeout - time.time())
+        if idle_timeout is not None:
+            waits.append(idle_timeout)
+        try:
+            line = received.get(timeout=max(0, min(waits)) if waits else None)
+        except queue.Empty:
+            result.timed_out = "wall" if wall_timeout is not None and time.time() - start >= wall_timeout else "idle"
+            return result
+        if line is None:
+            return result
+        result.bytes += len(line)
+        line = line.rstrip("\n")
+        result.tail.append(line)
+        record = parser(line)
+        if record is not None:
+            result.records.append(record)
+            if sink is not None:
+                sink(record)
+
+
+def run(cmd, parser, sink=None, cwd: str = None, env: dict = None, shell: bool = False, wall_timeout: float = None, idle_timeout: float = None, tail_lines: int = 200):
+    with tracing.tracer.span(tracing.command_name(cmd), "subprocess", cmd=cmd if isinstance(cmd, str) else " ".join(str(word) for word in cmd)) as span:
+        result = stream(cmd, parser, sink, cwd, env, shell, wall_timeout, idle_timeout, tail_lines)
+        span.args.update(returncode=result.returncode, output_bytes=result.bytes, records=len(result.records), timed_out=result.timed_out)
+    return result
+
+
+def stream(cmd, parser, sink, cwd, env, shell, wall_timeout, idle_timeout, tail_lines):
+    process = subprocess.Popen(
+        cmd,
+        cwd=cwd,
+        env=env,
+        shell=shell,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        text=True,
+        errors="replace",
+        bufsize=1,
+        # own process group, so a timeout also kills whatever the shell started
+        start_new_session=True,
+    )
+    result = pump(process.stdout, parser, sink, wall_timeout, idle_timeout, tail_lines)
+    if result.timed_out is not None:
+        os.killpg(process.pid, signal.SIGKILL)
+    result.returncode = process.wait()
+    finish(cmd, result)
+    return result
+
+
+# same for a command inside a running docker container
+def exec_stream(container, cmd: str, parser, sink=None, environment: dict = None, wall_timeout: float = None, idle_timeout: float = None, tail_lines: int = 200):
+    with tracing.tracer.span("docker exec " + tracing.command_name(cmd), "docker", cmd=cmd) as span:
+        result = exec_lines(container, cmd, parser, sink, environment, wall_timeout, idle_timeout, tail_lines)
+        span.args.update(returncode=result.returncode, output_bytes=result.bytes, records=len(result.records), timed_out=result.timed_out)
+    return result
+
+
+def exec_lines(container, cmd, parser, sink, environment, wall_timeout, idle_timeout, tail_lines):
+    client = container.client.api
+    # a container_pool.Pooled container adds the environment it was requested with, as its exec_run does
+    environment = dict(getattr(container, "environment", None) or {}, **(environment or {})) or None
+    exec_id = client.exec_create(container.id, cmd, environment=environment)["Id"]
+    stream = client.exec_start(exec_id, stream=True)
+
+    def lines():
+        partial = ""
+        for chunk in stream:
+            parts = (partial + chunk.decode("utf-8", errors="replace")).split("\n")
+            partial = parts.pop()
+            for part in parts:
+                yield part
+        if partial:
+            yield partial
+
+    result = pump(lines(), parser, sink, wall_timeout, idle_timeout, tail_lines)
+    if result.timed_out is not None:
+        # docker cannot signal a single exec, the pid inside the container has to be killed
+        pid = client.exec_inspect(exec_id).get("Pid")
+        if pid:
+            subprocess.run(["kill", "-9", str(pid)], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        result.returncode = -signal.SIGKILL
+    else:
+        result.returncode = client.exec_inspect(exec_id).get("ExitCode")
+    finish(cmd, result)
+    return result
+
+
+def finish(cmd, result: StreamResult):
+    if result.timed_out is not None:
+        message = "Timed out (" + result.timed_out + ") after " + str(len(result.records)) + " results: " + str(cmd)
+        print(message)
+        tools.write_log(message + "\n" + result.output())
+    elif result.returncode != 0:
+        tools.write_log(result.output())
+
+
+# appends every record to a CSV file as it arrives and flushes, so a crash keeps the rows written so far
+# while a telemetry session is running, every row gets the telemetry summary of the samples since the previous row
+class CSVSink:
+    def __init__(self, path: str, header: list, row=None):
+        self.file = open(path, "w")
+        self.writer = csv.writer(self.file, delimiter=',', quotechar='"', quoting=csv.QUOTE_MINIMAL)
+        self.session = telemetry.session
+        self.mark = self.session.mark() if self.session is not None else None
+        self.writer.writerow(header + (telemetry.SUMMARY_FIELDS if self.session is not None else []))
+        self.file.flush()
+        self.row = row
+        self.rows = []
+
+    def __call__(self, record):
+        row = self.row(record) if self.row is not None else record
+        self.rows.append(row)
+        if self.session is not None:
+            row = list(row) + self.session.window(self.mark)
+            self.mark = self.session.mark()
+        self.writer.writerow(row)
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+BABELSTREAM_FUNCTIONS = ["Copy", "Mul", "Add", "Triad", "Dot"]
+
+# BabelStream result row as [function, MBytes/sec]
+def babelstream_row(line: str):
+    fields = line.split()
+    if len(fields) < 2 or fields[0] not in BABELSTREAM_FUNCTIONS:
+        return None
+    try:
+        float(fields[1])
+    except ValueError:
+        return None
+    return [fields[0], fields[1]]
@@ -0,0 +1,389 @@
+import os
+import re
+import csv
+import glob
+import io
+import json
+import time
+import hashlib
+import threading
+import subprocess
+import datetime
+from Infra import tools
+
+# samples GPU clocks, power, temperature, utilization and throttle reasons, and CPU utilization and frequency, in
+# a background thread while a benchmark runs, so a low number can be told apart from a throttled GPU:
+#   Outputs/Telemetry_<Test>_<hostname>.csv          the time series, one row per sample
+#   Outputs/Telemetry_Summary_<hostname>.csv         one row per benchmark, with the sampling overhead
+# and SUMMARY_FIELDS appended to every result row: per row over the samples since the previous row for CSVs
+# written with stream_runner.CSVSink, over the whole benchmark for the other CSVs it wrote.
+#
+# A source is any object with a name and sample(), which returns {"<device>.<metric>": value}, e.g.
+# {"gpu0.sm_clock": 1980, "gpu0.power": 690.5}, so a fake source can drive the sampler without a GPU.
+# The sampler stretches its interval so the time spent sampling stays under max_overhead of the wall time.
+#
+# config["Telemetry"] = {"enabled": true, "interval": 1.0, "max_overhead": 0.02, "sources": "auto"},
+# sources is "auto" or a list of "nvml", "nvidia-smi", "rocm-smi", "cpu"
+
+SUMMARY_FIELDS = [
+    "Mean GPU Clock (MHz)", "Min GPU Clock (MHz)", "Max GPU Temperature (C)", "GPU Energy (J)",
+    "Throttled Samples (%)", "Mean CPU Clock (MHz)",
+]
+SESSION_FIELDS = ["Benchmark", "Start", "Seconds", "Samples", "Mean Interval (s)", "Overhead (%)"] + SUMMARY_FIELDS
+
+# power cap, hardware slowdown, software and hardware thermal slowdown and power brake; idle and the
+# applications clocks setting are not throttling
+THROTTLE_MASK = 0x4 | 0x8 | 0x40 | 0x80 | 0x100
+
+
+class NVMLSource:
+    name = "nvml"
+
+    def __init__(self):
+        import pynvml
+        self.nvml = pynvml
+        pynvml.nvmlInit()
+        self.handles = [pynvml.nvmlDeviceGetHandleByIndex(index) for index in range(pynvml.nvmlDeviceGetCount())]
+
+    def sample(self):
+        nvml = self.nvml
+        values = {}
+        for index, handle in enumerate(self.handles):
+            gpu = "gpu" + str(index) + "."
+            values[gpu + "sm_clock"] = nvml.nvmlDeviceGetClockInfo(handle, nvml.NVML_CLOCK_SM)
+            values[gpu + "mem_clock"] = nvml.nvmlDeviceGetClockInfo(handle, nvml.NVML_CLOCK_MEM)
+            values[gpu + "power"] = nvml.nvmlDeviceGetPowerUsage(handle) / 1000
+            values[gpu + "temperature"] = nvml.nvmlDeviceGetTemperature(handle, nvml.NVML_TEMPERATURE_GPU)
+            values[gpu + "utilization"] = nvml.nvmlDeviceGetUtilizationRates(handle).gpu
+            values[gpu + "throttle"] = nvml.nvmlDeviceGetCurrentClocksThrottleReasons(handle)
+        return values
+
+
+class NvidiaSMISource:
+    name = "nvidia-smi"
+    QUERY = ["index", "clocks.sm", "clocks.mem", "power.draw", "temperature.gpu", "utilization.gpu", "clocks_throttle_reasons.active"]
+    METRICS = ["sm_clock", "mem_clock", "power", "temperature", "utilization", "throttle"]
+
+    def sample(self):
+        results = subprocess.run(["nvidia-smi", "--query-gpu=" + ",".join(self.QUERY), "--format=csv,noheader,nounits"], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        values = {}
+        for line in results.stdout.decode("utf-8").strip().split("\n"):
+            fields = [field.strip() for field in line.split(",")]
+            if len(fields) != len(self.QUERY):
+                continue
+            for metric, field in zip(self.METRICS, fields[1:]):
+                try:
+                    values["gpu" + fields[0] + "." + metric] = int(field, 16) if metric == "throttle" else float(field)
+                except ValueError:
+                    # [N/A] on GPUs that do not report it
+                    continue
+        if not values:
+            raise ValueError("no GPUs in nvidia-smi output: " + tools.check_error(results))
+        return values
+
+
+class RocmSMISource:
+    name = "rocm-smi"
+
+    def sample(self):
+        results = subprocess.run(["rocm-smi", "--showtemp", "--showpower", "--showclocks", "--showuse", "--json"], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        values = {}
+        for card, fields in json.loads(results.stdout.decode("utf-8")).items():
+            if not card.startswith("card"):
+                continue
+            gpu = "gpu" + card[4:] + "."
+            temperatures = {}
+            for key, value in fields.items():
+                number = re.search(r"[\d.]+", str(value))
+                if number is None:
+                    continue
+                if key.startswith("sclk"):
+                    values[gpu + "sm_clock"] = float(number.group())
+                elif key.startswith("mclk"):
+                    values[gpu + "mem_clock"] = float(number.group())
+                elif "Power (W)" in key:
+                    values[gpu + "power"] = float(number.group())
+                elif key.startswith("Temperature"):
+                    temperatures[key] = float(number.group())
+                elif key == "GPU use (%)":
+                    values[gpu + "utilization"] = float(number.group())
+            # junction (hotspot) temperature when reported, as nvidia-smi reports the hottest sensor
+            junction = [value for key, value in temperatures.items() if "junction" in key]
+            if junction or temperatures:
+                values[gpu + "temperature"] = max(junction or temperatures.values())
+        return values
+
+
+class CPUSource:
+    name = "cpu"
+
+    def __init__(self, root: str = "/sys/devices/system/cpu", stat: str = "/proc/stat"):
+        self.frequencies = sorted(glob.glob(os.path.join(root, "cpu[0-9]*", "cpufreq", "scaling_cur_freq")))
+        self.stat = stat
+        self.last = self.times()
+        # the average since boot until a scheduler tick has passed between two samples
+        self.utilization = (1 - self.last[1] / self.last[0]) * 100 if self.last[0] else 0.0
+
+    def times(self):
+        with open(self.stat) as file:
+            fields = [int(field) for field in file.readline().split()[1:]]
+        # idle and iowait are not busy
+        return sum(fields), fields[3] + fields[4]
+
+    def sample(self):
+        total, idle = self.times()
+        if total > self.last[0]:
+            self.utilization = (1 - (idle - self.last[1]) / (total - self.last[0])) * 100
+        self.last = (total, idle)
+        values = {"cpu.utilization": self.utilization}
+        clocks = []
+        for path in self.frequencies:
+            try:
+                with open(path) as file:
+                    clocks.append(int(file.read()) / 1000)
+            except (OSError, ValueError):
+                continue
+        if clocks:
+            values["cpu.clock"] = sum(clocks) / len(clocks)
+            values["cpu.min_clock"] = min(clocks)
+        return values
+
+
+def create_sources(names, vendor: str):
+    if names == "auto":
+        names = ["nvml", "cpu"] if vendor == "nvidia" else ["rocm-smi", "cpu"]
+    sources = []
+    for name in names:
+        try:
+            if name == "nvml":
+                try:
+                    sources.append(NVMLSource())
+                except Exception:
+                    # no pynvml or no driver, polling nvidia-smi is the fallback
+                    sources.append(NvidiaSMISource())
+            elif name == "nvidia-smi":
+                sources.append(NvidiaSMISource())
+            elif name == "rocm-smi":
+                sources.append(RocmSMISource())
+            elif name == "cpu":
+                sources.append(CPUSource())
+            else:
+                raise ValueError("unknown telemetry source " + name + ", expected nvml, nvidia-smi, rocm-smi or cpu")
+        except OSError as error:
+            print("Telemetry source " + name + " is not available: " + str(error))
+    return sources
+
+
+def mean(values: list):
+    return sum(values) / len(values) if values else None
+
+
+# SUMMARY_FIELDS over samples, a list of (seconds, {key: value})
+def summarize(samples: list):
+    def series(metric, device="gpu"):
+        return {key: [(t, values[key]) for t, values in samples if key in values] for key in sorted(set(key for _, values in samples for key in values)) if key.startswith(device) and key.endswith("." + metric)}
+
+    clocks = [value for points in series("sm_clock").values() for _, value in points]
+    temperatures = [value for points in series("temperature").values() for _, value in points]
+    throttles = [value for points in series("throttle").values() for _, value in points]
+    energy = None
+    for points in series("power").values():
+        # trapezoidal integral of the power of every GPU over the samples
+        if len(points) > 1:
+            energy = (energy or 0) + sum((b[0] - a[0]) * (a[1] + b[1]) / 2 for a, b in zip(points, points[1:]))
+    cpu = [value for points in series("clock", "cpu").values() for _, value in points]
+    summary = [
+        mean(clocks), min(clocks) if clocks else None, max(temperatures) if temperatures else None, energy,
+        sum(1 for value in throttles if int(value) & THROTTLE_MASK) / len(throttles) * 100 if throttles else None, mean(cpu),
+    ]
+    return ["" if value is None else round(value, 1) for value in summary]
+
+
+class Session:
+    def __init__(self, name: str, sources: list, interval: float, max_overhead: float, path: str):
+        self.name = name
+        self.sources = sources
+        self.interval = interval
+        self.max_overhead = max_overhead
+        self.path = path
+        self.samples = []
+        self.busy = 0.0
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.loop, daemon=True)
+        self.start = None
+        self.started = None
+        self.wall_start = None
+        self.seconds = 0.0
+        self.file = None
+        self.writer = None
+        self.keys = None
+
+    def loop(self):
+        while not self.stopped.is_set():
+            began = time.perf_counter()
+            values = {}
+            for source in list(self.sources):
+                try:
+                    values.update(source.sample())
+                except Exception as error:
+                    print("Telemetry source " + source.name + " failed, it is disabled for " + self.name + ": " + str(error))
+                    tools.write_log("telemetry source " + source.name + " failed: " + str(error))
+                    self.sources.remove(source)
+            self.record(began - self.start, values)
+            duration = time.perf_counter() - began
+            self.busy += duration
+            # the wait keeps the sampling time under max_overhead of the wall time
+            self.stopped.wait(max(self.interval - duration, duration / self.max_overhead - duration))
+
+    def record(self, seconds: float, values: dict):
+        if not values:
+            return
+        self.samples.append((seconds, values))
+        if self.writer is None:
+            self.keys = sorted(values)
+            self.writer = csv.writer(self.file, delimiter=',', quotechar='"', quoting=csv.QUOTE_MINIMAL)
+            self.writer.writerow(["Time (s)"] + self.keys)
+        self.writer.writerow([round(seconds, 2)] + ["" if key not in values else round(values[key], 1) for key in self.keys])
+        self.file.flush()
+
+    def begin(self):
+        self.file = open(self.path, "w")
+        self.start = time.perf_counter()
+        self.started = datetime.datetime.now()
+        self.wall_start = time.time()
+        self.thread.start()
+
+    def end(self):
+        self.stopped.set()
+        self.thread.join()
+        self.file.close()
+        self.seconds = time.perf_counter() - self.start
+
+    def mark(self):
+        return len(self.samples)
+
+    # SUMMARY_FIELDS over the samples since mark, the last sample before it when there are none yet
+    def window(self, mark: int):
+        samples = self.samples[mark:] or self.samples[-1:]
+        return summarize(samples)
+
+    def overhead(self):
+        return self.busy / self.seconds * 100 if self.seconds else 0.0
+
+
+# the session of the benchmark that is running, None between benchmarks
+session = None
+
+
+class Telemetry:
+    def __init__(self):
+        self.enabled = False
+        self.machine_name = None
+        self.vendor = None
+        self.interval = 1.0
+        self.max_overhead = 0.02
+        self.sources = "auto"
+
+    # reads the "Telemetry" block of config.json
+    def configure(self, path: str, machine: str, vendor: str):
+        file = open(path)
+        data = json.load(file)
+        file.close()
+        config = data.get("Telemetry", {})
+        self.enabled = config.get("enabled", True)
+        self.interval = config.get("interval", 1.0)
+        self.max_overhead = config.get("max_overhead", 0.02)
+        self.sources = config.get("sources", "auto")
+        self.machine_name = machine
+        self.vendor = vendor
+
+    # runs fn with a session sampling in the background, a benchmark started by another one shares its session
+    def run(self, name: str, fn, *args, sources: list = None, output: str = None):
+        global session
+        if (not self.enabled and sources is None) or session is not None:
+            return fn(*args)
+        output = output or os.path.join(os.getcwd(), "Outputs")
+        sources = sources if sources is not None else create_sources(self.sources, self.vendor)
+        if not sources:
+            return fn(*args)
+        current = Session(name, sources, self.interval, self.max_overhead, os.path.join(output, "Telemetry_" + name + "_" + str(self.machine_name) + ".csv"))
+        before = snapshot(output)
+        current.begin()
+        session = current
+        try:
+            return fn(*args)
+        finally:
+            session = None
+            current.end()
+            self.finish(current, output, before)
+
+    def finish(self, current: Session, output: str, before: dict):
+        summary = summarize(current.samples)
+        path = os.path.join(output, "Telemetry_Summary_" + str(self.machine_name) + ".csv")
+        new = not os.path.exists(path)
+        with open(path, "a") as csvFile:
+            writer = csv.writer(csvFile, delimiter=',', quotechar='"', quoting=csv.QUOTE_MINIMAL)
+            if new:
+                writer.writerow(SESSION_FIELDS)
+            writer.writerow([
+                current.name, current.started.strftime("%Y-%m-%d %H:%M:%S"), round(current.seconds, 1), len(current.samples),
+                round(current.seconds / len(current.samples), 2) if current.samples else "", round(current.overhead(), 3),
+            ] + summary)
+        print("Telemetry for " + current.name + ": " + str(len(current.samples)) + " samples, sampling overhead " + str(round(current.overhead(), 3)) + "%")
+        annotate(output, current.wall_start, summary, before)
+
+    # decorator for the run_<test> functions of the runners
+    def attached(self, name: str):
+        def decorate(fn):
+            def run(*args):
+                return self.run(name, fn, *args)
+            return run
+        return decorate
+
+
+# size and digest of every result CSV before a benchmark, to tell the rows it appended from the ones already there
+def snapshot(output: str):
+    files = {}
+    for path in glob.glob(os.path.join(output, "*.csv")):
+        if os.path.basename(path).startswith("Telemetry_"):
+            continue
+        with open(path, "rb") as file:
+            data = file.read()
+        files[path] = (len(data), hashlib.sha1(data).hexdigest())
+    return files
+
+
+# appends the benchmark summary to the rows of the result CSVs written during the benchmark that do not have
+# per-row telemetry already. A file the benchmark only appended to keeps its older rows as they were, padded
+# with empty columns when the summary columns are new to the file
+def annotate(output: str, since: float, summary: list, before: dict):
+    for path in glob.glob(os.path.join(output, "*.csv")):
+        if os.path.basename(path).startswith("Telemetry_") or os.path.getmtime(path) < since:
+            continue
+        with open(path, "rb") as file:
+            data = file.read()
+        size, digest = before.get(path, (0, None))
+        if digest is None or len(data) < size or hashlib.sha1(data[:size]).hexdigest() != digest:
+            size = 0
+        old = list(csv.reader(io.StringIO(data[:size].decode("utf-8", errors="replace"), newline="")))
+        rows = old + list(csv.reader(io.StringIO(data[size:].decode("utf-8", errors="replace"), newline="")))
+        if not rows:
+            continue
+        header = rows[0] if SUMMARY_FIELDS[0] in rows[0] else rows[0] + SUMMARY_FIELDS
+        annotated = [header]
+        for index, row in enumerate(rows[1:], 1):
+            if not row or len(row) >= len(header):
+                annotated.append(row)
+            elif index < len(old):
+                annotated.append(row + [""] * (len(header) - len(row)))
+            else:
+                annotated.append(row + summary)
+        if annotated == rows:
+            continue
+        with open(path, "w") as csvFile:
+            writer = csv.writer(csvFile, delimiter=',', quotechar='"', quoting=csv.QUOTE_MINIMAL)
+            for row in annotated:
+                writer.writerow(row)
+
+
+monitor = Telemetry()
@@ -1,7 +1,9 @@
 import os
+import re
 import datetime
 import subprocess
 pwd = os.getcwd() + "/Outputs/log.txt"
+SIZE_UNITS = {"": 1, "K": 1024, "M": 1024**2, "G": 1024**3, "T": 1024**4}
 
 def create_dir(name: str):
     current = os.getcwd()
@@ -23,6 +25,13 @@ def check_error(results):
         return results.stderr.decode("utf-8")
     return results.stdout.decode("utf-8")
 
+# "8", "512K", "16M", "2GB" in bytes
+def parse_size(size) -> int:
+    match = re.fullmatch(r"\s*(\d+)\s*([KMGT]?)B?\s*", str(size), re.IGNORECASE)
+    if match is None:
+        raise ValueError("invalid size " + str(size))
+    return int(match.group(1)) * SIZE_UNITS[match.group(2).upper()]
+
 def get_hostname():
     results = subprocess.run(["hostname"], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
     if results.stderr:
@@ -0,0 +1,155 @@
+import os
+import json
+
+# CPU and memory topology from sysfs, so the CPU tests size and pin themselves to the machine they run on
+# instead of one SKU's core count:
+#   cpus:    online CPUs with their physical core, socket, NUMA node and SMT siblings
+#   nodes:   NUMA nodes with their CPUs, memory and SLIT distance to every node, nodes without CPUs (e.g. GPU
+#            memory on Grace) included
+#   caches:  every distinct cache, with the CPUs that share it
+CPU_ROOT = "/sys/devices/system/cpu"
+NODE_ROOT = "/sys/devices/system/node"
+
+SIZE_UNITS = {"K": 1024, "M": 1024**2, "G": 1024**3}
+
+
+def read(path: str, default=None):
+    try:
+        with open(path) as file:
+            return file.read().strip()
+    except OSError:
+        return default
+
+
+# "0-3,8,10-11" -> [0, 1, 2, 3, 8, 10, 11]
+def parse_cpulist(text: str):
+    cpus = []
+    for part in (text or "").split(","):
+        part = part.strip()
+        if not part:
+            continue
+        if "-" in part:
+            start, end = part.split("-")
+            cpus += list(range(int(start), int(end) + 1))
+        else:
+            cpus.append(int(part))
+    return cpus
+
+
+def format_cpulist(cpus: list):
+    ranges = []
+    for cpu in sorted(cpus):
+        if ranges and cpu == ranges[-1][1] + 1:
+            ranges[-1][1] = cpu
+        else:
+            ranges.append([cpu, cpu])
+    return ",".join(str(a) if a == b else str(a) + "-" + str(b) for a, b in ranges)
+
+
+def parse_size(text: str):
+    if not text:
+        return 0
+    unit = text[-1].upper()
+    if unit in SIZE_UNITS:
+        return int(text[:-1]) * SIZE_UNITS[unit]
+    return int(text)
+
+
+def discover(cpu_root: str = CPU_ROOT, node_root: str = NODE_ROOT):
+    online = parse_cpulist(read(os.path.join(cpu_root, "online"), "0"))
+
+    nodes = []
+    node_of = {}
+    for name in sorted(os.listdir(node_root) if os.path.isdir(node_root) else [], key=lambda name: int(name[4:]) if name[4:].isdigit() else -1):
+        if not name.startswith("node") or not name[4:].isdigit():
+            continue
+        node = int(name[4:])
+        cpus = [cpu for cpu in parse_cpulist(read(os.path.join(node_root, name, "cpulist"), "")) if cpu in online]
+        memory = 0
+        for line in (read(os.path.join(node_root, name, "meminfo"), "") or "").split("\n"):
+            if "MemTotal:" in line:
+                memory = int(line.split()[-2]) * 1024
+        distances = [int(distance) for distance in (read(os.path.join(node_root, name, "distance"), "") or "").split()]
+        nodes.append({"node": node, "cpus": cpus, "memory": memory, "distance": distances})
+        for cpu in cpus:
+            node_of[cpu] = node
+    if not nodes:
+        # no NUMA support in the kernel, everything is node 0
+        nodes = [{"node": 0, "cpus": online, "memory": 0, "distance": [10]}]
+        node_of = {cpu: 0 for cpu in online}
+    # the distance file lists the nodes in order
+    for node in nodes:
+        node["distance"] = dict(zip([other["node"] for other in nodes], node["distance"]))
+
+    cpus = []
+    caches = {}
+    for cpu in online:
+        path = os.path.join(cpu_root, "cpu" + str(cpu))
+        siblings = parse_cpulist(read(os.path.join(path, "topology", "thread_siblings_list"), str(cpu)))
+        cpus.append({
+            "cpu": cpu,
+            "core": int(read(os.path.join(path, "topology", "core_id"), cpu)),
+            "socket": int(read(os.path.join(path, "topology", "physical_package_id"), 0)),
+            "node": node_of.get(cpu, 0),
+            "siblings": siblings,
+        })
+        cache_root = os.path.join(path, "cache")
+        for index in sorted(os.listdir(cache_root)) if os.path.isdir(cache_root) else []:
+            if not index.startswith("index"):
+                continue
+            shared = read(os.path.join(cache_root, index, "shared_cpu_list"), str(cpu))
+            level = int(read(os.path.join(cache_root, index, "level"), 0))
+            kind = read(os.path.join(cache_root, index, "type"), "Unified")
+            key = (level, kind, shared)
+            if key not in caches:
+                caches[key] = {"level": level, "type": kind, "size": parse_size(read(os.path.join(cache_root, index, "size"), "0")), "cpus": shared}
+
+    return {
+        "sockets": len(set(cpu["socket"] for cpu in cpus)),
+        "cores": len(set(tuple(cpu["siblings"]) for cpu in cpus)),
+        "threads": len(cpus),
+        "threads_per_core": max((len(cpu["siblings"]) for cpu in cpus), default=1),
+        "nodes": nodes,
+        "cpus": cpus,
+        "caches": sorted(caches.values(), key=lambda cache: (cache["level"], cache["type"], parse_cpulist(cache["cpus"])[:1])),
+    }
+
+
+# one hardware thread per physical core, the lowest numbered sibling, optionally only on one NUMA node
+def primary_threads(topology: dict, node: int = None):
+    return [cpu["cpu"] for cpu in topology["cpus"] if cpu["cpu"] == min(cpu["siblings"]) and (node is None or cpu["node"] == node)]
+
+
+# NUMA nodes with CPUs, and nodes with memory (CPU-less memory nodes included)
+def cpu_nodes(topology: dict):
+    return [node["node"] for node in topology["nodes"] if node["cpus"]]
+
+
+def memory_nodes(topology: dict):
+    return [node["node"] for node in topology["nodes"] if node["memory"] > 0 or node["cpus"]]
+
+
+# the candidate node nearest to node by its SLIT distance, the lowest numbered one when the distance is unknown
+def nearest(topology: dict, node: int, candidates: list):
+    distances = next(entry["distance"] for entry in topology["nodes"] if entry["node"] == node)
+    return min(candidates, key=lambda candidate: (distances.get(candidate, float("inf")), candidate))
+
+
+# total size of the last level cache of the machine, in bytes
+def last_level_cache(topology: dict):
+    data = [cache for cache in topology["caches"] if cache["type"] != "Instruction"]
+    if not data:
+        return 0
+    level = max(cache["level"] for cache in data)
+    return sum(cache["size"] for cache in data if cache["level"] == level)
+
+
+def summary(topology: dict):
+    llc = last_level_cache(topology)
+    return (str(topology["sockets"]) + " sockets, " + str(len(topology["nodes"])) + " NUMA nodes, " + str(topology["cores"]) + " cores, "
+            + str(topology["threads"]) + " threads (SMT " + str(topology["threads_per_core"]) + "), last level cache " + str(llc // 1024**2) + " MiB")
+
+
+def save(topology: dict, path: str):
+    with open(path, "w") as file:
+        json.dump(topology, file, indent=4)
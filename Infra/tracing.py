@@ -0,0 +1,224 @@
+import os
+import csv
+import json
+import time
+import atexit
+import resource
+import inspect
+import threading
+import subprocess
+import functools
+from prettytable import PrettyTable
+
+# nested spans of what the runner spends its time on (tests, benchmark methods, build steps, subprocesses,
+# sleeps between runs), with wall and CPU time, written in the Chrome trace event format that chrome://tracing
+# and https://ui.perfetto.dev open:
+#   Outputs/Trace_<hostname>.json          every span longer than min_duration, one track per thread
+#   Outputs/Trace_Summary_<hostname>.csv   every span name by self time (its time minus its children's)
+# and the top time sinks are printed when the runner exits.
+#
+# Spans come from:
+#   span(name, category)       a context manager around any block, its args dict takes extra fields
+#   traced(name)               a decorator, used on the run_<test> functions of the runners
+#   instrument(*classes)       every method of the benchmark classes
+#   install()                  subprocess.run (exit code, bytes of output, CPU time of the child) and time.sleep,
+#                              inside the spans above
+#
+# config["Tracing"] = {"enabled": true, "min_duration": 0.001}
+
+SUMMARY_FIELDS = ["Category", "Name", "Count", "Total (s)", "Self (s)", "CPU (s)", "Self (% of wall)"]
+# programs named after their subcommand in span names, e.g. "git clone", "apt update"
+SUBCOMMANDS = ["git", "apt", "apt-get", "docker", "pip", "pip3", "conda", "python", "python3"]
+
+
+# span name of a command: the program, with its subcommand for the tools in SUBCOMMANDS
+def command_name(cmd):
+    words = cmd.split() if isinstance(cmd, str) else [str(word) for word in cmd]
+    while words and (words[0] == "sudo" or "=" in words[0]):
+        words = words[1:]
+    if not words:
+        return "subprocess"
+    name = os.path.basename(words[0])
+    if name in SUBCOMMANDS:
+        arguments = [word for word in words[1:] if not word.startswith("-")]
+        if arguments:
+            name += " " + os.path.basename(arguments[0])
+    return name
+
+
+def output_bytes(results):
+    return sum(len(output) for output in [getattr(results, "stdout", None), getattr(results, "stderr", None)] if output is not None)
+
+
+class Tracer:
+    def __init__(self):
+        self.enabled = False
+        self.min_duration = 0.001
+        self.events = []
+        self.totals = {}
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.start = time.perf_counter()
+        self.pid = os.getpid()
+        self.threads = {}
+        self.path = None
+        self.summary_path = None
+        self.installed = False
+
+    # reads the "Tracing" block of config.json, and writes the trace and the summary when the runner exits
+    def configure(self, path: str, machine: str):
+        file = open(path)
+        data = json.load(file)
+        file.close()
+        config = data.get("Tracing", {})
+        self.enabled = config.get("enabled", True)
+        self.min_duration = config.get("min_duration", 0.001)
+        output = os.path.join(os.getcwd(), "Outputs")
+        self.path = os.path.join(output, "Trace_" + machine + ".json")
+        self.summary_path = os.path.join(output, "Trace_Summary_" + machine + ".csv")
+        if self.enabled:
+            self.start = time.perf_counter()
+            self.install()
+            atexit.register(self.finish)
+
+    def stack(self):
+        if not hasattr(self.local, "stack"):
+            self.local.stack = []
+            self.threads[threading.get_ident()] = threading.current_thread().name
+        return self.local.stack
+
+    # whether the calling thread is inside a span
+    def active(self):
+        return self.enabled and bool(getattr(self.local, "stack", None))
+
+    def span(self, name: str, category: str = "phase", **args):
+        return Span(self, name, category, args)
+
+    def record(self, span):
+        duration = span.end - span.begin
+        with self.lock:
+            total = self.totals.setdefault((span.category, span.name), [0, 0.0, 0.0, 0.0])
+            total[0] += 1
+            total[1] += duration
+            total[2] += duration - span.children
+            total[3] += span.cpu
+            if duration >= self.min_duration:
+                args = dict(span.args, cpu_ms=round(span.cpu * 1000, 3))
+                self.events.append({
+                    "name": span.name, "cat": span.category, "ph": "X", "pid": self.pid, "tid": span.thread,
+                    "ts": round((span.begin - self.start) * 1e6, 1), "dur": round(duration * 1e6, 1), "args": args,
+                })
+
+    def traced(self, name: str, category: str = "test"):
+        def decorate(fn):
+            @functools.wraps(fn)
+            def run(*args, **kwargs):
+                if not self.enabled:
+                    return fn(*args, **kwargs)
+                with self.span(name, category):
+                    return fn(*args, **kwargs)
+            return run
+        return decorate
+
+    # wraps every method defined on the classes in a span named <class>.<method>
+    def instrument(self, *classes):
+        for cls in classes:
+            for name, method in list(vars(cls).items()):
+                if inspect.isfunction(method) and not name.startswith("__"):
+                    setattr(cls, name, self.traced(cls.__name__ + "." + name, "method")(method))
+
+    # subprocess.run and time.sleep are replaced by traced versions, for the subprocesses and sleeps of every
+    # module without changing their call sites. Only calls inside an open span are traced, so background threads
+    # (the telemetry sampler polling nvidia-smi) and code outside the tests add no spans
+    def install(self):
+        if self.installed:
+            return
+        self.installed = True
+        run = subprocess.run
+        sleep = time.sleep
+
+        @functools.wraps(run)
+        def traced_run(*args, **kwargs):
+            if not self.active():
+                return run(*args, **kwargs)
+            cmd = args[0] if args else kwargs.get("args", "")
+            before = resource.getrusage(resource.RUSAGE_CHILDREN)
+            with self.span(command_name(cmd), "subprocess", cmd=cmd if isinstance(cmd, str) else " ".join(str(word) for word in cmd)) as span:
+                results = run(*args, **kwargs)
+                after = resource.getrusage(resource.RUSAGE_CHILDREN)
+                span.args["returncode"] = results.returncode
+                span.args["output_bytes"] = output_bytes(results)
+                # CPU time of the children that finished meanwhile, concurrent builds add to each other
+                span.args["child_cpu_ms"] = round((after.ru_utime + after.ru_stime - before.ru_utime - before.ru_stime) * 1000, 1)
+            return results
+
+        @functools.wraps(sleep)
+        def traced_sleep(seconds):
+            if not self.active():
+                return sleep(seconds)
+            with self.span("sleep", "wait", seconds=seconds):
+                sleep(seconds)
+
+        subprocess.run = traced_run
+        time.sleep = traced_sleep
+
+    def rows(self):
+        wall = time.perf_counter() - self.start
+        rows = []
+        for (category, name), (count, total, own, cpu) in sorted(self.totals.items(), key=lambda item: -item[1][2]):
+            rows.append([category, name, count, round(total, 3), round(own, 3), round(cpu, 3), round(own / wall * 100, 2) if wall else 0.0])
+        return rows
+
+    def finish(self, top: int = 15):
+        if not self.enabled or not self.totals:
+            return
+        metadata = [{"name": "thread_name", "ph": "M", "pid": self.pid, "tid": thread, "args": {"name": name}} for thread, name in self.threads.items()]
+        with open(self.path, "w") as file:
+            json.dump({"traceEvents": metadata + self.events, "displayTimeUnit": "ms"}, file)
+        rows = self.rows()
+        with open(self.summary_path, "w") as csvFile:
+            writer = csv.writer(csvFile, delimiter=',', quotechar='"', quoting=csv.QUOTE_MINIMAL)
+            writer.writerow(SUMMARY_FIELDS)
+            for row in rows:
+                writer.writerow(row)
+
+        table1 = PrettyTable()
+        table1.field_names = SUMMARY_FIELDS
+        for row in rows[:top]:
+            table1.add_row(row)
+        print("Top time sinks of the run, by self time (trace in " + self.path + "):")
+        print(table1)
+
+
+class Span:
+    def __init__(self, tracer: Tracer, name: str, category: str, args: dict):
+        self.tracer = tracer
+        self.name = name
+        self.category = category
+        self.args = args
+        self.children = 0.0
+
+    def __enter__(self):
+        if self.tracer.enabled:
+            self.thread = threading.get_ident()
+            self.tracer.stack().append(self)
+            self.begin = time.perf_counter()
+            self.cpu_begin = time.thread_time()
+        return self
+
+    def __exit__(self, kind, error, traceback):
+        if not self.tracer.enabled:
+            return False
+        self.end = time.perf_counter()
+        self.cpu = time.thread_time() - self.cpu_begin
+        stack = self.tracer.stack()
+        stack.pop()
+        if stack:
+            stack[-1].children += self.end - self.begin
+        if kind is not None:
+            self.args["error"] = kind.__name__
+        self.tracer.record(self)
+        return False
+
+
+tracer = Tracer()
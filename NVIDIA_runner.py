@@ -1,29 +1,33 @@
 import os
 import sys
 import subprocess
-import torch
-
-from Benchmarks.NVIDIA import GEMMCublasLt as gemm
-from Benchmarks.NVIDIA import HBMBandwidth as HBM
-from Benchmarks.NVIDIA import NVBandwidth as NV
-from Benchmarks.NVIDIA import NCCLBandwidth as NCCL
-from Benchmarks.NVIDIA import FlashAttention as FA
-from Benchmarks.NVIDIA import FIO
-from Benchmarks.NVIDIA import CPUStream as CPU
-from Benchmarks.NVIDIA import Multichase as Multichase
-from Benchmarks.NVIDIA import LLMBenchmark as llmb
+from importlib import metadata
+
 from Infra import tools
+from Infra import build_scheduler
+from Infra import telemetry
+from Infra import tracing
+from Infra import manifest
+from Infra import registry
 
 
 host_name = tools.get_hostname()
 current = os.getcwd()
 tools.create_dir("Outputs")
+# the benchmarks are imported only when they are selected, see Infra/registry.py
+tests = registry.Registry("nvidia")
 
 def get_system_specs():
     file = open("Outputs/system_specs.txt", "w")
 
-    results = subprocess.run(["nvidia-smi", "--query-gpu=gpu_name,vbios_version,driver_version,memory.total", "--format=csv"], stdout=subprocess.PIPE,stderr=subprocess.PIPE)
-    output = results.stdout.decode('utf-8').split('\n')[1].split(",")
+    try:
+        results = subprocess.run(["nvidia-smi", "--query-gpu=gpu_name,vbios_version,driver_version,memory.total", "--format=csv"], stdout=subprocess.PIPE,stderr=subprocess.PIPE)
+        output = results.stdout.decode('utf-8').split('\n')[1].split(",")
+    except (OSError, IndexError):
+        # CPU-only node, only the host side tests (e.g. gloo) can run
+        file.write("GPU name     : none\n")
+        file.close()
+        return "CPU"
     file.write("GPU name     : "+ output[0]+"\n")
     file.write("VBIOS    : "+ output[1]+"\n")
     file.write("driver version   : "+ output[2]+"\n")
@@ -37,128 +41,204 @@ def get_system_specs():
         results = subprocess.run("lsb_release -a | grep Release", shell=True, stdout=subprocess.PIPE,stderr=subprocess.PIPE)
         ubuntu = results.stdout.decode('utf-8').strip().split("\t")[1]
         file.write("ubuntu version   : "+ubuntu+"\n")
-        file.write("pytorch version  : {torch.__version__}\n")
+        try:
+            file.write("pytorch version  : " + metadata.version("torch") + "\n")
+        except metadata.PackageNotFoundError:
+            file.write("pytorch version  : none\n")
 
     file.close()
     return output[0].strip()
 
-def run_CublasLt():
+# builds the test serially, or waits for its steps when the whole suite is built by the scheduler
+def build(test, scheduler=None):
+    if scheduler is None:
+        test.build()
+        return True
+    if not scheduler.wait(test.name):
+        print(test.name + " build failed, skipping. See Outputs/log.txt for details")
+        manifest.runs.fail(test.name, "build failed")
+        return False
+    return True
+
+@tests.benchmark("gemm", "GEMMCublasLt", "Benchmarks.NVIDIA.GEMMCublasLt", usage=[
+    ("CuBLASLt GEMM", "gemm"), ("CuBLASLt GEMM M/N/K sweep", "gemm sweep"), ("CuBLASLt GEMM soak", "gemm soak"),
+    ("Run on every GPU at once", "gemm pergpu, hbm pergpu, fa pergpu"),
+])
+def run_CublasLt(gemm, scheduler=None):
     test = gemm.GEMMCublastLt("config.json",host_name) 
-    test.build()
-    test.run_model_sizes()
-   
-def run_HBMBandwidth():
+    if not build(test, scheduler):
+        return
+    if "sweep" in arguments:
+        test.run_sweep()
+    elif "soak" in arguments:
+        test.run_soak()
+    elif "pergpu" in arguments:
+        test.run_pergpu()
+    else:
+        test.run_model_sizes()
+
+@tests.benchmark("nccl", "NCCLBandwidth", "Benchmarks.NVIDIA.NCCLBandwidth", requires=["numpy"], usage=[
+    ("NCCL Bandwidth", "nccl"), ("NCCL across the nodes of the hostfile", "nccl multinode, nccl bisect"),
+])
+def run_NCCLBandwidth(NCCL, scheduler=None):
+    test = NCCL.NCCLBandwidth("config.json", host_name)
+    if not build(test, scheduler):
+        return
+    if "multinode" in arguments:
+        test.run_multinode()
+    elif "bisect" in arguments:
+        test.run_bisect()
+    else:
+        test.run()
+
+@tests.benchmark("hbm", "HBMBandwidth", "Benchmarks.NVIDIA.HBMBandwidth", usage=[("HBMBandwidth", "hbm")])
+def run_HBMBandwidth(HBM, scheduler=None):
     if "GB200" in sku_name:
         print("HBM bandwidth Test not supported on GB200 yet")
         return
     test = HBM.HBMBandwidth("config.json", host_name)
-    test.build()
-    test.run()
+    if not build(test, scheduler):
+        return
+    if "pergpu" in arguments:
+        test.run_pergpu()
+    else:
+        test.run()
 
-def run_NVBandwidth():
+@tests.benchmark("nv", "NVBandwidth", "Benchmarks.NVIDIA.NVBandwidth", usage=[("NV Bandwidth", "nv")])
+def run_NVBandwidth(NV, scheduler=None):
     test = NV.NVBandwidth("config.json", host_name)
-    test.build()
-    test.run()
+    if build(test, scheduler):
+        test.run()
 
-def run_NCCLBandwidth():
-    test = NCCL.NCCLBandwidth("config.json", host_name)
-    test.build()
-    test.run()
-
-def run_FlashAttention():
+@tests.benchmark("fa", "FlashAttention", "Benchmarks.NVIDIA.FlashAttention", usage=[("Flash Attention", "fa")])
+def run_FlashAttention(FA, scheduler=None):
     test = FA.FlashAttention("config.json", host_name)
-    test.run()
-
-def run_Multichase():
+    if not build(test, scheduler):
+        return
+    if "pergpu" in arguments:
+        test.run_pergpu()
+    else:
+        test.run()
+
+@tests.benchmark("multichase", "Multichase", "Benchmarks.NVIDIA.Multichase", usage=[
+    ("Multichase", "multichase"), ("Multichase latency under load", "multichase loaded"),
+])
+def run_Multichase(Multichase, scheduler=None):
     test = Multichase.Multichase("config.json", host_name)
-    test.build()
-    test.run()
-
-def run_CPUStream():
+    if not build(test, scheduler):
+        return
+    if "loaded" in arguments:
+        test.run_loaded()
+    else:
+        test.run()
+
+@tests.benchmark("cpustream", "CPUStream", "Benchmarks.NVIDIA.CPUStream", usage=[
+    ("CPU Stream", "cpustream"), ("CPU Stream thread and array size scaling", "cpustream scaling"),
+])
+def run_CPUStream(CPU, scheduler=None):
     test = CPU.CPUStream("config.json", host_name)
-    test.build()
-    test.run()
-    
-def run_FIO():
+    if not build(test, scheduler):
+        return
+    if "scaling" in arguments:
+        test.run_scaling()
+    else:
+        test.run()
+
+@tests.benchmark("fio", "FIO", "Benchmarks.NVIDIA.FIO", usage=[
+    ("FIO Tests", "fio"), ("FIO quick profile", "fio quick"), ("FIO NVMe device scaling", "fio scaling"),
+])
+def run_FIO(FIO):
     test = FIO.FIO("config.json", host_name)
-    test.run()
-    
-def run_LLMBenchmark():
+    profile = "quick" if "quick" in arguments else "full"
+    if "scaling" in arguments:
+        test.run_scaling(profile)
+    else:
+        test.run(profile)
+
+@tests.benchmark("llm", "LLMBenchmark", "Benchmarks.NVIDIA.LLMBenchmark", requires=["huggingface_hub"], usage=[("LLM Inference Workloads", "llm")])
+def run_LLMBenchmark(llmb, scheduler=None):
     test = llmb.LLMBenchmark("config.json", current, host_name)
-    test.install_requirements()
+    if scheduler is None:
+        test.install_requirements()
+    elif not build(test, scheduler):
+        return
     test.prepare_datasets()
     test.download_models()
     test.run_benchmark()
 
-sku_name = get_system_specs()
+@tests.benchmark("gloo", "GlooBandwidth", "Benchmarks.NVIDIA.GlooBandwidth", requires=["numpy", "torch"], usage=[("Gloo CPU collectives", "gloo")])
+def run_GlooBandwidth(Gloo):
+    test = Gloo.GlooBandwidth("config.json", host_name)
+    test.run()
+
+@tests.benchmark("checkpoint", "CheckpointLoad", "Benchmarks.NVIDIA.CheckpointLoad", usage=[("Checkpoint load throughput", "checkpoint")])
+def run_CheckpointLoad(CheckpointLoad):
+    test = CheckpointLoad.CheckpointLoad("config.json", host_name)
+    test.run()
+
+# declares the build steps of every test up front so clones and compiles overlap with each other
+# and with the tests that are already running
+def build_all():
+    tests_to_build = {
+        "GEMMCublasLt": lambda gemm: gemm.GEMMCublastLt("config.json", host_name),
+        "NCCLBandwidth": lambda NCCL: NCCL.NCCLBandwidth("config.json", host_name),
+        "Multichase": lambda Multichase: Multichase.Multichase("config.json", host_name),
+        "CPUStream": lambda CPU: CPU.CPUStream("config.json", host_name),
+        "NVBandwidth": lambda NV: NV.NVBandwidth("config.json", host_name),
+        "FlashAttention": lambda FA: FA.FlashAttention("config.json", host_name),
+        "LLMBenchmark": lambda llmb: llmb.LLMBenchmark("config.json", current, host_name),
+    }
+    if "GB200" not in sku_name:
+        tests_to_build["HBMBandwidth"] = lambda HBM: HBM.HBMBandwidth("config.json", host_name)
+
+    scheduler = build_scheduler.BuildScheduler()
+    for name, create in tests_to_build.items():
+        # tests already done in the resumed run, or missing a package, are not built
+        if not manifest.runs.done(name) and not tests.missing(name):
+            scheduler.add(name, create(tests.load(name)).build_steps())
+    scheduler.start()
+    return scheduler
+
 arguments = []
-match = False
 for arg in sys.argv:
     arguments.append(arg.lower())
+if "--import-only" in arguments:
+    tests.import_only(arguments)
+    sys.exit(0)
 
-if ("gemm" in arguments):
-    match = True
-    run_CublasLt()
-    os.chdir(current)
-    
-if ("nccl" in arguments):
-    match = True
-    run_NCCLBandwidth()
-    os.chdir(current)
-    
-if ("hbm" in arguments):
-    match = True
-    run_HBMBandwidth()
-    os.chdir(current)
-    
-if ("nv" in arguments):
-    match = True
-    run_NVBandwidth()
-    os.chdir(current)
-    
-if ("fa"  in arguments):
-    match = True
-    run_FlashAttention()
-    os.chdir(current)
+sku_name = get_system_specs()
+# GPU and CPU telemetry is sampled in the background while each test runs
+telemetry.monitor.configure("config.json", host_name, "nvidia")
+# spans of every test, benchmark method, build step, subprocess and sleep, written to Outputs/Trace_<hostname>.json at exit
+tracing.tracer.configure("config.json", host_name)
+# a new run manifest, or the arguments of the run to resume with --resume <run id>
+arguments = manifest.runs.configure(arguments, host_name)
 
-if ("multichase" in arguments):
-    match = True
-    run_Multichase()
-    os.chdir(current)
+match = tests.run(arguments, current)
 
-if ("cpustream" in arguments):
-    match = True
-    run_CPUStream()
-    os.chdir(current)
-    
-if ("fio" in arguments):
-    match = True
-    run_FIO()
-    os.chdir(current)
-    
-if ("llm" in arguments):
-    match = True
-    run_LLMBenchmark()
-    os.chdir(current)
-    
 if ("all" in arguments):
     match = True
-    run_CublasLt()
+    manifest.runs.plan(["GEMMCublasLt", "NCCLBandwidth", "Multichase", "CPUStream", "HBMBandwidth", "NVBandwidth", "FlashAttention", "FIO", "LLMBenchmark"])
+    scheduler = build_all()
+    run_CublasLt(scheduler)
     os.chdir(current)
-    run_NCCLBandwidth()
+    run_NCCLBandwidth(scheduler)
     os.chdir(current)
-    run_Multichase()
+    # Multichase, CPUStream and HBM measure latency and bandwidth that make -j in the background would skew
+    scheduler.drain()
+    run_Multichase(scheduler)
     os.chdir(current)
-    run_CPUStream()
+    run_CPUStream(scheduler)
     os.chdir(current)
-    run_HBMBandwidth()
+    run_HBMBandwidth(scheduler)
     os.chdir(current)
-    run_NVBandwidth()
+    run_NVBandwidth(scheduler)
     os.chdir(current)
-    run_FlashAttention()
+    run_FlashAttention(scheduler)
     os.chdir(current)
     run_FIO()
-    run_LLMBenchmark()
-if not match: 
-    print("Usage: python3 NVIDIA_runner.py [arg]\n   or: python3 NVIDIA_runner.py [arg1] [arg2] ... to run more than one test e.g python3 NVIDIA_runner.py hbm nccl\nArguments are as follows, and are case insensitive:\nAll tests:  all\nCuBLASLt GEMM:  gemm\nNCCL Bandwidth: nccl\nHBMBandwidth:   hbm\nNV Bandwidth:   nv\nFlash Attention: fa\nFIO Tests:   fio\nLLM Inference Workloads: llm\nCPU Stream: cpustream\nMultichase:  multichase")
-    
+    run_LLMBenchmark(scheduler)
+    scheduler.shutdown()
+    scheduler.report("Outputs/BuildTimings_" + host_name + ".csv")
+if not match:
+    print(tests.usage("NVIDIA_runner.py"))